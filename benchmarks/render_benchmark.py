@@ -0,0 +1,57 @@
+# Per-payslip render latency: cold path (new Jinja2 environment, template parse,
+# stylesheet parse and font configuration on every call, as generate_salary_pdf
+# used to do) against the warm process-lifetime SalaryRenderContext.
+#
+#   cd src && python ../benchmarks/render_benchmark.py [iterations]
+import os
+import sys
+import time
+from io import BytesIO
+from jinja2 import Environment, FileSystemLoader
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from services.payslip_renderer import TEMPLATES_DIR, TEMPLATE_NAME, STYLESHEET_NAME, SalaryRenderContext
+
+
+def get_salary_data():
+    lines = "<br>".join(f"In Monday 2024-09-{day:02d} has 1 spiffs" for day in range(1, 31))
+    return {
+        "name": "John Doe", "position": "Developer", "tier_type": "A", "is_onsite": True, "has_insurance": True,
+        "is_appointment_serrer": True, "is_full_time": True, "month": "09", "month_name": "September", "year": "2024",
+        "basic_salary": 3000, "basic_salary_deduction_absent": 100, "basic_salary_deduction_missing_hours": 50,
+        "final_salary": 2850, "no_show_days": "", "missing_hours": "", "saturdays": "", "overpay_summary": 120,
+        "additional_hours": "", "additional_hours_value": 40, "kpis_score": lines, "kpis_total": 40,
+        "spiffs_logs": lines, "spiffs_total": 280, "transportation_allowance": "30 Days * 50 EGP = 1500",
+        "deductions_info": "", "deductions": 0, "butter_up": 80, "total_salary": 4930,
+    }
+
+
+def render_cold(salary_data):
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+    html_content = env.get_template(TEMPLATE_NAME).render(**salary_data)
+    font_config = FontConfiguration()
+    stylesheet = CSS(filename=os.path.join(TEMPLATES_DIR, STYLESHEET_NAME), font_config=font_config)
+    pdf_io = BytesIO()
+    HTML(string=html_content).write_pdf(pdf_io, stylesheets=[stylesheet], font_config=font_config)
+    return pdf_io.getvalue()
+
+
+def bench(name, render, salary_data, iterations):
+    render(salary_data)  # first call pays one-off imports and font discovery
+    started = time.perf_counter()
+    for _ in range(iterations):
+        render(salary_data)
+    per_render = (time.perf_counter() - started) / iterations * 1000
+    print(f"{name:<6} {per_render:8.2f} ms/payslip")
+    return per_render
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    salary_data = get_salary_data()
+    context = SalaryRenderContext()
+    cold = bench("cold", render_cold, salary_data, iterations)
+    warm = bench("warm", context.render_pdf, salary_data, iterations)
+    print(f"speedup {cold / warm:.2f}x over {iterations} renders")
@@ -29,6 +29,9 @@ employee_collection = database["employees"]
 daily_report_collection = database["daily_reports"]
 user_collection = database["users"]
 static_values_collection = database["static_values"]
+monthly_rollup_collection = database["monthly_rollups"]
+daily_report_bucket_collection = database["daily_report_buckets"]
+cache_version_collection = database["cache_versions"]
 
 # Function to initialize beanie with the database and models
 async def init_db():
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from config.database.database import daily_report_collection, employee_collection, user_collection, static_values_collection, monthly_rollup_collection, daily_report_bucket_collection
+
+
+logger = logging.getLogger(__name__)
+
+# Indexes every CRUD lookup relies on, declared per collection.
+REQUIRED_INDEXES = [
+    (daily_report_collection, [
+        IndexModel([("employee_id", ASCENDING), ("date", ASCENDING)], unique=True),
+        IndexModel([("date", ASCENDING), ("employee_id", ASCENDING)]),
+    ]),
+    (employee_collection, [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # listing pages: a company's employees and the sort orders, id last for the keyset
+        IndexModel([("company_id", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("company_id", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("name", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("start_date", ASCENDING), ("id", ASCENDING)]),
+    ]),
+    (user_collection, [
+        IndexModel([("email", ASCENDING)], unique=True),
+    ]),
+    (static_values_collection, [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("effective_from", ASCENDING), ("effective_to", ASCENDING)]),
+    ]),
+    (monthly_rollup_collection, [
+        IndexModel([("year", ASCENDING), ("month", ASCENDING), ("employee_id", ASCENDING)], unique=True),
+    ]),
+    (daily_report_bucket_collection, [
+        IndexModel([("employee_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING)], unique=True),
+    ]),
+]
+
+
+def _spec(key, unique) -> tuple:
+    return [tuple(field) for field in key], bool(unique)
+
+
+# compare the declared indexes with the ones the collection actually has
+def index_drift(index_information:dict, indexes:List[IndexModel]) -> Dict[str, list]:
+    drift = {"missing": [], "mismatched": [], "unexpected": []}
+    declared = {index.document["name"]: index.document for index in indexes}
+    for name, document in declared.items():
+        if name not in index_information:
+            drift["missing"].append(name)
+        elif _spec(index_information[name]["key"], index_information[name].get("unique")) != _spec(document["key"].items(), document.get("unique")):
+            drift["mismatched"].append(name)
+    drift["unexpected"] = [name for name in index_information if name != "_id_" and name not in declared]
+    return drift
+
+
+# Create the missing indexes and report what still differs from the declaration.
+# Mismatched and unexpected indexes are only reported, dropping an index is left to a human.
+async def ensure_indexes() -> Dict[str, Dict[str, list]]:
+    report = {}
+    for collection, indexes in REQUIRED_INDEXES:
+        if os.getenv("TESTING") == "True":
+            index_information = collection.index_information()
+        else:
+            index_information = await collection.index_information()
+        drift = index_drift(index_information, indexes)
+
+        missing = [index for index in indexes if index.document["name"] in drift["missing"]]
+        if missing:
+            try:
+                if os.getenv("TESTING") == "True":
+                    collection.create_indexes(missing)
+                else:
+                    await collection.create_indexes(missing)
+                drift["missing"] = []
+            except OperationFailure as e:
+                # e.g. duplicates in existing data keep a unique index from being built
+                logger.error("could not create indexes on %s: %s", collection.name, e)
+
+        if any(drift.values()):
+            logger.warning("index drift on %s: %s", collection.name, drift)
+        report[collection.name] = drift
+    return report
+
+
+if __name__ == "__main__":
+    for name, drift in asyncio.run(ensure_indexes()).items():
+        print(name, drift)
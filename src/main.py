@@ -3,12 +3,21 @@ from modules.users import users_router
 from modules.employees import employees_router
 from modules.daily_reports import daily_reports_router
 from modules.static_values import static_values_router
+from modules.payroll import payroll_router
+from modules.rollups import rollups_router
 from modules.auth.authorizations import get_admin, get_superadmin
 from services import exportPdf 
+from services import events
+from services import employee_cache
+from config.database.indexes import ensure_indexes
 
 
 app = FastAPI()
 
+app.add_event_handler("startup", ensure_indexes)
+app.add_event_handler("shutdown", exportPdf.shutdown_render_pool)
+app.add_event_handler("shutdown", events.event_bus.stop)
+
 
 
 app.include_router(users_router.router)
@@ -16,6 +25,10 @@ app.include_router(employees_router.router, dependencies=[Depends(get_admin)])
 app.include_router(daily_reports_router.router, dependencies=[Depends(get_admin)])
 app.include_router(static_values_router.router, dependencies=[Depends(get_superadmin)])
 app.include_router(exportPdf.router,  dependencies=[Depends(get_admin)])
+app.include_router(payroll_router.router, dependencies=[Depends(get_admin)])
+app.include_router(rollups_router.router, dependencies=[Depends(get_admin)])
+app.include_router(events.router, dependencies=[Depends(get_admin)])
+app.include_router(employee_cache.router, dependencies=[Depends(get_admin)])
 
     
 @app.get("/")
@@ -0,0 +1,15 @@
+# Store total_salary on daily reports written before it was computed at write time.
+#
+#   cd src && python -m modules.daily_reports.backfill_total_salary [--recompute]
+import asyncio
+import sys
+from .daily_reports_crud import backfill_total_salary
+
+
+async def main(args:list):
+    updated = await backfill_total_salary(recompute="--recompute" in args)
+    print(f"stored total_salary on {updated} daily reports")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -1,19 +1,89 @@
+import base64
+import binascii
+import csv
+import io
+import json
 from fastapi import HTTPException
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from pymongo.errors import DuplicateKeyError
+from typing import AsyncIterator, List, Optional, Tuple, Union
 from datetime import datetime
-from .daily_reports_crud import create_daily_report, update_daily_report, get_daily_report, delete_daily_report, get_all_daily_reports, get_daily_reports_by_employee_and_range_date
-from shared.models_schemas.schemas import DailyReportCreate, DailyReportUpdate
+from .daily_reports_crud import create_daily_report, create_daily_reports, update_daily_reports, get_daily_reports_page, iter_daily_reports, report_filter, update_daily_report, get_daily_report, delete_daily_report, get_all_daily_reports, get_daily_reports_by_employee_and_range_date, get_team_summary, get_total_salary
+from shared.models_schemas.models import DailyReport
+from shared.models_schemas.schemas import DailyReportCreate, DailyReportUpdate, BulkIngestResponse, BulkRowError, BulkUpdateResponse, DailyReportBulkUpdate, SalaryTotalResponse, TeamSummaryResponse, TeamSummaryRow
+from shared.projection import model_columns, parse_fields
+from shared.ingest import validation_error_message
+from services.summary_cache import summary_cache
 
 
 exception_error = HTTPException(status_code=404, detail="Daily report not found")
+duplicate_error = HTTPException(status_code=409, detail="Daily report already exists for this employee and date")
+invalid_cursor_error = HTTPException(status_code=400, detail="Invalid cursor")
+
+# reports validated and written per insert_many round trip
+BULK_CHUNK_SIZE = 1000
+# documents per cursor batch and bytes per response chunk of an export
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FLUSH_BYTES = 64 * 1024
 
 async def create_daily_report_control(report:DailyReportCreate):
-    create_report = await create_daily_report(report)
+    try:
+        create_report = await create_daily_report(report)
+    except DuplicateKeyError:
+        raise duplicate_error
     return create_report
 
 
-async def get_daily_report_control(employee_id:int, report_date:datetime):
-    report = await get_daily_report(employee_id, report_date)
+async def _write_chunk(rows:List[int], reports:List[DailyReportCreate], errors:List[BulkRowError]) -> int:
+    write_errors = await create_daily_reports(reports)
+    errors.extend(BulkRowError(row=rows[index], error=error) for index, error in sorted(write_errors.items()))
+    return len(reports) - len(write_errors)
+
+
+# validate and insert the records chunk by chunk, a bad row never aborts the rest
+async def bulk_create_daily_reports_control(records:AsyncIterator[Tuple[int, Union[bytes, dict]]]) -> BulkIngestResponse:
+    received = 0
+    inserted = 0
+    errors = []
+    rows = []
+    reports = []
+    async for row, record in records:
+        received += 1
+        try:
+            if isinstance(record, bytes):
+                report = DailyReportCreate.model_validate_json(record)
+            else:
+                report = DailyReportCreate.model_validate(record)
+        except ValidationError as e:
+            errors.append(BulkRowError(row=row, error=validation_error_message(e)))
+            continue
+        rows.append(row)
+        reports.append(report)
+        if len(reports) >= BULK_CHUNK_SIZE:
+            inserted += await _write_chunk(rows, reports, errors)
+            rows, reports = [], []
+    if reports:
+        inserted += await _write_chunk(rows, reports, errors)
+    errors.sort(key=lambda error: error.row)
+    return BulkIngestResponse(received=received, inserted=inserted, errors=errors)
+
+
+# corrections in BULK_CHUNK_SIZE batches, each batch is one read and one bulk_write
+async def bulk_update_daily_reports_control(updates:List[DailyReportBulkUpdate]) -> BulkUpdateResponse:
+    response = BulkUpdateResponse(received=len(updates), matched=0, modified=0, upserted=0)
+    for start in range(0, len(updates), BULK_CHUNK_SIZE):
+        chunk = updates[start:start + BULK_CHUNK_SIZE]
+        counts, write_errors = await update_daily_reports([(update.employee_id, update.date, update.update, update.upsert) for update in chunk])
+        response.matched += counts["matched"]
+        response.modified += counts["modified"]
+        response.upserted += counts["upserted"]
+        response.errors.extend(BulkRowError(row=start + index + 1, error=error) for index, error in sorted(write_errors.items()))
+    return response
+
+
+async def get_daily_report_control(employee_id:int, report_date:datetime, fields:Optional[str] = None):
+    report = await get_daily_report(employee_id, report_date, parse_fields(fields, DailyReport))
     if not report:
         raise exception_error
     return report
@@ -34,18 +104,117 @@ async def delete_daily_report_control(employee_id:int, report_date:datetime):
     return deleted
 
 
+# the cursor is the (date, employee_id) of the last report of the previous page, kept opaque to clients
+def encode_cursor(key:Tuple[datetime, int]) -> str:
+    report_date, employee_id = key
+    return base64.urlsafe_b64encode(json.dumps([report_date.isoformat(), employee_id]).encode()).decode()
+
+
+def decode_cursor(cursor:str) -> Tuple[datetime, int]:
+    try:
+        report_date, employee_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(report_date), int(employee_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise invalid_cursor_error
+
+
+async def get_daily_reports_page_control(limit:int, cursor:Optional[str] = None, employee_id:Optional[int] = None,
+                                         start_date:Optional[datetime] = None, end_date:Optional[datetime] = None,
+                                         fields:Optional[str] = None) -> Tuple[list, Optional[str]]:
+    projection = parse_fields(fields, DailyReport)
+    after = decode_cursor(cursor) if cursor else None
+    reports, last_key = await get_daily_reports_page(limit, after, employee_id, start_date, end_date, projection)
+    return reports, encode_cursor(last_key) if last_key else None
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _flatten(document:dict, prefix:str = "") -> dict:
+    flat = {}
+    for key, value in document.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value.isoformat() if isinstance(value, datetime) else value
+    return flat
+
+
+async def iter_ndjson_lines(reports:AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for report in reports:
+        yield json.dumps(report, default=_export_value) + "\n"
+
+
+# nested documents become dotted columns, the header is the given columns whatever the reports hold:
+# a field a report lacks is left empty, one outside the columns is left out
+async def iter_csv_lines(reports:AsyncIterator[dict], columns:List[str]) -> AsyncIterator[str]:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=columns, extrasaction="ignore", restval="")
+    writer.writeheader()
+    async for report in reports:
+        writer.writerow(_flatten(report))
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+
+
+# the first line goes out right away, the rest in EXPORT_FLUSH_BYTES chunks
+async def iter_export_chunks(lines:AsyncIterator[str]) -> AsyncIterator[bytes]:
+    buffer = []
+    size = 0
+    first = True
+    async for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if first or size >= EXPORT_FLUSH_BYTES:
+            yield "".join(buffer).encode()
+            buffer.clear()
+            size = 0
+            first = False
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+async def export_daily_reports_control(format:str, fields:Optional[str] = None, employee_id:Optional[int] = None,
+                                       start_date:Optional[datetime] = None, end_date:Optional[datetime] = None) -> StreamingResponse:
+    projection = parse_fields(fields, DailyReport)
+    reports = iter_daily_reports(report_filter(employee_id, start_date, end_date), projection, EXPORT_BATCH_SIZE)
+    if format == "csv":
+        lines, media_type = iter_csv_lines(reports, model_columns(DailyReport, projection)), "text/csv"
+    else:
+        lines, media_type = iter_ndjson_lines(reports), "application/x-ndjson"
+    return StreamingResponse(
+        iter_export_chunks(lines),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="daily_reports.{format}"'},
+    )
+
+
 async def get_all_daily_reports_control():
     reports = await get_all_daily_reports()
     return reports
 
 
-async def get_daily_reports_by_employee_and_renage_date_control(employee_id:int, start_date:Optional[datetime], end_date:Optional[datetime]):
-    reports = await get_daily_reports_by_employee_and_range_date(employee_id, start_date, end_date)
+async def get_daily_reports_by_employee_and_renage_date_control(employee_id:int, start_date:Optional[datetime], end_date:Optional[datetime], fields:Optional[str] = None):
+    reports = await get_daily_reports_by_employee_and_range_date(employee_id, start_date, end_date, parse_fields(fields, DailyReport))
     return reports
 
 
-# async def get_daily_report_salary_control(employee_id:int, report_date:datetime):
-#     total_salary = await calculate_daily_report_salary(employee_id, report_date)
-#     if not total_salary:
-#         raise exception_error
-#     return total_salary
+async def get_total_salary_control(employee_id:int, start_date:datetime, end_date:datetime) -> SalaryTotalResponse:
+    totals = await get_total_salary(employee_id, start_date, end_date)
+    return SalaryTotalResponse(employee_id=employee_id, start_date=start_date, end_date=end_date, **totals)
+
+
+# served from summary_cache while no report or employee was written
+async def get_team_summary_control(start_date:datetime, end_date:datetime, company_id:Optional[int] = None, group_by:str = "employee") -> TeamSummaryResponse:
+    key = ("team_summary", start_date, end_date, company_id, group_by)
+    summary = await summary_cache.get(key)
+    if summary is None:
+        rows = await get_team_summary(start_date, end_date, company_id, by_company=group_by == "company")
+        summary = TeamSummaryResponse(start_date=start_date, end_date=end_date, company_id=company_id, group_by=group_by,
+                                      rows=[TeamSummaryRow(**row) for row in rows])
+        summary_cache.put(key, summary)
+    return summary
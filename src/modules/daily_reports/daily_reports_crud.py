@@ -1,7 +1,20 @@
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List, Dict, Tuple
 from datetime import datetime
 from shared.models_schemas.models import DailyReport
-from config.database.database import daily_report_collection
+from shared.projection import partial_model
+from shared.documents import WRITE_ID, apply_set, new_write_id
+from shared.ingest import validation_error_message
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from pydantic import ValidationError
+from config.database.database import daily_report_collection, employee_collection, static_values_collection
+from services.payslip_cache import payslip_cache
+from services.daily_salary import salary_lookups
+from services.events import DAILY_REPORT, EMPLOYEE, STATIC_VALUES, ChangeEvent, event_bus
+from services.summary_cache import summary_cache
+from modules.rollups.rollups_crud import apply_report_delta, apply_report_deltas
+from .report_buckets_crud import apply_bucket_changes, apply_bucket_salaries
+from modules.payroll.payroll_crud import monthly_totals_accumulators
 import os
 from dotenv import load_dotenv
 
@@ -12,47 +25,187 @@ load_dotenv(dotenv_path)
 
 # CRUD operations for daily_report        
 
+# the day's salary is stored with the report, computed from cached employee and static values
+async def _with_total_salary(report_dict:dict) -> dict:
+    total_salary = await salary_lookups.total_salary(report_dict)
+    if total_salary is not None:
+        report_dict["total_salary"] = total_salary
+    return report_dict
+
+def _publish_change(before:Optional[dict], after:Optional[dict]):
+    report = after or before
+    action = "update" if before and after else "create" if after else "delete"
+    event_bus.publish(DAILY_REPORT, action, (report["employee_id"], report["date"]), before, after)
+
 async def create_daily_report(report:DailyReport ) -> DailyReport:    
-    report_dict = report.model_dump()
+    report_dict = await _with_total_salary(report.model_dump())
+    report_dict[WRITE_ID] = new_write_id()
+    report.total_salary = report_dict["total_salary"]
     if os.getenv("TESTING") == "True":
         daily_report_collection.insert_one(report_dict)
     else:
         await daily_report_collection.insert_one(report_dict)
+    await apply_report_delta(None, report_dict)
+    await apply_bucket_changes([(None, report_dict)])
+    payslip_cache.invalidate_employee(report.employee_id)
+    _publish_change(None, report_dict)
     return report
 
 
-async def get_daily_report(employee_id:int, report_date:datetime) -> Optional[DailyReport]:
+# insert a batch of validated reports in one unordered insert_many,
+# returns the error of every report that was not written by its position in the batch
+async def create_daily_reports(reports:List[DailyReport]) -> Dict[int, str]:
+    report_dicts = [await _with_total_salary(report.model_dump()) for report in reports]
+    for report_dict in report_dicts:
+        report_dict[WRITE_ID] = new_write_id()
+    errors = {}
+    try:
+        if os.getenv("TESTING") == "True":
+            daily_report_collection.insert_many(report_dicts, ordered=False)
+        else:
+            await daily_report_collection.insert_many(report_dicts, ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details["writeErrors"]:
+            if write_error["code"] == 11000:
+                errors[write_error["index"]] = "Daily report already exists for this employee and date"
+            else:
+                errors[write_error["index"]] = write_error["errmsg"]
+
+    inserted = [report for index, report in enumerate(report_dicts) if index not in errors]
+    await apply_report_deltas((None, report) for report in inserted)
+    await apply_bucket_changes((None, report) for report in inserted)
+    for employee_id in {report["employee_id"] for report in inserted}:
+        payslip_cache.invalidate_employee(employee_id)
+    for report in inserted:
+        _publish_change(None, report)
+    return errors
+
+
+# with a projection only the projected fields are fetched and validated, into the partial model
+def _report_model(projection:Optional[dict]):
+    return partial_model(DailyReport) if projection else DailyReport
+
+async def get_daily_report(employee_id:int, report_date:datetime, projection:Optional[dict] = None) -> Optional[DailyReport]:
+    find_args = ({"employee_id":employee_id, "date":report_date}, projection) if projection else ({"employee_id":employee_id, "date":report_date},)
     if os.getenv("TESTING") == "True":
-        report_data = daily_report_collection.find_one({"employee_id":employee_id, "date":report_date})
+        report_data = daily_report_collection.find_one(*find_args)
     else:
-        report_data =await daily_report_collection.find_one({"employee_id":employee_id, "date":report_date})
+        report_data =await daily_report_collection.find_one(*find_args)
     if report_data:
-        return DailyReport(**report_data)
+        return _report_model(projection)(**report_data)
     return None
 
 async def update_daily_report(employee_id:int, report_date:datetime, update_data:dict) -> Optional[DailyReport]:
+    # fetch the document as it was before the update, the rollups need the delta
+    update_data = {**update_data, WRITE_ID: new_write_id()}
     if os.getenv("TESTING") == "True":
-        updated_report = daily_report_collection.find_one_and_update(
+        previous_report = daily_report_collection.find_one_and_update(
             {"employee_id" : employee_id, "date" : report_date},
             {"$set" : update_data},
-            return_document = True
+            return_document = ReturnDocument.BEFORE
         )
     else:
-        updated_report = await daily_report_collection.find_one_and_update(
+        previous_report = await daily_report_collection.find_one_and_update(
             {"employee_id" : employee_id, "date" : report_date},
             {"$set" : update_data},
-            return_document = True
+            return_document = ReturnDocument.BEFORE
         )
-    if updated_report:
+    payslip_cache.invalidate_employee(employee_id)
+    if "employee_id" in update_data and update_data["employee_id"] != employee_id:
+        payslip_cache.invalidate_employee(update_data["employee_id"])
+    if previous_report:
+        updated_report = apply_set(previous_report, update_data)
+        await apply_report_delta(previous_report, updated_report)
+        total_salary = updated_report.get("total_salary")
+        if (await _with_total_salary(updated_report)).get("total_salary") != total_salary:
+            salary_update = ({"_id": previous_report["_id"]}, {"$set": {"total_salary": updated_report["total_salary"]}})
+            if os.getenv("TESTING") == "True":
+                daily_report_collection.update_one(*salary_update)
+            else:
+                await daily_report_collection.update_one(*salary_update)
+        await apply_bucket_changes([(previous_report, updated_report)])
+        _publish_change(previous_report, updated_report)
         return DailyReport(**updated_report)
     return None
 
+# Apply a batch of (employee_id, date, update, upsert) partial updates with one read of the
+# current reports and one unordered bulk_write. Every update is validated against the report
+# it produces; the error of every update that was not written is returned by its position.
+async def update_daily_reports(updates:List[Tuple[int, datetime, dict, bool]]) -> Tuple[Dict[str, int], Dict[int, str]]:
+    keys = {(employee_id, report_date) for employee_id, report_date, _, _ in updates}
+    query = {"$or": [{"employee_id": employee_id, "date": report_date} for employee_id, report_date in keys]}
+    if os.getenv("TESTING") == "True":
+        existing = list(daily_report_collection.find(query))
+    else:
+        existing = await daily_report_collection.find(query).to_list(length=None)
+    previous = {(report["employee_id"], report["date"]): report for report in existing}
+
+    errors = {}
+    current = dict(previous)
+    changed_fields = {}
+    key_indexes = {}
+    for index, (employee_id, report_date, update_data, upsert) in enumerate(updates):
+        key = (employee_id, report_date)
+        if {"_id", "employee_id", "date"} & {field.split(".")[0] for field in update_data}:
+            errors[index] = "employee_id and date identify the report and can not be updated"
+            continue
+        if key not in current and not upsert:
+            errors[index] = "Daily report not found"
+            continue
+        try:
+            report = DailyReport(**apply_set(current.get(key, {"employee_id": employee_id, "date": report_date}), update_data))
+        except ValidationError as e:
+            errors[index] = validation_error_message(e)
+            continue
+        current[key] = report.model_dump()
+        changed_fields.setdefault(key, set()).update(field.split(".")[0] for field in update_data)
+        key_indexes.setdefault(key, []).append(index)
+
+    # a single operation per report, several updates of one report are merged in request order
+    written = list(changed_fields)
+    requests = []
+    for key in written:
+        report = await _with_total_salary(current[key])
+        report[WRITE_ID] = new_write_id()
+        update_set = {field: report[field] for field in changed_fields[key] | {"total_salary", WRITE_ID}}
+        requests.append(UpdateOne({"employee_id": key[0], "date": key[1]}, {"$set": update_set}, upsert=key not in previous))
+
+    counts = {"matched": 0, "modified": 0, "upserted": 0}
+    if not requests:
+        return counts, errors
+    try:
+        if os.getenv("TESTING") == "True":
+            result = daily_report_collection.bulk_write(requests, ordered=False).bulk_api_result
+        else:
+            result = (await daily_report_collection.bulk_write(requests, ordered=False)).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+        for write_error in result["writeErrors"]:
+            key = written[write_error["index"]]
+            for index in key_indexes[key]:
+                errors[index] = write_error["errmsg"]
+            current[key] = previous.get(key)
+    counts = {"matched": result["nMatched"], "modified": result["nModified"], "upserted": result["nUpserted"]}
+
+    await apply_report_deltas((previous.get(key), current[key]) for key in written)
+    await apply_bucket_changes((previous.get(key), current[key]) for key in written)
+    for employee_id in {employee_id for employee_id, _ in written}:
+        payslip_cache.invalidate_employee(employee_id)
+    for key in written:
+        if current[key] is not None and current[key] is not previous.get(key):
+            _publish_change(previous.get(key), current[key])
+    return counts, errors
+
 async def delete_daily_report(employee_id:int, report_date:datetime) -> bool:
     if os.getenv("TESTING") == "True":
-        result = daily_report_collection.delete_one({"employee_id":employee_id, "date":report_date})
+        deleted_report = daily_report_collection.find_one_and_delete({"employee_id":employee_id, "date":report_date})
     else:
-        result = await daily_report_collection.delete_one({"employee_id":employee_id, "date":report_date})
-    if result:
+        deleted_report = await daily_report_collection.find_one_and_delete({"employee_id":employee_id, "date":report_date})
+    payslip_cache.invalidate_employee(employee_id)
+    if deleted_report:
+        await apply_report_delta(deleted_report, None)
+        await apply_bucket_changes([(deleted_report, None)])
+        _publish_change(deleted_report, None)
         return True
     return False
 
@@ -65,8 +218,189 @@ async def get_all_daily_reports() -> List[DailyReport]:
         reports = await report_cursor.to_list(length=None)
         return [DailyReport(**report_data) for report_data in reports]
 
+def report_filter(employee_id:Optional[int] = None, start_date:Optional[datetime] = None, end_date:Optional[datetime] = None) -> dict:
+    query = {}
+    if employee_id is not None:
+        query["employee_id"] = employee_id
+    if start_date or end_date:
+        query["date"] = {}
+        if start_date:
+            query["date"]["$gte"] = start_date
+        if end_date:
+            query["date"]["$lte"] = end_date
+    return query
+
+
+# One page of reports in (date, employee_id) order, starting after the given key.
+# Returns the page and the key of its last report when more reports follow.
+async def get_daily_reports_page(limit:int, after:Optional[Tuple[datetime, int]] = None, employee_id:Optional[int] = None,
+                                 start_date:Optional[datetime] = None, end_date:Optional[datetime] = None,
+                                 projection:Optional[dict] = None) -> Tuple[List[DailyReport], Optional[Tuple[datetime, int]]]:
+    query = report_filter(employee_id, start_date, end_date)
+    if projection:
+        # the page key is always fetched, the next cursor is built from it
+        projection = {**projection, "date": 1, "employee_id": 1}
+    if after is not None:
+        after_date, after_employee_id = after
+        keyset = {"$or": [{"date": {"$gt": after_date}}, {"date": after_date, "employee_id": {"$gt": after_employee_id}}]}
+        query = {"$and": [query, keyset]} if query else keyset
+
+    # one extra document tells whether there is a next page
+    find_args = (query, projection) if projection else (query,)
+    if os.getenv("TESTING") == "True":
+        reports = list(daily_report_collection.find(*find_args).sort([("date", 1), ("employee_id", 1)]).limit(limit + 1))
+    else:
+        reports = await daily_report_collection.find(*find_args).sort([("date", 1), ("employee_id", 1)]).limit(limit + 1).to_list(length=limit + 1)
+
+    report_model = _report_model(projection)
+    page = [report_model(**report) for report in reports[:limit]]
+    if len(reports) > limit:
+        return page, (page[-1].date, page[-1].employee_id)
+    return page, None
+
+# raw report documents in (date, employee_id) order, fetched from the cursor batch by batch
+async def iter_daily_reports(query:dict, projection:Optional[dict] = None, batch_size:int = 1000) -> AsyncIterator[dict]:
+    projection = projection or {"_id": 0}
+    if os.getenv("TESTING") == "True":
+        for report in daily_report_collection.find(query, projection).sort([("date", 1), ("employee_id", 1)]).batch_size(batch_size):
+            yield report
+    else:
+        async for report in daily_report_collection.find(query, projection).sort([("date", 1), ("employee_id", 1)]).batch_size(batch_size):
+            yield report
+
+# sum of the stored daily salaries, served from the (employee_id, date) index
+async def get_total_salary(employee_id:int, start_date:datetime, end_date:datetime) -> dict:
+    pipeline = [
+        {"$match": {"employee_id": employee_id, "date": {"$gte": start_date, "$lte": end_date}}},
+        {"$group": {
+            "_id": None,
+            "total_salary": {"$sum": "$total_salary"},
+            "report_count": {"$sum": 1},
+            "missing_salaries": {"$sum": {"$cond": [{"$eq": [{"$ifNull": ["$total_salary", None]}, None]}, 1, 0]}},
+        }},
+    ]
+    if os.getenv("TESTING") == "True":
+        groups = list(daily_report_collection.aggregate(pipeline))
+    else:
+        groups = await daily_report_collection.aggregate(pipeline).to_list(length=None)
+    totals = groups[0] if groups else {"total_salary": 0, "report_count": 0, "missing_salaries": 0}
+    return {"total_salary": totals["total_salary"], "report_count": totals["report_count"], "missing_salaries": totals["missing_salaries"]}
+
+
+# Range totals of every employee in one aggregation. The join with the employees only runs
+# on the grouped rows (one per employee), to filter or group them by company_id.
+async def get_team_summary(start_date:datetime, end_date:datetime, company_id:Optional[int] = None, by_company:bool = False) -> List[dict]:
+    accumulators = {**monthly_totals_accumulators(), "working_hours": {"$sum": "$working_hours"}, "total_salary": {"$sum": "$total_salary"}}
+    pipeline = [
+        {"$match": report_filter(None, start_date, end_date)},
+        {"$group": {"_id": "$employee_id", **accumulators}},
+        {"$set": {"employee_id": "$_id"}},
+    ]
+    if company_id is not None or by_company:
+        pipeline += [
+            # reports of deleted employees belong to no company and are left out here
+            {"$lookup": {"from": employee_collection.name, "localField": "_id", "foreignField": "id", "as": "employee"}},
+            {"$unwind": "$employee"},
+            {"$set": {"company_id": "$employee.company_id"}},
+            {"$project": {"employee": 0}},
+        ]
+    if company_id is not None:
+        pipeline.append({"$match": {"company_id": company_id}})
+    if by_company:
+        pipeline.append({"$group": {"_id": "$company_id", "company_id": {"$first": "$company_id"}, "employees": {"$sum": 1},
+                                    **{field: {"$sum": f"${field}"} for field in accumulators}}})
+    pipeline.append({"$sort": {"_id": 1}})
+
+    if os.getenv("TESTING") == "True":
+        rows = list(daily_report_collection.aggregate(pipeline))
+    else:
+        rows = await daily_report_collection.aggregate(pipeline).to_list(length=None)
+    for row in rows:
+        del row["_id"]
+        row["absent_days"] = row["report_count"] - row["present_days"]
+    return rows
+
+
+# (re)compute total_salary of the stored reports matching query in bulk_write batches, only the ones
+# without it unless recompute; a recomputed report whose salary can no longer be computed loses it.
+# A report is only written if it still holds the write it was read with, a later write stored its own
+# salary. The buckets get the same salaries; the rollups do not count total_salary and the write id
+# stays, they are left as they are.
+async def backfill_total_salary(recompute:bool = False, batch_size:int = 1000, query:Optional[dict] = None) -> int:
+    query = dict(query or {})
+    if not recompute:
+        query["total_salary"] = None
+    updated = 0
+    salaries = []
+    async for report in iter_daily_reports(query, {"_id": 1, "employee_id": 1, "date": 1, "appointment": 1, "compensation": 1, WRITE_ID: 1,
+                                                   "deductions": 1, "adherence_status": 1, "is_saturday": 1, "working_hours": 1}, batch_size):
+        total_salary = await salary_lookups.total_salary(report)
+        if total_salary is None and not recompute:
+            continue
+        salaries.append((report, total_salary))
+        if len(salaries) >= batch_size:
+            updated += await _write_salaries(salaries)
+            salaries = []
+    if salaries:
+        updated += await _write_salaries(salaries)
+    return updated
+
+async def _write_salaries(salaries:List[Tuple[dict, Optional[float]]]) -> int:
+    requests = []
+    for report, total_salary in salaries:
+        update = {"$set": {"total_salary": total_salary}} if total_salary is not None else {"$unset": {"total_salary": ""}}
+        requests.append(UpdateOne({"_id": report["_id"], WRITE_ID: report.get(WRITE_ID)}, update))
+    if os.getenv("TESTING") == "True":
+        result = daily_report_collection.bulk_write(requests, ordered=False)
+    else:
+        result = await daily_report_collection.bulk_write(requests, ordered=False)
+    await apply_bucket_salaries(salaries)
+    return result.modified_count
+
+# employee fields daily_salary reads, a change of any other field leaves the stored salaries as they are
+SALARY_EMPLOYEE_FIELDS = ("tier_type", "employee_type")
+
+# The stored total_salary is computed with the employee and the static values of the write, the
+# reports of an employee whose tier or type changed, and the ones dated in the range a written
+# static values document was or is in force on, are recomputed after the change is published.
+@event_bus.subscribe(EMPLOYEE)
+async def recompute_employee_salaries(event:ChangeEvent):
+    if event.action == "delete":
+        return
+    if event.before and event.after and all(event.before.get(field) == event.after.get(field) for field in SALARY_EMPLOYEE_FIELDS):
+        return
+    await backfill_total_salary(recompute=True, query={"employee_id": event.key})
+    await summary_cache.changed()
+
+@event_bus.subscribe(STATIC_VALUES)
+async def recompute_static_values_salaries(event:ChangeEvent):
+    # the union of the ranges before and after the write, an empty range stands for every date
+    ranges = [await _in_force_dates(values) for values in (event.before, event.after) if values]
+    if not ranges:
+        return
+    query = {} if {} in ranges else {"$or": [{"date": dates} for dates in ranges]}
+    await backfill_total_salary(recompute=True, query=query)
+    await summary_cache.changed()
+
+# the report dates a static values document is in force on as a date condition: a version from its
+# effective_from to its effective_to, a document without effective dates until the first version
+async def _in_force_dates(values:dict) -> dict:
+    if values.get("effective_from") is None and values.get("effective_to") is None:
+        query = ({"effective_from": {"$ne": None}}, {"effective_from": 1, "_id": 0})
+        if os.getenv("TESTING") == "True":
+            first = static_values_collection.find_one(*query, sort=[("effective_from", 1)])
+        else:
+            first = await static_values_collection.find_one(*query, sort=[("effective_from", 1)])
+        return {"$lt": first["effective_from"]} if first else {}
+    dates = {}
+    if values.get("effective_from") is not None:
+        dates["$gte"] = values["effective_from"]
+    if values.get("effective_to") is not None:
+        dates["$lt"] = values["effective_to"]
+    return dates
+
 # get dailyreport by specific employee and range date
-async def get_daily_reports_by_employee_and_range_date(employee_id:int, start_date:Optional[datetime], end_date:Optional[datetime]) -> List[DailyReport]:
+async def get_daily_reports_by_employee_and_range_date(employee_id:int, start_date:Optional[datetime], end_date:Optional[datetime], projection:Optional[dict] = None) -> List[DailyReport]:
     query = {"employee_id" : employee_id}
     if start_date and end_date:
         query["date"] = {"$gte":start_date, "$lte":end_date}
@@ -75,11 +409,13 @@ async def get_daily_reports_by_employee_and_range_date(employee_id:int, start_da
     elif end_date:
         query["date"] = {"$lte":end_date}
         
+    find_args = (query, projection) if projection else (query,)
+    report_model = _report_model(projection)
     if os.getenv("TESTING") == "True":
-        reports = list(daily_report_collection.find(query))
-        return [DailyReport(**report_data) for report_data in reports]
+        reports = list(daily_report_collection.find(*find_args))
+        return [report_model(**report_data) for report_data in reports]
     else:
-        cursor = daily_report_collection.find(query)
+        cursor = daily_report_collection.find(*find_args)
         reports = await cursor.to_list(length=None)
-        return [DailyReport(**report) for report in reports]
+        return [report_model(**report) for report in reports]
 
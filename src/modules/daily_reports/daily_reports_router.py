@@ -1,12 +1,19 @@
 from datetime import datetime
-from fastapi import APIRouter
-from typing import List, Optional
-from shared.models_schemas.schemas import DailyReportCreate, DailyReportResponse
-from .daily_reports_controller import create_daily_report_control, get_daily_report_control, update_daily_report_control, delete_daily_report_control, get_all_daily_reports_control, get_daily_reports_by_employee_and_renage_date_control
+from fastapi import APIRouter, Query, Request, Response
+from typing import List, Literal, Optional, Union
+from shared.models_schemas.schemas import DailyReportCreate, DailyReportResponse, BulkIngestResponse, BulkUpdateResponse, DailyReportBulkUpdate, SalaryTotalResponse, TeamSummaryResponse
+from shared.models_schemas.models import DailyReport
+from shared.projection import partial_model
+from shared.ingest import iter_body_records
+from .daily_reports_controller import export_daily_reports_control, get_team_summary_control, get_total_salary_control, get_daily_reports_page_control, bulk_create_daily_reports_control, bulk_update_daily_reports_control, create_daily_report_control, get_daily_report_control, update_daily_report_control, delete_daily_report_control, get_daily_reports_by_employee_and_renage_date_control
 
 
 router = APIRouter()
 
+# read endpoints take fields=employee_id,date,... and then return only those fields
+# (the crud returns instances of this very model, so their unset fields stay out of the response)
+PartialDailyReportResponse = partial_model(DailyReport)
+
 
 # daily_reports endpoints
 
@@ -15,10 +22,35 @@ async def create_daily_report_endpoint(report:DailyReportCreate):
     return await create_daily_report_control(report)
 
 
+# NDJSON (one report per line) or a JSON array, read as it streams in
+@router.post("/daily_reports/bulk", response_model=BulkIngestResponse)
+async def bulk_create_daily_reports_endpoint(request:Request):
+    return await bulk_create_daily_reports_control(iter_body_records(request.stream()))
+
+
+# keyed partial updates (and upserts) of many reports, written with one bulk_write
+@router.put("/daily_reports/bulk", response_model=BulkUpdateResponse)
+async def bulk_update_daily_reports_endpoint(updates:List[DailyReportBulkUpdate]):
+    return await bulk_update_daily_reports_control(updates)
+
+
+# streams every matching report, fields is a comma separated projection (e.g. employee_id,date,compensation.kpis)
+@router.get("/daily_reports/export")
+async def export_daily_reports_endpoint(format:Literal["ndjson", "csv"] = "ndjson", fields:Optional[str] = None, employee_id:Optional[int] = None,
+                                        start_date:Optional[datetime] = None, end_date:Optional[datetime] = None):
+    return await export_daily_reports_control(format, fields, employee_id, start_date, end_date)
+
+
+# totals of every employee over [start_date, end_date], optionally for one company or per company
+@router.get("/daily_reports/summary", response_model=TeamSummaryResponse)
+async def get_team_summary_endpoint(start_date:datetime, end_date:datetime, company_id:Optional[int] = None,
+                                    group_by:Literal["employee", "company"] = "employee"):
+    return await get_team_summary_control(start_date, end_date, company_id, group_by)
+
 
-@router.get("/daily_reports/{employee_id}/daily_reports/{report_date}", response_model=DailyReportResponse)
-async def get_daily_report_endpoint(employee_id:int, report_date:datetime):
-    return await get_daily_report_control(employee_id, report_date)
+@router.get("/daily_reports/{employee_id}/daily_reports/{report_date}", response_model=Union[DailyReportResponse, PartialDailyReportResponse], response_model_exclude_unset=True)
+async def get_daily_report_endpoint(employee_id:int, report_date:datetime, fields:Optional[str] = None):
+    return await get_daily_report_control(employee_id, report_date, fields)
 
         
 @router.put("/daily_reports/{employee_id}/daily_reports/{report_date}", response_model=DailyReportResponse)
@@ -29,15 +61,22 @@ async def update_daily_report_endpoint(employee_id:int, report_date:datetime, up
 async def delete_daily_report_endpoint(employee_id:int, report_date:datetime):
     return await delete_daily_report_control(employee_id, report_date)
 
-@router.get("/daily_reports", response_model=List[DailyReportResponse])
-async def get_all_daily_reports_endpoints():
-    return await get_all_daily_reports_control()
+# paginated in (date, employee_id) order, the next page's cursor comes back in the X-Next-Cursor header
+@router.get("/daily_reports", response_model=List[Union[DailyReportResponse, PartialDailyReportResponse]], response_model_exclude_unset=True)
+async def get_all_daily_reports_endpoints(response:Response, limit:int = Query(100, ge=1, le=1000), cursor:Optional[str] = None,
+                                          employee_id:Optional[int] = None, start_date:Optional[datetime] = None, end_date:Optional[datetime] = None,
+                                          fields:Optional[str] = None):
+    reports, next_cursor = await get_daily_reports_page_control(limit, cursor, employee_id, start_date, end_date, fields)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return reports
 
 
-@router.get("/daily_reports/{employee_id}/daily_reports/{start_date}/{end_date}", response_model=list[DailyReportResponse])
-async def get_daily_reports_by_employee_and_renage_date_endpoint(employee_id:int, start_date:Optional[datetime], end_date:Optional[datetime]):
-    return await get_daily_reports_by_employee_and_renage_date_control(employee_id, start_date, end_date)
+@router.get("/daily_reports/{employee_id}/daily_reports/{start_date}/{end_date}", response_model=list[Union[DailyReportResponse, PartialDailyReportResponse]], response_model_exclude_unset=True)
+async def get_daily_reports_by_employee_and_renage_date_endpoint(employee_id:int, start_date:Optional[datetime], end_date:Optional[datetime], fields:Optional[str] = None):
+    return await get_daily_reports_by_employee_and_renage_date_control(employee_id, start_date, end_date, fields)
 
-# @router.get("/employees/{employee_id}/daily_reports/{report_date}/salary", response_model=float)
-# async def get_daily_report_salary_endpoint(employee_id:int, report_date:datetime):
-#     return await get_daily_report_salary_control(employee_id, report_date)
\ No newline at end of file
+# sum of the salaries stored on the reports, no payroll recompute
+@router.get("/daily_reports/{employee_id}/total_salary/{start_date}/{end_date}", response_model=SalaryTotalResponse)
+async def get_total_salary_endpoint(employee_id:int, start_date:datetime, end_date:datetime):
+    return await get_total_salary_control(employee_id, start_date, end_date)
@@ -0,0 +1,24 @@
+# Build (or re-build) the bucketed daily report layout from the report documents.
+# Run it once after switching DAILY_REPORT_STORAGE to bucket, writes made from then on keep the buckets current.
+# `drop` removes the layout again once DAILY_REPORT_STORAGE is unset.
+#
+#   cd src && python -m modules.daily_reports.migrate_report_buckets [year month | drop]
+import asyncio
+import sys
+from .report_buckets_crud import buckets_enabled, drop_report_buckets, rebuild_report_buckets
+
+
+async def main(args:list):
+    if args == ["drop"]:
+        if buckets_enabled():
+            sys.exit("unset DAILY_REPORT_STORAGE first, report writes still go to the buckets")
+        await drop_report_buckets()
+        print("dropped the daily report buckets")
+        return
+    year, month = (int(args[0]), int(args[1])) if len(args) == 2 else (None, None)
+    buckets = await rebuild_report_buckets(year, month)
+    print(f"rebuilt {buckets} daily report buckets")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
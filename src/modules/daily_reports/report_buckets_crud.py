@@ -0,0 +1,202 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from config.database.database import daily_report_bucket_collection, daily_report_collection
+from shared.documents import WRITE_ID
+import os
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+logger = logging.getLogger(__name__)
+
+# rounds of a rebuild, the buckets written to during one round are rebuilt again in the next
+REBUILD_ROUNDS = 3
+
+
+# Bucketed layout of the daily reports: one document per (employee_id, year, month)
+# holding the month's reports, without their employee_id, in a date sorted `days` array.
+#
+# With DAILY_REPORT_STORAGE=bucket every report write is applied to the buckets too and the
+# monthly reads of payroll runs and payslips fetch a single bucket per employee instead of
+# ~30 report documents. The per-report documents stay the source of truth (single report
+# reads, pagination, export and aggregations), the buckets can be rebuilt from them at any
+# time with `python -m modules.daily_reports.migrate_report_buckets`.
+#
+# Writing both layouts is a transition step, not the target. Removal plan for the per-report writes:
+#   1. move the reads still served by the report documents to the buckets ($unwind of `days`):
+#      single reports, pagination, export, team summary, salary totals and the rollup rebuild;
+#   2. in bucket mode, stop inserting report documents (the unique (employee_id, date) check
+#      moves to the bucket update) and rebuild the rollups from the buckets;
+#   3. drop daily_report once no reader is left.
+# To back out instead, unset DAILY_REPORT_STORAGE and run
+# `python -m modules.daily_reports.migrate_report_buckets drop`.
+
+def buckets_enabled() -> bool:
+    return os.getenv("DAILY_REPORT_STORAGE") == "bucket"
+
+
+def _bucket_key(report:dict) -> dict:
+    report_date = report["date"]
+    if isinstance(report_date, str):
+        report_date = datetime.fromisoformat(report_date)
+    return {"employee_id": report["employee_id"], "year": report_date.year, "month": report_date.month}
+
+
+def _day_entry(report:dict) -> dict:
+    return {field: value for field, value in report.items() if field not in ("_id", "employee_id")}
+
+
+# move the reports before their writes out of their buckets and the reports after them in,
+# in order and in one round trip (None when a report did not / no longer exists).
+# A day is pulled by date before it is pushed, so a write a rebuild already put in the bucket is not added twice.
+async def apply_bucket_changes(changes:Iterable[Tuple[Optional[dict], Optional[dict]]]):
+    if not buckets_enabled():
+        return
+    requests = []
+    for before, after in changes:
+        # every write moves the bucket's version, see rebuild_report_buckets
+        if before:
+            requests.append(UpdateOne(_bucket_key(before), {"$pull": {"days": {"date": before["date"]}}, "$inc": {"version": 1}}))
+        if after and not (before and _bucket_key(before) == _bucket_key(after) and before["date"] == after["date"]):
+            requests.append(UpdateOne(_bucket_key(after), {"$pull": {"days": {"date": after["date"]}}, "$inc": {"version": 1}}))
+        if after:
+            requests.append(UpdateOne(_bucket_key(after), {"$push": {"days": {"$each": [_day_entry(after)], "$sort": {"date": 1}}}, "$inc": {"version": 1}}, upsert=True))
+    if not requests:
+        return
+    if os.getenv("TESTING") == "True":
+        daily_report_bucket_collection.bulk_write(requests, ordered=True)
+    else:
+        await daily_report_bucket_collection.bulk_write(requests, ordered=True)
+
+
+# set the recomputed salaries of (report, total_salary) pairs, None unsets it, on the days that still
+# hold the write the salary was computed from; a day written since came with its own salary
+async def apply_bucket_salaries(salaries:Iterable[Tuple[dict, Optional[float]]]):
+    if not buckets_enabled():
+        return
+    requests = []
+    for report, total_salary in salaries:
+        day = {"date": report["date"], WRITE_ID: report.get(WRITE_ID)}
+        if total_salary is None:
+            update = {"$unset": {"days.$.total_salary": ""}}
+        else:
+            update = {"$set": {"days.$.total_salary": total_salary}}
+        requests.append(UpdateOne({**_bucket_key(report), "days": {"$elemMatch": day}}, {**update, "$inc": {"version": 1}}))
+    if not requests:
+        return
+    if os.getenv("TESTING") == "True":
+        daily_report_bucket_collection.bulk_write(requests, ordered=False)
+    else:
+        await daily_report_bucket_collection.bulk_write(requests, ordered=False)
+
+
+def _months(start_date:datetime, end_date:datetime) -> List[dict]:
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append({"year": year, "month": month})
+        year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+    return months
+
+
+# the reports in [start_date, end_date) of the given employees, grouped by employee_id and in date order,
+# a month of one employee is a single document
+async def get_bucket_reports(employee_ids:List[int], start_date:datetime, end_date:datetime) -> Dict[int, List[dict]]:
+    query = {"employee_id": {"$in": employee_ids}, "$or": _months(start_date, end_date)}
+    sort = [("employee_id", 1), ("year", 1), ("month", 1)]
+    if os.getenv("TESTING") == "True":
+        buckets = list(daily_report_bucket_collection.find(query).sort(sort))
+    else:
+        buckets = await daily_report_bucket_collection.find(query).sort(sort).to_list(length=None)
+
+    grouped = {employee_id: [] for employee_id in employee_ids}
+    for bucket in buckets:
+        grouped[bucket["employee_id"]].extend(
+            dict(day, employee_id=bucket["employee_id"]) for day in bucket["days"] if start_date <= day["date"] < end_date
+        )
+    return grouped
+
+
+def _key_query(key:tuple) -> dict:
+    employee_id, year, month = key
+    return {"employee_id": employee_id, "year": year, "month": month}
+
+
+# Re-derive the buckets from the report documents, for every month or just one.
+# Buckets are replaced in place like the rollups (see rebuild_rollups): one conditional upsert
+# per key, applied only if the bucket's version is still the one read before the reports were
+# aggregated, the buckets a report write got to in between are rebuilt in the next round.
+# Months whose reports are all gone keep an empty bucket.
+async def rebuild_report_buckets(year:Optional[int] = None, month:Optional[int] = None) -> int:
+    match = {}
+    scope = {}
+    if year is not None and month is not None:
+        start_of_month = datetime(year, month, 1)
+        next_month = datetime(year, month + 1, 1) if month < 12 else datetime(year + 1, 1, 1)
+        match = {"date": {"$gte": start_of_month, "$lt": next_month}}
+        scope = {"year": year, "month": month}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"date": 1}},
+        {"$group": {
+            "_id": {"employee_id": "$employee_id", "year": {"$year": "$date"}, "month": {"$month": "$date"}},
+            "days": {"$push": "$$ROOT"},
+        }},
+    ]
+
+    pending = None
+    days = {}
+    for _ in range(REBUILD_ROUNDS):
+        # versions first: a write landing after this read moves the version, whether or not the aggregation saw it
+        version_projection = {"employee_id": 1, "year": 1, "month": 1, "version": 1}
+        if os.getenv("TESTING") == "True":
+            versions = {(bucket["employee_id"], bucket["year"], bucket["month"]): bucket.get("version") for bucket in daily_report_bucket_collection.find(scope, version_projection)}
+            groups = list(daily_report_collection.aggregate(pipeline))
+        else:
+            versions = {(bucket["employee_id"], bucket["year"], bucket["month"]): bucket.get("version") for bucket in await daily_report_bucket_collection.find(scope, version_projection).to_list(length=None)}
+            groups = await daily_report_collection.aggregate(pipeline).to_list(length=None)
+
+        days = {(group["_id"]["employee_id"], group["_id"]["year"], group["_id"]["month"]): [_day_entry(day) for day in group["days"]] for group in groups}
+
+        keys = set(versions) | set(days) if pending is None else pending
+        # the token marks the buckets this round replaced
+        token = ObjectId()
+        requests = []
+        for key in keys:
+            version = versions.get(key)
+            query = {**_key_query(key), "version": version if version is not None else {"$exists": False}}
+            requests.append(UpdateOne(query, {"$set": {"days": days.get(key, []), "rebuild": token}}, upsert=True))
+        if not requests:
+            break
+        try:
+            if os.getenv("TESTING") == "True":
+                daily_report_bucket_collection.bulk_write(requests, ordered=False)
+            else:
+                await daily_report_bucket_collection.bulk_write(requests, ordered=False)
+        except BulkWriteError:
+            # a version that moved turns the upsert into a duplicate of the existing bucket, it stays pending
+            pass
+        if os.getenv("TESTING") == "True":
+            replaced = list(daily_report_bucket_collection.find({"rebuild": token}, version_projection))
+        else:
+            replaced = await daily_report_bucket_collection.find({"rebuild": token}, version_projection).to_list(length=None)
+        pending = keys - {(bucket["employee_id"], bucket["year"], bucket["month"]) for bucket in replaced}
+        if not pending:
+            break
+    if pending:
+        logger.warning("buckets still written to after %d rebuild rounds: %s", REBUILD_ROUNDS, sorted(pending))
+    return len(days)
+
+
+# the removal path of the bucketed layout, run after unsetting DAILY_REPORT_STORAGE
+async def drop_report_buckets():
+    if os.getenv("TESTING") == "True":
+        daily_report_bucket_collection.drop()
+    else:
+        await daily_report_bucket_collection.drop()
@@ -1,16 +1,34 @@
+import base64
+import binascii
+import json
+from datetime import datetime
 from fastapi import HTTPException
-from .employees_crud import  create_employee, get_employee, update_employee, delete_employee, get_all_employee
-from shared.models_schemas.schemas import EmployeeCreate
+from typing import Any, AsyncIterator, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from pymongo.errors import DuplicateKeyError
+from .employees_crud import  create_employee, get_employee, update_employee, delete_employee, get_all_employee, upsert_employees, get_employees_page, employee_filter
+from shared.models_schemas.models import Employee
+from shared.models_schemas.schemas import EmployeeCreate, BulkRowError, BulkUpdateResponse
+from shared.projection import parse_fields
+from shared.ingest import validation_error_message
 
 exception_error = HTTPException(status_code=404, detail="Employee not found")
+duplicate_error = HTTPException(status_code=409, detail="Employee already exists")
+invalid_cursor_error = HTTPException(status_code=400, detail="Invalid cursor")
+
+# employees validated and written per bulk_write round trip
+IMPORT_CHUNK_SIZE = 1000
 
 async def create_employee_control(employee:EmployeeCreate):
-    create_employe = await create_employee(employee)
+    try:
+        create_employe = await create_employee(employee)
+    except DuplicateKeyError:
+        raise duplicate_error
     return create_employe
 
 
-async def get_employee_control(employee_id:int):
-    employee  = await get_employee(employee_id)
+async def get_employee_control(employee_id:int, fields:Optional[str] = None):
+    employee  = await get_employee(employee_id, parse_fields(fields, Employee))
     if not employee:
         raise exception_error
     return employee
@@ -30,6 +48,73 @@ async def delete_employee_control(employee_id:int):
     return deleted
 
 
-async def get_all_employees_control():
-    employees = await get_all_employee()
-    return employees
\ No newline at end of file
+async def get_all_employees_control(fields:Optional[str] = None):
+    employees = await get_all_employee(parse_fields(fields, Employee))
+    return employees
+
+
+# the cursor holds the sort and the (sort value, id) of the last employee of the previous page, kept opaque to clients
+def encode_cursor(sort:str, key:Tuple[Any, int]) -> str:
+    value, employee_id = key
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([sort, value, employee_id]).encode()).decode()
+
+
+# a cursor is only valid for the sort it was issued for
+def decode_cursor(cursor:str, sort:str) -> Tuple[Any, int]:
+    try:
+        cursor_sort, value, employee_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if cursor_sort != sort:
+            raise ValueError(cursor_sort)
+        if sort.lstrip("-") == "start_date":
+            value = datetime.fromisoformat(value)
+        return value, int(employee_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise invalid_cursor_error
+
+
+# sort is id, name or start_date, prefixed with - for descending order
+async def get_employees_page_control(limit:int, cursor:Optional[str] = None, sort:str = "id", company_id:Optional[int] = None,
+                                     tier_type:Optional[str] = None, is_onsite:Optional[bool] = None, active:Optional[bool] = None,
+                                     fields:Optional[str] = None) -> Tuple[list, Optional[str]]:
+    projection = parse_fields(fields, Employee)
+    after = decode_cursor(cursor, sort) if cursor else None
+    employees, last_key = await get_employees_page(limit, after, sort.lstrip("-"), sort.startswith("-"),
+                                                   employee_filter(company_id, tier_type, is_onsite, active), projection)
+    return employees, encode_cursor(sort, last_key) if last_key else None
+
+
+async def _upsert_chunk(rows:List[int], employees:List[EmployeeCreate], response:BulkUpdateResponse):
+    counts, write_errors, superseded = await upsert_employees(employees)
+    response.matched += counts["matched"]
+    response.modified += counts["modified"]
+    response.upserted += counts["upserted"]
+    response.errors.extend(BulkRowError(row=rows[index], error=error) for index, error in sorted(write_errors.items()))
+    response.errors.extend(BulkRowError(row=rows[index], error=f"duplicate id, superseded by row {rows[later]}") for index, later in sorted(superseded.items()))
+
+
+# validate and upsert the records chunk by chunk as they are read, a bad row never aborts the rest
+async def import_employees_control(records:AsyncIterator[Tuple[int, Union[bytes, dict]]]) -> BulkUpdateResponse:
+    response = BulkUpdateResponse(received=0, matched=0, modified=0, upserted=0)
+    rows = []
+    employees = []
+    async for row, record in records:
+        response.received += 1
+        try:
+            if isinstance(record, bytes):
+                employee = EmployeeCreate.model_validate_json(record)
+            else:
+                employee = EmployeeCreate.model_validate(record)
+        except ValidationError as e:
+            response.errors.append(BulkRowError(row=row, error=validation_error_message(e)))
+            continue
+        rows.append(row)
+        employees.append(employee)
+        if len(employees) >= IMPORT_CHUNK_SIZE:
+            await _upsert_chunk(rows, employees, response)
+            rows, employees = [], []
+    if employees:
+        await _upsert_chunk(rows, employees, response)
+    response.errors.sort(key=lambda error: error.row)
+    return response
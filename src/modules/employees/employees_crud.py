@@ -1,6 +1,14 @@
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, Tuple
+from datetime import datetime
 from shared.models_schemas.models import Employee
+from shared.projection import partial_model
 from config.database.database import employee_collection
+from services.payslip_cache import payslip_cache
+from services.employee_cache import employee_cache
+from services.events import EMPLOYEE, event_bus
+from shared.documents import apply_set
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
 from dotenv import load_dotenv
 
@@ -16,36 +24,59 @@ async def create_employee(employee : Employee) -> Employee:
         employee_collection.insert_one(employee_dict)
     else:
         await employee_collection.insert_one(employee_dict)        
+    employee_cache.put(employee.id, employee)
+    await employee_cache.changed()
+    event_bus.publish(EMPLOYEE, "create", employee.id, None, employee_dict)
     return employee
 
-async def get_employee(employee_id: int) -> Optional[Employee]:
+# with a projection only the projected fields are fetched and validated, into the partial model
+def _employee_model(projection:Optional[dict]):
+    return partial_model(Employee) if projection else Employee
+
+# full employees are served from employee_cache, projected and uncached reads go to the collection
+async def get_employee(employee_id: int, projection:Optional[dict] = None, cached:bool = True) -> Optional[Employee]:
+    if not projection and cached:
+        return await employee_cache.get(employee_id, lambda: _load_employee(employee_id))
+    return await _load_employee(employee_id, projection)
+
+async def _load_employee(employee_id: int, projection:Optional[dict] = None) -> Optional[Employee]:
+    find_args = ({"id": employee_id}, projection) if projection else ({"id": employee_id},)
     if os.getenv("TESTING") == "True":
         # Use synchronous find_one for tests
-        employee_data = employee_collection.find_one({"id": employee_id})
+        employee_data = employee_collection.find_one(*find_args)
     else:
         # Use asynchronous find_one for production
-        employee_data = await employee_collection.find_one({"id": employee_id})
+        employee_data = await employee_collection.find_one(*find_args)
 
     if employee_data:
-        return Employee(**employee_data)
+        return _employee_model(projection)(**employee_data)
     return None
 
 
 async def update_employee(employee_id:int, update_data:dict) -> Optional[Employee]:
+    # the employee as it was before, subscribers get both sides of the change
     if os.getenv("TESTING") == "True":
-        updated_employee = employee_collection.find_one_and_update(
+        previous_employee = employee_collection.find_one_and_update(
             {"id" : employee_id},
             {"$set" : update_data},
-            return_document = True
+            return_document = ReturnDocument.BEFORE
         )
     else:
-        updated_employee = await employee_collection.find_one_and_update(
+        previous_employee = await employee_collection.find_one_and_update(
             {"id" : employee_id},
             {"$set" : update_data},
-            return_document = True
+            return_document = ReturnDocument.BEFORE
         )
-    if updated_employee:
-        return Employee(**updated_employee)
+    payslip_cache.invalidate_employee(employee_id)
+    if previous_employee:
+        updated_employee = apply_set(previous_employee, update_data)
+        employee = Employee(**updated_employee)
+        employee_cache.put(employee_id, employee)
+        await employee_cache.changed()
+        event_bus.publish(EMPLOYEE, "update", employee_id, previous_employee, updated_employee)
+        return employee
+    employee_cache.put(employee_id, None)
+    await employee_cache.changed()
     return None
 
 async def delete_employee(employee_id : int) -> bool:
@@ -53,17 +84,140 @@ async def delete_employee(employee_id : int) -> bool:
         result = employee_collection.delete_one({"id":employee_id})
     else:
         result = await employee_collection.delete_one({"id":employee_id})
+    payslip_cache.invalidate_employee(employee_id)
+    employee_cache.put(employee_id, None)
+    await employee_cache.changed()
+    event_bus.publish(EMPLOYEE, "delete", employee_id, None, None)
     if result:
         return True
     return False
 
 
 
-async def get_all_employee() -> List[Employee]:
+# Upsert a batch of employees keyed on id with one unordered bulk_write. The fields given in the
+# record are set, the defaulted ones (start_date) only when the employee is created.
+# The error of every record that was not written is returned by its position. A later record of the
+# same id wins, the earlier one is not written and returned with the position of the record superseding it.
+# The stored employees are read first (one $in query), so the events carry the documents around the
+# write and the records that change nothing publish nothing and keep their cached entries.
+async def upsert_employees(employees:List[Employee]) -> Tuple[Dict[str, int], Dict[int, str], Dict[int, int]]:
+    positions = {}
+    superseded = {}
+    for index, employee in enumerate(employees):
+        if employee.id in positions:
+            superseded[positions[employee.id]] = index
+        positions[employee.id] = index
+    written = sorted(positions.values())
+    requests = []
+    for index in written:
+        employee = employees[index]
+        given = employee.model_dump(include=employee.model_fields_set)
+        defaults = {field: value for field, value in employee.model_dump().items() if field not in given}
+        update = {"$set": given, "$setOnInsert": defaults} if defaults else {"$set": given}
+        requests.append(UpdateOne({"id": employee.id}, update, upsert=True))
+
+    query = {"id": {"$in": [employees[index].id for index in written]}}
+    if os.getenv("TESTING") == "True":
+        existing = list(employee_collection.find(query))
+    else:
+        existing = await employee_collection.find(query).to_list(length=None)
+    previous = {employee["id"]: employee for employee in existing}
+
+    errors = {}
+    try:
+        if os.getenv("TESTING") == "True":
+            result = employee_collection.bulk_write(requests, ordered=False).bulk_api_result
+        else:
+            result = (await employee_collection.bulk_write(requests, ordered=False)).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+        for write_error in result["writeErrors"]:
+            errors[written[write_error["index"]]] = write_error["errmsg"]
+    # the upserts of the ids the read did not find created their employees
+    created = {index for index in written if employees[index].id not in previous}
+
+    for index in written:
+        employee = employees[index]
+        if index in errors:
+            payslip_cache.invalidate_employee(employee.id)
+            employee_cache.invalidate(employee.id)
+            continue
+        employee_dict = employee.model_dump()
+        if index in created:
+            payslip_cache.invalidate_employee(employee.id)
+            employee_cache.put(employee.id, Employee(**employee_dict))
+            event_bus.publish(EMPLOYEE, "create", employee.id, None, employee_dict)
+            continue
+        # the stored document keeps its start_date when the record did not give one
+        before = previous.get(employee.id)
+        after = apply_set(before, employee.model_dump(include=employee.model_fields_set)) if before else employee_dict
+        if after == before:
+            continue
+        payslip_cache.invalidate_employee(employee.id)
+        employee_cache.invalidate(employee.id)
+        event_bus.publish(EMPLOYEE, "update", employee.id, before, after)
+    await employee_cache.changed()
+    counts = {"matched": result["nMatched"], "modified": result["nModified"], "upserted": result["nUpserted"]}
+    return counts, errors, superseded
+
+
+async def get_all_employee(projection:Optional[dict] = None) -> List[Employee]:
+    find_args = ({}, projection) if projection else ({},)
+    employee_model = _employee_model(projection)
     if os.getenv("TESTING") == "True":
-        employees = list(employee_collection.find({})) 
-        return [Employee(**employee) for employee in employees]
+        employees = list(employee_collection.find(*find_args)) 
+        return [employee_model(**employee) for employee in employees]
     else:
-        employee_cursor = employee_collection.find({})
+        employee_cursor = employee_collection.find(*find_args)
         employees = await employee_cursor.to_list(length=None)
-        return [Employee(**employee_data) for employee_data in employees]
\ No newline at end of file
+        return [employee_model(**employee_data) for employee_data in employees]
+
+
+def employee_filter(company_id:Optional[int] = None, tier_type:Optional[str] = None, is_onsite:Optional[bool] = None, active:Optional[bool] = None) -> dict:
+    query = {}
+    if company_id is not None:
+        query["company_id"] = company_id
+    if tier_type is not None:
+        query["tier_type"] = tier_type
+    if is_onsite is not None:
+        query["is_onsite"] = is_onsite
+    # active: not left yet, an end_date in the future is still active
+    if active is True:
+        query["$or"] = [{"end_date": None}, {"end_date": {"$gt": datetime.now()}}]
+    elif active is False:
+        query["end_date"] = {"$lte": datetime.now()}
+    return query
+
+# One page of employees ordered by sort_field (then id, so the order and the keyset are total),
+# descending if asked, starting after the given key.
+# Returns the page and the (sort value, id) of its last employee when more employees follow.
+async def get_employees_page(limit:int, after:Optional[Tuple[Any, int]] = None, sort_field:str = "id", descending:bool = False,
+                             query:Optional[dict] = None, projection:Optional[dict] = None) -> Tuple[List[Employee], Optional[Tuple[Any, int]]]:
+    query = dict(query or {})
+    keys = [sort_field] if sort_field == "id" else [sort_field, "id"]
+    if projection:
+        # the page key is always fetched, the next cursor is built from it
+        projection = {**projection, **{key: 1 for key in keys}}
+    if after is not None:
+        after_value, after_id = after
+        direction = "$lt" if descending else "$gt"
+        if sort_field == "id":
+            keyset = {"id": {direction: after_id}}
+        else:
+            keyset = {"$or": [{sort_field: {direction: after_value}}, {sort_field: after_value, "id": {direction: after_id}}]}
+        query = {"$and": [query, keyset]} if query else keyset
+
+    # one extra document tells whether there is a next page
+    sort = [(key, -1 if descending else 1) for key in keys]
+    find_args = (query, projection) if projection else (query,)
+    if os.getenv("TESTING") == "True":
+        employees = list(employee_collection.find(*find_args).sort(sort).limit(limit + 1))
+    else:
+        employees = await employee_collection.find(*find_args).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+
+    employee_model = _employee_model(projection)
+    page = [employee_model(**employee) for employee in employees[:limit]]
+    if len(employees) > limit:
+        last = page[-1]
+        return page, (getattr(last, sort_field), last.id)
+    return page, None
@@ -1,21 +1,35 @@
-from fastapi import APIRouter
-from typing import List
-from shared.models_schemas.schemas import EmployeeCreate, EmployeeUpdate, EmployeeResponse, DailyReportCreate, DailyReportUpdate, DailyReportResponse
-from .employees_controller import create_employee_control, get_employee_control, update_employee_control, delete_employee_control, get_all_employees_control
+from fastapi import APIRouter, Query, Request, Response
+from typing import List, Literal, Optional, Union
+from shared.models_schemas.schemas import EmployeeCreate, EmployeeUpdate, EmployeeResponse, DailyReportCreate, DailyReportUpdate, DailyReportResponse, BulkUpdateResponse
+from shared.models_schemas.models import Employee
+from shared.projection import partial_model
+from shared.ingest import iter_body_records, iter_csv_records
+from .employees_controller import create_employee_control, get_employee_control, update_employee_control, delete_employee_control, get_employees_page_control, import_employees_control
 
 
 
 router = APIRouter()
 
+# read endpoints take fields=id,name,... and then return only those fields
+# (the crud returns instances of this very model, so their unset fields stay out of the response)
+PartialEmployeeResponse = partial_model(Employee)
+
 # Employee endpoints
 
 @router.post("/employees", response_model=EmployeeResponse)
 async def create_employee_endpoint(employee:EmployeeCreate):
     return await create_employee_control(employee)
 
-@router.get("/employees/{employee_id}", response_model=EmployeeResponse)
-async def get_employee_endpoint(employee_id:int):
-    return await get_employee_control(employee_id)
+# CSV (header row, dotted columns for employee_type) or NDJSON / a JSON array, read as it streams in.
+# Employees are upserted on id, the errors are reported per row.
+@router.post("/employees/bulk", response_model=BulkUpdateResponse)
+async def import_employees_endpoint(request:Request, format:Literal["ndjson", "csv"] = "ndjson"):
+    records = iter_csv_records(request.stream()) if format == "csv" else iter_body_records(request.stream())
+    return await import_employees_control(records)
+
+@router.get("/employees/{employee_id}", response_model=Union[EmployeeResponse, PartialEmployeeResponse], response_model_exclude_unset=True)
+async def get_employee_endpoint(employee_id:int, fields:Optional[str] = None):
+    return await get_employee_control(employee_id, fields)
 
 
 @router.put("/employees/{employee_id}", response_model=EmployeeResponse)
@@ -28,7 +42,14 @@ async def delete_employee_endpoint(employee_id:int):
     return await delete_employee_control(employee_id)
 
 
-@router.get("/employees", response_model=List[EmployeeResponse])
-async def get_all_employees_endpoint():
-    employees = await get_all_employees_control()
+# filtered and paginated in sort order (id by default, -name for descending), the next page's cursor
+# comes back in the X-Next-Cursor header; active means no end_date or one in the future
+@router.get("/employees", response_model=List[Union[EmployeeResponse, PartialEmployeeResponse]], response_model_exclude_unset=True)
+async def get_all_employees_endpoint(response:Response, limit:int = Query(100, ge=1, le=1000), cursor:Optional[str] = None,
+                                     sort:Literal["id", "-id", "name", "-name", "start_date", "-start_date"] = "id",
+                                     company_id:Optional[int] = None, tier_type:Optional[str] = None, is_onsite:Optional[bool] = None,
+                                     active:Optional[bool] = None, fields:Optional[str] = None):
+    employees, next_cursor = await get_employees_page_control(limit, cursor, sort, company_id, tier_type, is_onsite, active, fields)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return employees
\ No newline at end of file
@@ -0,0 +1,211 @@
+import asyncio
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Tuple, Union
+import os
+import zipfile
+from .payroll_crud import get_payroll_employees, get_reports_by_employee
+from modules.rollups.rollups_crud import get_rollups
+from modules.static_values.static_values_crud import get_static_values, get_static_values_as_of
+from services.payroll import compute_payroll, compute_payroll_from_reports, month_bounds
+from services.exportPdf import render_salary_pdfs
+from services.payslip_cache import payslip_cache, payslip_content_key
+from services.payslip_archive import payslip_archive
+from services.payslip_renderer import get_render_context
+from shared.models_schemas.models import StaticValues
+from shared.models_schemas.schemas import PayrollRunRequest, PayrollRunResponse, PayrollResult, PayrollCloseResponse
+
+
+exception_error = HTTPException(status_code=404, detail="static_values not found")
+month_open_error = HTTPException(status_code=400, detail="month is not over yet")
+not_archived_error = HTTPException(status_code=404, detail="payslip not archived")
+
+PAYSLIPS_DIR = os.getenv("PAYSLIPS_DIR") or os.path.join(os.path.dirname(__file__), '..', '..', '..', 'payslips')
+
+
+# the given static values, or without values_id the version in force on the first day of the run's month
+async def get_run_static_values(run:PayrollRunRequest) -> StaticValues:
+    if run.values_id is None:
+        static_values = await get_static_values_as_of(datetime(run.year, run.month, 1))
+    else:
+        static_values = await get_static_values(run.values_id)
+    if static_values is None:
+        raise exception_error
+    return static_values
+
+
+# month-end figures for every employee of the run without itemized lines:
+# the report totals are read from the monthly rollups, no report document is touched
+async def payroll_summary_control(run:PayrollRunRequest) -> List[PayrollResult]:
+    static_values = await get_run_static_values(run)
+    period = datetime(run.year, run.month, 1)
+    start_of_month, _ = month_bounds(period)
+    employees = await get_payroll_employees(start_of_month, run.company_id)
+    totals = await get_rollups(run.year, run.month, [employee.id for employee in employees])
+    return [compute_payroll(employee, static_values, totals[employee.id], period) for employee in employees]
+
+
+# yields (employee_id, pdf bytes or the rendering error) for every employee of the run.
+# Payslips whose inputs were already rendered come straight from the cache,
+# the rest are computed here and rendered on the process pool as they complete.
+async def iter_payslips(run:PayrollRunRequest, static_values:StaticValues) -> AsyncIterator[Tuple[int, Union[bytes, Exception]]]:
+    period = datetime(run.year, run.month, 1)
+    start_of_month, next_month = month_bounds(period)
+    employees = await get_payroll_employees(start_of_month, run.company_id)
+    reports = await get_reports_by_employee([employee.id for employee in employees], start_of_month, next_month)
+
+    payslips = {}
+    content_keys = {}
+    template_version = get_render_context().version
+    static_values_data = static_values.model_dump()
+    for employee in employees:
+        content_key = payslip_content_key(employee.model_dump(), reports[employee.id], static_values_data, period, template_version)
+        cached_pdf = payslip_cache.get(content_key)
+        if cached_pdf is not None:
+            yield employee.id, cached_pdf
+            continue
+        content_keys[employee.id] = content_key
+        payslips[employee.id] = compute_payroll_from_reports(employee, static_values, reports[employee.id], period).model_dump()
+
+    async for employee_id, pdf in render_salary_pdfs(payslips):
+        if not isinstance(pdf, Exception):
+            payslip_cache.put(content_keys[employee_id], pdf)
+        yield employee_id, pdf
+
+
+def _write_pdf(path:str, pdf:bytes):
+    with open(path, "wb") as pdf_file:
+        pdf_file.write(pdf)
+
+
+# write every payslip of the month to PAYSLIPS_DIR/<year>-<month>/, the files are written
+# on a thread so the event loop keeps serving while a run is in progress
+async def run_payroll_control(run:PayrollRunRequest) -> PayrollRunResponse:
+    static_values = await get_run_static_values(run)
+
+    output_dir = os.path.abspath(os.path.join(PAYSLIPS_DIR, f"{run.year}-{run.month:02d}"))
+    await asyncio.to_thread(os.makedirs, output_dir, exist_ok=True)
+
+    generated = 0
+    errors = {}
+    async for employee_id, pdf in iter_payslips(run, static_values):
+        if isinstance(pdf, Exception):
+            errors[employee_id] = f"Error generating PDF: {str(pdf)}"
+            continue
+        await asyncio.to_thread(_write_pdf, os.path.join(output_dir, f"{employee_id}.pdf"), pdf)
+        generated += 1
+
+    return PayrollRunResponse(year=run.year, month=run.month, output_dir=output_dir, employees=generated + len(errors), generated=generated, errors=errors)
+
+
+# Write-only file object for zipfile: it has no tell/seek, so zipfile streams the
+# archive with data descriptors and everything written so far can be drained.
+class _ZipStream:
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def iter_payslips_zip(run:PayrollRunRequest, static_values:StaticValues) -> AsyncIterator[bytes]:
+    stream = _ZipStream()
+    errors = []
+    # PDFs are already compressed, storing them keeps the archive cheap to build
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for employee_id, pdf in iter_payslips(run, static_values):
+            if isinstance(pdf, Exception):
+                errors.append(f"{employee_id}: Error generating PDF: {str(pdf)}")
+                continue
+            archive.writestr(f"{employee_id}.pdf", pdf)
+            yield stream.drain()
+        if errors:
+            archive.writestr("errors.txt", "\n".join(errors))
+    yield stream.drain()
+
+
+# stream a ZIP of every payslip of the month, each PDF is sent as soon as it is rendered
+async def zip_payslips_control(run:PayrollRunRequest) -> StreamingResponse:
+    static_values = await get_run_static_values(run)
+    filename = f"payslips_{run.year}-{run.month:02d}.zip"
+    return StreamingResponse(
+        iter_payslips_zip(run, static_values),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# Freeze every payslip of a finished month in the archive, with the inputs it was computed from.
+# Payslips archived by an earlier close are left untouched, so a close can be re-run after errors.
+async def close_month_control(run:PayrollRunRequest) -> PayrollCloseResponse:
+    static_values = await get_run_static_values(run)
+    period = datetime(run.year, run.month, 1)
+    start_of_month, next_month = month_bounds(period)
+    if next_month > datetime.now(timezone.utc).replace(tzinfo=None):
+        raise month_open_error
+
+    employees = await get_payroll_employees(start_of_month, run.company_id)
+    reports = await get_reports_by_employee([employee.id for employee in employees], start_of_month, next_month)
+
+    already_archived = 0
+    archived = 0
+    errors = {}
+    payslips = {}
+    inputs = {}
+    template_version = get_render_context().version
+    static_values_data = static_values.model_dump()
+    for employee in employees:
+        if payslip_archive.lookup(employee.id, period, static_values.id) is not None:
+            already_archived += 1
+            continue
+        salary_data = compute_payroll_from_reports(employee, static_values, reports[employee.id], period).model_dump()
+        inputs[employee.id] = {
+            "employee": employee.model_dump(),
+            "reports": [{k: v for k, v in report.items() if k != "_id"} for report in reports[employee.id]],
+            "static_values": static_values_data,
+            "salary_data": salary_data,
+            "template_version": template_version,
+        }
+        # a payslip rendered from the very same inputs is archived as is
+        cached_pdf = payslip_cache.get(payslip_content_key(employee.model_dump(), reports[employee.id], static_values_data, period, template_version))
+        if cached_pdf is not None:
+            archived += payslip_archive.put(employee.id, period, static_values.id, cached_pdf, inputs[employee.id])
+            continue
+        payslips[employee.id] = salary_data
+
+    async for employee_id, pdf in render_salary_pdfs(payslips):
+        if isinstance(pdf, Exception):
+            errors[employee_id] = f"Error generating PDF: {str(pdf)}"
+            continue
+        archived += payslip_archive.put(employee_id, period, static_values.id, pdf, inputs[employee_id])
+
+    return PayrollCloseResponse(
+        year=run.year, month=run.month, output_dir=payslip_archive.month_dir(period),
+        employees=len(employees), generated=archived, already_archived=already_archived, errors=errors,
+    )
+
+
+# archived payslips are served straight from disk, nothing is queried or rendered
+async def get_archived_payslip_control(employee_id:int, year:int, month:int, values_id:int) -> FileResponse:
+    path = payslip_archive.lookup(employee_id, datetime(year, month, 1), values_id)
+    if path is None:
+        raise not_archived_error
+    return FileResponse(path, media_type="application/pdf", filename=f"payslip_{employee_id}_{year}-{month:02d}.pdf")
+
+
+async def get_archived_payslip_inputs_control(employee_id:int, year:int, month:int, values_id:int) -> FileResponse:
+    period = datetime(year, month, 1)
+    if payslip_archive.lookup(employee_id, period, values_id) is None:
+        raise not_archived_error
+    return FileResponse(payslip_archive.inputs_path(employee_id, period, values_id), media_type="application/json")
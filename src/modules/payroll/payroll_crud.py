@@ -0,0 +1,95 @@
+from typing import Optional, List, Dict
+from datetime import datetime
+from shared.models_schemas.models import Employee
+from shared.models_schemas.schemas import MonthlyReportTotals
+from services.payroll import WORKING_DAY_HOURS
+from config.database.database import employee_collection, daily_report_collection
+from modules.daily_reports.report_buckets_crud import buckets_enabled, get_bucket_reports
+import os
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+
+# Bulk reads used by payroll runs
+
+# employees still employed at the start of the period, optionally for one company
+async def get_payroll_employees(start_date:datetime, company_id:Optional[int] = None) -> List[Employee]:
+    query = {"$or": [{"end_date": None}, {"end_date": {"$gte": start_date}}]}
+    if company_id is not None:
+        query["company_id"] = company_id
+
+    if os.getenv("TESTING") == "True":
+        employees = list(employee_collection.find(query))
+    else:
+        employees = await employee_collection.find(query).to_list(length=None)
+    return [Employee(**employee) for employee in employees]
+
+
+# every report in [start_date, end_date) for the given employees, grouped by employee_id
+async def get_reports_by_employee(employee_ids:List[int], start_date:datetime, end_date:datetime) -> Dict[int, List[dict]]:
+    if buckets_enabled():
+        return await get_bucket_reports(employee_ids, start_date, end_date)
+    query = {
+        "employee_id": {"$in": employee_ids},
+        "date": {"$gte": start_date, "$lt": end_date}
+    }
+    sort = [("employee_id", 1), ("date", 1)]
+
+    if os.getenv("TESTING") == "True":
+        reports = list(daily_report_collection.find(query).sort(sort))
+    else:
+        reports = await daily_report_collection.find(query).sort(sort).to_list(length=None)
+
+    grouped = {employee_id: [] for employee_id in employee_ids}
+    for report in reports:
+        grouped[report["employee_id"]].append(report)
+    return grouped
+
+
+# $group accumulators producing MonthlyReportTotals fields, mirrors ReportColumns.totals()
+def monthly_totals_accumulators() -> dict:
+    hours = "$working_hours"
+    return {
+        "report_count": {"$sum": 1},
+        "present_days": {"$sum": {"$cond": [{"$eq": ["$adherence_status", True]}, 1, 0]}},
+        "missing_hours": {"$sum": {"$cond": [
+            {"$and": [{"$ne": [hours, 0]}, {"$lt": [hours, WORKING_DAY_HOURS]}]},
+            {"$subtract": [WORKING_DAY_HOURS, hours]}, 0]}},
+        "overtime_hours": {"$sum": {"$cond": [{"$gt": [hours, WORKING_DAY_HOURS]}, {"$subtract": [hours, WORKING_DAY_HOURS]}, 0]}},
+        "saturday_hours": {"$sum": {"$cond": [{"$eq": ["$is_saturday", True]}, hours, 0]}},
+        "qualified_appointments": {"$sum": "$appointment.no_of_qualified_appointment"},
+        "kpis": {"$sum": "$compensation.kpis"},
+        "spiffs": {"$sum": "$compensation.spiffs"},
+        "butter_up": {"$sum": "$compensation.butter_up"},
+        "deductions": {"$sum": "$deductions.deductions"},
+    }
+
+
+# Monthly payroll totals per employee computed by Mongo
+def monthly_totals_pipeline(start_date:datetime, end_date:datetime, employee_ids:Optional[List[int]] = None) -> list:
+    match = {"date": {"$gte": start_date, "$lt": end_date}}
+    if employee_ids is not None:
+        match["employee_id"] = {"$in": employee_ids}
+    return [
+        {"$match": match},
+        {"$group": {"_id": "$employee_id", **monthly_totals_accumulators()}},
+    ]
+
+
+# one round trip for the month's totals of every (or the given) employee
+async def get_monthly_totals(start_date:datetime, end_date:datetime, employee_ids:Optional[List[int]] = None) -> Dict[int, MonthlyReportTotals]:
+    pipeline = monthly_totals_pipeline(start_date, end_date, employee_ids)
+    if os.getenv("TESTING") == "True":
+        groups = list(daily_report_collection.aggregate(pipeline))
+    else:
+        groups = await daily_report_collection.aggregate(pipeline).to_list(length=None)
+
+    totals = {employee_id: MonthlyReportTotals() for employee_id in employee_ids or []}
+    for group in groups:
+        employee_id = group.pop("_id")
+        group["absent_days"] = group["report_count"] - group["present_days"]
+        totals[employee_id] = MonthlyReportTotals(**group)
+    return totals
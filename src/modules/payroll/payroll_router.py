@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Depends, Path
+from typing import List, Optional
+from shared.models_schemas.schemas import PayrollRunRequest, PayrollRunResponse, PayrollResult, PayrollCloseResponse
+from modules.auth.authorizations import get_superadmin
+from .payroll_controller import run_payroll_control, zip_payslips_control, payroll_summary_control, close_month_control, get_archived_payslip_control, get_archived_payslip_inputs_control
+
+
+router = APIRouter()
+
+# payroll endpoints
+
+@router.post("/payroll_runs", response_model=PayrollRunResponse)
+async def run_payroll_endpoint(run:PayrollRunRequest):
+    return await run_payroll_control(run)
+
+
+# without values_id the static values version in force at the start of the month is used
+@router.get("/payroll_runs/{year}/{month}/payslips.zip")
+@router.get("/payroll_runs/{year}/{month}/{values_id}/payslips.zip")
+async def zip_payslips_endpoint(year:int, values_id:Optional[int] = None, month:int = Path(ge=1, le=12), company_id:Optional[int] = None):
+    return await zip_payslips_control(PayrollRunRequest(year=year, month=month, values_id=values_id, company_id=company_id))
+
+
+@router.get("/payroll_runs/{year}/{month}/summary", response_model=List[PayrollResult])
+@router.get("/payroll_runs/{year}/{month}/{values_id}/summary", response_model=List[PayrollResult])
+async def payroll_summary_endpoint(year:int, values_id:Optional[int] = None, month:int = Path(ge=1, le=12), company_id:Optional[int] = None):
+    return await payroll_summary_control(PayrollRunRequest(year=year, month=month, values_id=values_id, company_id=company_id))
+
+
+@router.post("/payroll_runs/close", response_model=PayrollCloseResponse, dependencies=[Depends(get_superadmin)])
+async def close_month_endpoint(run:PayrollRunRequest):
+    return await close_month_control(run)
+
+
+@router.get("/payslip_archive/{year}/{month}/{values_id}/{employee_id}.pdf")
+async def get_archived_payslip_endpoint(year:int, values_id:int, employee_id:int, month:int = Path(ge=1, le=12)):
+    return await get_archived_payslip_control(employee_id, year, month, values_id)
+
+
+@router.get("/payslip_archive/{year}/{month}/{values_id}/{employee_id}.json")
+async def get_archived_payslip_inputs_endpoint(year:int, values_id:int, employee_id:int, month:int = Path(ge=1, le=12)):
+    return await get_archived_payslip_inputs_control(employee_id, year, month, values_id)
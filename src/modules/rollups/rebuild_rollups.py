@@ -0,0 +1,16 @@
+# Re-derive monthly rollups from the raw daily reports.
+#
+#   cd src && python -m modules.rollups.rebuild_rollups [year month]
+import asyncio
+import sys
+from .rollups_crud import rebuild_rollups
+
+
+async def main(args:list):
+    year, month = (int(args[0]), int(args[1])) if len(args) == 2 else (None, None)
+    rollups = await rebuild_rollups(year, month)
+    print(f"rebuilt {rollups} monthly rollups")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
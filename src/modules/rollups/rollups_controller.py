@@ -0,0 +1,22 @@
+from fastapi import HTTPException
+from typing import Optional
+from .rollups_crud import get_rollup, get_rollup_drift, rebuild_rollups
+
+
+exception_error = HTTPException(status_code=400, detail="year and month must be given together")
+
+
+async def get_rollup_control(employee_id:int, year:int, month:int):
+    return await get_rollup(employee_id, year, month)
+
+
+async def rebuild_rollups_control(year:Optional[int], month:Optional[int]):
+    if (year is None) != (month is None):
+        raise exception_error
+    rollups = await rebuild_rollups(year, month)
+    return {"rollups": rollups}
+
+
+async def get_rollup_drift_control(year:int, month:int):
+    checked, drifted = await get_rollup_drift(year, month)
+    return {"year": year, "month": month, "checked": checked, "drifted": drifted}
@@ -0,0 +1,219 @@
+import logging
+import math
+from typing import Optional, List, Dict, Iterable, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime
+from config.database.database import monthly_rollup_collection, daily_report_collection
+from modules.payroll.payroll_crud import get_monthly_totals, monthly_totals_accumulators
+from services.payroll import month_bounds, report_totals
+from shared.models_schemas.schemas import MonthlyReportTotals, MonthlyRollup
+from shared.documents import WRITE_ID, new_write_id
+import os
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+logger = logging.getLogger(__name__)
+
+# rounds of a rebuild, the rollups written to during one round are rebuilt again in the next
+REBUILD_ROUNDS = 3
+
+
+# Monthly rollups hold the running MonthlyReportTotals of one (employee_id, year, month),
+# kept current with $inc from every daily report write. Every write also bumps the rollup's
+# version, which lets a rebuild tell whether a rollup changed while it was being recomputed.
+#
+# Every report write stamps the report with a new write_id and a rollup records the write ids
+# of the reports it counts in `applied`. A delta only takes out a report whose write the rollup
+# counts and only adds one it does not, so the delta of a write a rebuild already aggregated is
+# a no-op whenever it lands. Reports written before write ids existed are applied unconditionally.
+
+def _rollup_key(report:dict) -> tuple:
+    report_date = report["date"]
+    if isinstance(report_date, str):
+        report_date = datetime.fromisoformat(report_date)
+    return report["employee_id"], report_date.year, report_date.month
+
+
+# a missing rollup is only created for a report that is added, not for one whose write it has to count already
+def _delta_request(key:tuple, increments:dict, removed_id:Optional[str], added_id:Optional[str], upsert:bool) -> UpdateOne:
+    query = _key_query(key)
+    update = {"$inc": {**{field: value for field, value in increments.items() if value != 0}, "version": 1}}
+    if removed_id is not None:
+        query[f"applied.{removed_id}"] = {"$exists": True}
+        update["$unset"] = {f"applied.{removed_id}": ""}
+    if added_id is not None:
+        query[f"applied.{added_id}"] = {"$exists": False}
+        update["$set"] = {f"applied.{added_id}": True}
+    return UpdateOne(query, update, upsert=upsert)
+
+
+# apply the differences between reports before and after their writes
+# (None when a report did not / no longer exists), one round trip for the whole batch
+async def apply_report_deltas(changes:Iterable[Tuple[Optional[dict], Optional[dict]]]):
+    requests = []
+    for before, after in changes:
+        before_id = before.get(WRITE_ID) if before else None
+        after_id = after.get(WRITE_ID) if after else None
+        if before_id is not None and before_id == after_id:
+            # the write did not happen
+            continue
+        before_key = _rollup_key(before) if before else None
+        after_key = _rollup_key(after) if after else None
+        if before_key == after_key:
+            before_totals, after_totals = report_totals(before), report_totals(after)
+            increments = {field: after_totals[field] - before_totals[field] for field in after_totals}
+            requests.append(_delta_request(after_key, increments, before_id, after_id, before_id is None))
+            continue
+        if before:
+            requests.append(_delta_request(before_key, {field: -value for field, value in report_totals(before).items()}, before_id, None, False))
+        if after:
+            requests.append(_delta_request(after_key, report_totals(after), None, after_id, True))
+    if not requests:
+        return
+    try:
+        if os.getenv("TESTING") == "True":
+            monthly_rollup_collection.bulk_write(requests, ordered=False)
+        else:
+            await monthly_rollup_collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        # an upsert whose write a rebuild already counted collides with the existing rollup, nothing to apply
+        if any(write_error["code"] != 11000 for write_error in e.details["writeErrors"]):
+            raise
+
+
+async def apply_report_delta(before:Optional[dict], after:Optional[dict]):
+    await apply_report_deltas([(before, after)])
+
+
+def _to_totals(rollup:dict) -> MonthlyReportTotals:
+    return MonthlyReportTotals(**{field: rollup.get(field, 0) for field in MonthlyReportTotals.model_fields})
+
+
+async def get_rollup(employee_id:int, year:int, month:int) -> MonthlyRollup:
+    query = {"employee_id": employee_id, "year": year, "month": month}
+    if os.getenv("TESTING") == "True":
+        rollup = monthly_rollup_collection.find_one(query)
+    else:
+        rollup = await monthly_rollup_collection.find_one(query)
+    totals = _to_totals(rollup or {})
+    return MonthlyRollup(employee_id=employee_id, year=year, month=month, **totals.model_dump())
+
+
+# totals of a month for the given employees in one indexed read
+async def get_rollups(year:int, month:int, employee_ids:List[int]) -> Dict[int, MonthlyReportTotals]:
+    query = {"year": year, "month": month, "employee_id": {"$in": employee_ids}}
+    if os.getenv("TESTING") == "True":
+        rollups = list(monthly_rollup_collection.find(query))
+    else:
+        rollups = await monthly_rollup_collection.find(query).to_list(length=None)
+
+    totals = {employee_id: MonthlyReportTotals() for employee_id in employee_ids}
+    for rollup in rollups:
+        totals[rollup["employee_id"]] = _to_totals(rollup)
+    return totals
+
+
+def _same_totals(left:MonthlyReportTotals, right:MonthlyReportTotals) -> bool:
+    # the rollups are summed one $inc at a time, fractional hours may differ in the last digits
+    return all(math.isclose(getattr(left, field), getattr(right, field), abs_tol=1e-6) for field in MonthlyReportTotals.model_fields)
+
+
+# Compare a month's rollups with the totals Mongo aggregates from the raw reports.
+# Returns how many employees were checked and the ones whose rollup drifted (rebuild_rollups repairs them).
+async def get_rollup_drift(year:int, month:int) -> Tuple[int, List[int]]:
+    start_of_month, next_month = month_bounds(datetime(year, month, 1))
+    expected = await get_monthly_totals(start_of_month, next_month)
+    query = {"year": year, "month": month}
+    if os.getenv("TESTING") == "True":
+        rollups = list(monthly_rollup_collection.find(query))
+    else:
+        rollups = await monthly_rollup_collection.find(query).to_list(length=None)
+    actual = {rollup["employee_id"]: _to_totals(rollup) for rollup in rollups}
+
+    employee_ids = set(expected) | set(actual)
+    drifted = [employee_id for employee_id in sorted(employee_ids)
+               if not _same_totals(expected.get(employee_id, MonthlyReportTotals()), actual.get(employee_id, MonthlyReportTotals()))]
+    return len(employee_ids), drifted
+
+
+def _key_query(key:tuple) -> dict:
+    employee_id, year, month = key
+    return {"employee_id": employee_id, "year": year, "month": month}
+
+
+# Re-derive the rollups from the raw reports, for every month or just one.
+# Rollups are replaced in place, one conditional upsert per key, so readers never see a month
+# empty and the $inc of report writes keep applying. A rollup is only replaced if its version
+# is still the one read before the reports were aggregated; the ones a write got to in between
+# are recomputed in the next round. Months whose reports are all gone keep a zeroed rollup.
+async def rebuild_rollups(year:Optional[int] = None, month:Optional[int] = None) -> int:
+    match = {}
+    scope = {}
+    if year is not None and month is not None:
+        start_of_month = datetime(year, month, 1)
+        next_month = datetime(year, month + 1, 1) if month < 12 else datetime(year + 1, 1, 1)
+        match = {"date": {"$gte": start_of_month, "$lt": next_month}}
+        scope = {"year": year, "month": month}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"employee_id": "$employee_id", "year": {"$year": "$date"}, "month": {"$month": "$date"}},
+            **monthly_totals_accumulators(),
+            "applied": {"$addToSet": f"${WRITE_ID}"},
+        }},
+    ]
+    zero_totals = {field: 0 for field in MonthlyReportTotals.model_fields}
+
+    pending = None
+    totals = {}
+    for _ in range(REBUILD_ROUNDS):
+        # versions first: a write landing after this read moves the version, whether or not the aggregation saw it
+        version_projection = {"employee_id": 1, "year": 1, "month": 1, "version": 1}
+        if os.getenv("TESTING") == "True":
+            versions = {(rollup["employee_id"], rollup["year"], rollup["month"]): rollup.get("version") for rollup in monthly_rollup_collection.find(scope, version_projection)}
+            groups = list(daily_report_collection.aggregate(pipeline))
+        else:
+            versions = {(rollup["employee_id"], rollup["year"], rollup["month"]): rollup.get("version") for rollup in await monthly_rollup_collection.find(scope, version_projection).to_list(length=None)}
+            groups = await daily_report_collection.aggregate(pipeline).to_list(length=None)
+
+        totals = {}
+        for group in groups:
+            key = _rollup_key({"employee_id": group["_id"]["employee_id"], "date": datetime(group["_id"]["year"], group["_id"]["month"], 1)})
+            group.pop("_id")
+            group["applied"] = {write_id: True for write_id in group["applied"] if write_id is not None}
+            group["absent_days"] = group["report_count"] - group["present_days"]
+            totals[key] = group
+
+        keys = set(versions) | set(totals) if pending is None else pending
+        # the token marks the rollups this round replaced
+        token = ObjectId()
+        requests = []
+        for key in keys:
+            version = versions.get(key)
+            query = {**_key_query(key), "version": version if version is not None else {"$exists": False}}
+            requests.append(UpdateOne(query, {"$set": {**zero_totals, "applied": {}, **totals.get(key, {}), "rebuild": token}}, upsert=True))
+        if not requests:
+            break
+        try:
+            if os.getenv("TESTING") == "True":
+                monthly_rollup_collection.bulk_write(requests, ordered=False)
+            else:
+                await monthly_rollup_collection.bulk_write(requests, ordered=False)
+        except BulkWriteError:
+            # a version that moved turns the upsert into a duplicate of the existing rollup, it stays pending
+            pass
+        if os.getenv("TESTING") == "True":
+            replaced = list(monthly_rollup_collection.find({"rebuild": token}, version_projection))
+        else:
+            replaced = await monthly_rollup_collection.find({"rebuild": token}, version_projection).to_list(length=None)
+        pending = keys - {(rollup["employee_id"], rollup["year"], rollup["month"]) for rollup in replaced}
+        if not pending:
+            break
+    if pending:
+        logger.warning("rollups still written to after %d rebuild rounds: %s", REBUILD_ROUNDS, sorted(pending))
+    return len(totals)
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends, Path
+from typing import Optional
+from shared.models_schemas.schemas import MonthlyRollup, RollupDriftResponse, RollupRebuildResponse
+from modules.auth.authorizations import get_superadmin
+from .rollups_controller import get_rollup_control, get_rollup_drift_control, rebuild_rollups_control
+
+
+router = APIRouter()
+
+# monthly rollups endpoints
+
+# the month's rollups checked against the raw reports, declared first so /{employee_id}/{year}/{month} does not shadow it
+@router.get("/monthly_rollups/{year}/{month}/drift", response_model=RollupDriftResponse)
+async def get_rollup_drift_endpoint(year:int, month:int = Path(ge=1, le=12)):
+    return await get_rollup_drift_control(year, month)
+
+
+@router.get("/monthly_rollups/{employee_id}/{year}/{month}", response_model=MonthlyRollup)
+async def get_rollup_endpoint(employee_id:int, year:int, month:int = Path(ge=1, le=12)):
+    return await get_rollup_control(employee_id, year, month)
+
+
+@router.post("/monthly_rollups/rebuild", response_model=RollupRebuildResponse, dependencies=[Depends(get_superadmin)])
+async def rebuild_rollups_endpoint(year:Optional[int] = None, month:Optional[int] = None):
+    return await rebuild_rollups_control(year, month)
@@ -1,8 +1,13 @@
 from fastapi import HTTPException
-from .static_values_crud import  create_static_values, get_static_values, update_static_values, delete_static_values
+from datetime import datetime
+from .static_values_crud import  create_static_values, create_static_values_version, get_static_values, get_static_values_as_of, update_static_values, delete_static_values
 from shared.models_schemas.schemas import StaticValuesCreate
 
 exception_error = HTTPException(status_code=404, detail="static_values not found")
+effective_from_error = HTTPException(status_code=400, detail="effective_from is required for a version")
+later_version_error = HTTPException(status_code=409, detail="a version starting at or after effective_from already exists")
+in_force_error = HTTPException(status_code=409, detail="static_values in force cannot be changed, create a new version instead")
+effective_dates_error = HTTPException(status_code=400, detail="effective dates are set by creating a version")
 
 
 async def create_static_values_control(values:StaticValuesCreate):
@@ -10,15 +15,35 @@ async def create_static_values_control(values:StaticValuesCreate):
     return create_static_value
 
 
+async def create_static_values_version_control(values:StaticValuesCreate):
+    if values.effective_from is None:
+        raise effective_from_error
+    version = await create_static_values_version(values)
+    if version is None:
+        raise later_version_error
+    return version
+
+
+async def get_static_values_as_of_control(as_of:datetime):
+    values = await get_static_values_as_of(as_of)
+    if values is None:
+        raise exception_error
+    return values
+
+
 async def get_static_values_control(values_id:int):
     values  = await get_static_values(values_id)
     return values
 
 
 async def update_static_values_control(values_id:int, values_update:dict):
+    if "effective_from" in values_update or "effective_to" in values_update:
+        raise effective_dates_error
     updated_static_values = await update_static_values(values_id, values_update)
     if not updated_static_values:
-        raise exception_error
+        if await get_static_values(values_id) is None:
+            raise exception_error
+        raise in_force_error
     return updated_static_values
 
 
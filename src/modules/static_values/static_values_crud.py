@@ -1,5 +1,12 @@
+from datetime import datetime
+from typing import Optional, Tuple
 from shared.models_schemas.models import StaticValues
 from config.database.database import static_values_collection
+from services.payslip_cache import payslip_cache
+from services.static_values_cache import static_values_cache
+from services.events import STATIC_VALUES, event_bus
+from shared.documents import apply_set
+from pymongo import ReturnDocument
 import os
 from dotenv import load_dotenv
 
@@ -16,9 +23,81 @@ async def create_static_values(values : StaticValues):
         static_values_collection.insert_one(values_dict)
     else:
         await static_values_collection.insert_one(values_dict)        
+    await static_values_cache.changed()
+    event_bus.publish(STATIC_VALUES, "create", values.id, None, values_dict)
     return values
 
+# Versions: a new version starts at its effective_from and closes the versions still open then.
+# Documents without effective dates (written before versions) are in force until the first version.
+
+# the version in force at as_of: open at as_of, the latest effective_from wins (then the highest id)
+def as_of_query(as_of:datetime) -> dict:
+    return {"$and": [
+        {"$or": [{"effective_from": None}, {"effective_from": {"$lte": as_of}}]},
+        {"$or": [{"effective_to": None}, {"effective_to": {"$gt": as_of}}]},
+    ]}
+
+AS_OF_SORT = [("effective_from", -1), ("id", -1)]
+
+async def create_static_values_version(values:StaticValues) -> Optional[StaticValues]:
+    # the latest version has to start before the new one, history is not rewritten
+    if os.getenv("TESTING") == "True":
+        latest = static_values_collection.find_one({"effective_from": {"$gte": values.effective_from}})
+    else:
+        latest = await static_values_collection.find_one({"effective_from": {"$gte": values.effective_from}})
+    if latest:
+        return None
+
+    close = ({"$or": [{"effective_to": None}, {"effective_to": {"$gt": values.effective_from}}]}, {"$set": {"effective_to": values.effective_from}})
+    values.effective_to = None
+    values_dict = values.model_dump()
+    if os.getenv("TESTING") == "True":
+        closed_ids = [closed["id"] for closed in static_values_collection.find(close[0], {"id": 1})]
+        static_values_collection.update_many(*close)
+        static_values_collection.insert_one(values_dict)
+    else:
+        closed_ids = [closed["id"] for closed in await static_values_collection.find(close[0], {"id": 1}).to_list(length=None)]
+        await static_values_collection.update_many(*close)
+        await static_values_collection.insert_one(values_dict)
+    for values_id in closed_ids:
+        payslip_cache.invalidate_static_values(values_id)
+    await static_values_cache.changed()
+    event_bus.publish(STATIC_VALUES, "create", values.id, None, values_dict)
+    return values
+
+# served from the interval map of static_values_cache, the collection is only read for a date no resolved version covers
+async def get_static_values_as_of(as_of:datetime) -> Optional[StaticValues]:
+    return await static_values_cache.as_of(as_of, lambda: load_static_values_as_of(as_of))
+
+# the version in force at as_of with the bounds around as_of where any version starts or ends:
+# the documents open in between, and so the version in force, are the same on the whole range
+async def load_static_values_as_of(as_of:datetime, collection=None) -> Tuple[Optional[StaticValues], datetime, datetime]:
+    if collection is None:
+        collection = static_values_collection
+    if os.getenv("TESTING") == "True":
+        values = collection.find_one(as_of_query(as_of), sort=AS_OF_SORT)
+    else:
+        values = await collection.find_one(as_of_query(as_of), sort=AS_OF_SORT)
+    starts = [await _bound(collection, field, "$lte", as_of, -1) for field in ("effective_from", "effective_to")]
+    ends = [await _bound(collection, field, "$gt", as_of, 1) for field in ("effective_from", "effective_to")]
+    start = max([bound for bound in starts if bound is not None], default=datetime.min)
+    end = min([bound for bound in ends if bound is not None], default=datetime.max)
+    return (StaticValues(**values) if values else None), start, end
+
+# the closest value of field to as_of on the side given by operator
+async def _bound(collection, field:str, operator:str, as_of:datetime, direction:int) -> Optional[datetime]:
+    query = ({field: {operator: as_of}}, {field: 1, "_id": 0})
+    if os.getenv("TESTING") == "True":
+        bound = collection.find_one(*query, sort=[(field, direction)])
+    else:
+        bound = await collection.find_one(*query, sort=[(field, direction)])
+    return bound[field] if bound else None
+
+# served from static_values_cache, the collection is only read on a miss
 async def get_static_values(values_id: int):
+    return await static_values_cache.get(values_id, lambda: _load_static_values(values_id))
+
+async def _load_static_values(values_id: int):
     if os.getenv("TESTING") == "True":
         # Use synchronous find_one for tests
         values = static_values_collection.find_one({"id": values_id})
@@ -31,28 +110,40 @@ async def get_static_values(values_id: int):
     return None
 
 
+# only a version starting later may change: the payroll already computed with a version in force
+# would not match its rates any more, a new version is needed. Documents without effective dates
+# (written before versions) stay editable as they always were, the stored salaries of their range are recomputed.
 async def update_static_values(values_id:int, update_data:dict):
+    query = {"id": values_id, "$or": [{"effective_from": None}, {"effective_from": {"$gt": datetime.now()}}]}
     if os.getenv("TESTING") == "True":
-        updated_static_values = static_values_collection.find_one_and_update(
-            {"id" : values_id},
+        previous_static_values = static_values_collection.find_one_and_update(
+            query,
             {"$set" : update_data},
-            return_document = True
+            return_document = ReturnDocument.BEFORE
         )
     else:
-        updated_static_values = await static_values_collection.find_one_and_update(
-            {"id" : values_id},
+        previous_static_values = await static_values_collection.find_one_and_update(
+            query,
             {"$set" : update_data},
-            return_document = True
+            return_document = ReturnDocument.BEFORE
         )
-    if updated_static_values:
+    payslip_cache.invalidate_static_values(values_id)
+    await static_values_cache.changed()
+    if previous_static_values:
+        updated_static_values = apply_set(previous_static_values, update_data)
+        event_bus.publish(STATIC_VALUES, "update", values_id, previous_static_values, updated_static_values)
         return StaticValues(**updated_static_values)
     return None
 
+# the deleted document is published, the subscribers recompute what depended on its range
 async def delete_static_values(values_id : int) -> bool:
     if os.getenv("TESTING") == "True":
-        result = static_values_collection.delete_one({"id":values_id})
+        deleted_static_values = static_values_collection.find_one_and_delete({"id":values_id})
     else:
-        result = await static_values_collection.delete_one({"id":values_id})
-    if result:
+        deleted_static_values = await static_values_collection.find_one_and_delete({"id":values_id})
+    payslip_cache.invalidate_static_values(values_id)
+    await static_values_cache.changed()
+    if deleted_static_values:
+        event_bus.publish(STATIC_VALUES, "delete", values_id, deleted_static_values, None)
         return True
     return False
\ No newline at end of file
@@ -1,6 +1,7 @@
 from fastapi import APIRouter
+from datetime import datetime
 from shared.models_schemas.schemas import StaticValuesCreate, StaticValuesResponse 
-from .static_values_controller import create_static_values_control, get_static_values_control, update_static_values_control, delete_static_values_control
+from .static_values_controller import create_static_values_version_control, get_static_values_as_of_control, create_static_values_control, get_static_values_control, update_static_values_control, delete_static_values_control
 
 
 router = APIRouter()
@@ -11,6 +12,17 @@ async def create_static_values_endpoint(values:StaticValuesCreate):
     return await create_static_values_control(values)
 
 
+# a new version in force from its effective_from, the versions open until then end there
+@router.post("/static_values/versions", response_model=StaticValuesResponse)
+async def create_static_values_version_endpoint(values:StaticValuesCreate):
+    return await create_static_values_version_control(values)
+
+
+@router.get("/static_values/as_of/{as_of}", response_model=StaticValuesResponse)
+async def get_static_values_as_of_endpoint(as_of:datetime):
+    return await get_static_values_as_of_control(as_of)
+
+
 @router.get("/static_values/{values_id}", response_model=StaticValuesResponse)
 async def get_employee_endpoint(values_id:int):
     return await get_static_values_control(values_id)
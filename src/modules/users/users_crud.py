@@ -3,6 +3,7 @@ from shared.models_schemas.models import User
 from config.database.database import user_collection
 from shared.models_schemas.schemas import UserCreate, UserInDB
 from modules.auth.authentication import get_password_hash
+from services.events import USER, event_bus
 import os
 from dotenv import load_dotenv
 
@@ -23,6 +24,8 @@ async def create_user(user:UserCreate) -> UserInDB:
         user_collection.insert_one(db_user.model_dump())
     else:
         await user_collection.insert_one(db_user.model_dump())
+    # the password hash is not handed to subscribers
+    event_bus.publish(USER, "create", db_user.email, None, db_user.model_dump(exclude={"hashed_password"}))
     return db_user
 
 async def get_user_by_email(email:str) -> User:
@@ -0,0 +1,47 @@
+import os
+import time
+from typing import Optional
+from pymongo import ReturnDocument
+from config.database.database import cache_version_collection
+
+
+# A counter in cache_version_collection shared by all workers. Every write behind an in-process
+# cache bumps it; the other workers compare it, a single _id lookup, at most every interval
+# and drop their entries when it moved.
+class SharedVersion:
+
+    def __init__(self, key:str):
+        self.key = key
+        self.version: Optional[int] = None
+        self.checked_at = float("-inf")
+
+    async def _read(self) -> int:
+        if os.getenv("TESTING") == "True":
+            document = cache_version_collection.find_one({"_id": self.key})
+        else:
+            document = await cache_version_collection.find_one({"_id": self.key})
+        return document["version"] if document else 0
+
+    # True when the version differs from the one last seen, read at most every interval seconds
+    async def moved(self, interval:float) -> bool:
+        now = time.monotonic()
+        if now - self.checked_at < interval:
+            return False
+        self.checked_at = now
+        version = await self._read()
+        moved = version != self.version
+        self.version = version
+        return moved
+
+    # called after a write of this worker; True when other workers wrote since the version was last seen
+    async def bump(self) -> bool:
+        update = ({"_id": self.key}, {"$inc": {"version": 1}})
+        if os.getenv("TESTING") == "True":
+            document = cache_version_collection.find_one_and_update(*update, upsert=True, return_document=ReturnDocument.AFTER)
+        else:
+            document = await cache_version_collection.find_one_and_update(*update, upsert=True, return_document=ReturnDocument.AFTER)
+        # never read before, nothing was loaded that another worker's write could have made stale
+        moved = self.version is not None and document["version"] != self.version + 1
+        self.version = document["version"]
+        self.checked_at = time.monotonic()
+        return moved
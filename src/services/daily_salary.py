@@ -0,0 +1,51 @@
+import os
+from datetime import datetime
+from typing import Optional
+from dotenv import load_dotenv
+from config.database.database import employee_collection, static_values_collection
+from services.payroll import daily_salary
+from services.static_values_cache import StaticValuesCache, static_values_cache
+from services.employee_cache import EmployeeCache, employee_cache
+from modules.static_values.static_values_crud import load_static_values_as_of
+from shared.models_schemas.models import Employee, StaticValues
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+# Employees and the static values in force as seen by report writes,
+# served from employee_cache and static_values_cache.
+class SalaryLookups:
+
+    def __init__(self, values_cache:StaticValuesCache = static_values_cache, employee_cache:EmployeeCache = employee_cache):
+        self.values_cache = values_cache
+        self.employee_cache = employee_cache
+
+    async def employee(self, employee_id:int) -> Optional[Employee]:
+        return await self.employee_cache.get(employee_id, lambda: self._load_employee(employee_id))
+
+    async def _load_employee(self, employee_id:int) -> Optional[Employee]:
+        if os.getenv("TESTING") == "True":
+            employee_data = employee_collection.find_one({"id": employee_id})
+        else:
+            employee_data = await employee_collection.find_one({"id": employee_id})
+        return Employee(**employee_data) if employee_data else None
+
+    # the static values version in force on the report's day
+    async def static_values(self, as_of:datetime) -> Optional[StaticValues]:
+        return await self.values_cache.as_of(as_of, lambda: load_static_values_as_of(as_of, static_values_collection))
+
+    # the report's daily salary, None while its employee or rates for its tier do not exist
+    async def total_salary(self, report:dict) -> Optional[float]:
+        employee = await self.employee(report["employee_id"])
+        static_values = await self.static_values(report["date"])
+        if employee is None or static_values is None:
+            return None
+        try:
+            return daily_salary(report, employee, static_values)
+        except KeyError:
+            # the employee's tier has no rates in the static values
+            return None
+
+
+salary_lookups = SalaryLookups()
@@ -0,0 +1,91 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+from dotenv import load_dotenv
+from fastapi import APIRouter
+from services.cache_version import SharedVersion
+from shared.models_schemas.models import Employee
+from shared.models_schemas.schemas import EmployeeCacheStats
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+EMPLOYEE_CACHE_MAX_ENTRIES = int(os.getenv("EMPLOYEE_CACHE_MAX_ENTRIES") or 10000)
+# seconds an employee is served from memory at most
+EMPLOYEE_CACHE_TTL = float(os.getenv("EMPLOYEE_CACHE_TTL") or 300)
+# seconds between two reads of the shared version, i.e. how late a worker may see another worker's write
+EMPLOYEE_CACHE_VERSION_INTERVAL = float(os.getenv("EMPLOYEE_CACHE_VERSION_INTERVAL") or 2)
+
+
+# Validated employees by id, the least recently used is evicted once max_entries is reached.
+# The employee CRUD writes of this worker store the written employee (None once deleted),
+# unknown ids are cached as None too. A load that raced with a write is not stored.
+# Every write also bumps the "employees" SharedVersion, the other workers drop all their entries
+# once they see it move, within EMPLOYEE_CACHE_VERSION_INTERVAL.
+class EmployeeCache:
+
+    def __init__(self, max_entries:int = EMPLOYEE_CACHE_MAX_ENTRIES, ttl:float = EMPLOYEE_CACHE_TTL,
+                 version_interval:float = EMPLOYEE_CACHE_VERSION_INTERVAL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self._shared = SharedVersion("employees")
+        self._entries: "OrderedDict[int, Tuple[float, Optional[Employee]]]" = OrderedDict()
+        self._writes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    async def get(self, employee_id:int, loader:Callable[[], Awaitable[Optional[Employee]]]) -> Optional[Employee]:
+        if await self._shared.moved(self.version_interval):
+            self.invalidate()
+        entry = self._entries.get(employee_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(employee_id)
+            self._stats["hits"] += 1
+            return entry[1]
+        self._stats["misses"] += 1
+        writes = self._writes
+        employee = await loader()
+        if writes == self._writes:
+            self._store(employee_id, employee)
+        return employee
+
+    def _store(self, employee_id:int, employee:Optional[Employee]):
+        self._entries[employee_id] = (time.monotonic() + self.ttl, employee)
+        self._entries.move_to_end(employee_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    # write-through from the employee CRUD, employee is None after a delete
+    def put(self, employee_id:int, employee:Optional[Employee]):
+        self._writes += 1
+        self._store(employee_id, employee)
+
+    def invalidate(self, employee_id:Optional[int] = None):
+        self._writes += 1
+        if employee_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(employee_id, None)
+
+    # called after the employee writes of this worker, so every worker reloads
+    async def changed(self):
+        # another worker wrote too since the version was last read, its writes are not in the entries
+        if await self._shared.bump():
+            self.invalidate()
+
+    def stats(self) -> dict:
+        return {**self._stats, "size": len(self._entries), "max_entries": self.max_entries}
+
+
+employee_cache = EmployeeCache()
+
+
+router = APIRouter()
+
+# hit/miss/eviction counters, the hit rate comes from sampling them
+@router.get("/employee_cache_stats", response_model=EmployeeCacheStats)
+async def employee_cache_stats_endpoint():
+    return employee_cache.stats()
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+from dotenv import load_dotenv
+from fastapi import APIRouter
+from shared.models_schemas.schemas import EventBusStats
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+logger = logging.getLogger(__name__)
+
+# events waiting for their subscribers, a write never blocks on a full queue (the event is dropped and counted)
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE") or 10000)
+
+# entities whose CRUD writes publish events
+DAILY_REPORT = "daily_report"
+EMPLOYEE = "employee"
+STATIC_VALUES = "static_values"
+USER = "user"
+
+
+# One write of one document. key identifies it within its entity ((employee_id, date) for daily reports,
+# id for employees and static values, email for users); before/after are the document around the write,
+# None when it did not / no longer exists or was not fetched by the write.
+class ChangeEvent(NamedTuple):
+    entity: str
+    action: str     # create, update or delete
+    key: Any
+    before: Optional[dict]
+    after: Optional[dict]
+
+
+Subscriber = Callable[[ChangeEvent], Awaitable[None]]
+
+
+# In-process publish/subscribe for CRUD writes. publish() only enqueues, the subscribers run
+# one event at a time, in publish order, on a background task of the event loop, so they never add to a write's
+# latency and a failing subscriber never fails the write. Delivery is best effort: events still
+# queued when the worker stops are lost, state that must never be stale is kept by the write itself.
+class EventBus:
+
+    def __init__(self, max_queue:int = EVENT_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # consumed counts dequeued events, failed counts subscriber calls that raised
+        self._stats = {"published": 0, "consumed": 0, "failed": 0, "dropped": 0}
+
+    # usable as a decorator: @event_bus.subscribe(DAILY_REPORT)
+    def subscribe(self, entity:str, subscriber:Optional[Subscriber] = None):
+        if subscriber is None:
+            return lambda subscriber: self.subscribe(entity, subscriber)
+        self._subscribers.setdefault(entity, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, entity:str, subscriber:Subscriber):
+        if subscriber in self._subscribers.get(entity, []):
+            self._subscribers[entity].remove(subscriber)
+
+    def publish(self, entity:str, action:str, key:Any, before:Optional[dict] = None, after:Optional[dict] = None):
+        if not self._subscribers.get(entity):
+            return
+        self._start_worker()
+        try:
+            self._queue.put_nowait(ChangeEvent(entity, action, key, before, after))
+            self._stats["published"] += 1
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+            logger.warning("event queue full, dropped %s %s %s", entity, action, key)
+
+    # the worker runs while there are queued events and ends when the queue is empty,
+    # it lives on the loop of the writes (a new loop, e.g. a new test, gets a new queue)
+    def _start_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(self.max_queue)
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._consume())
+
+    async def _consume(self):
+        while not self._queue.empty():
+            event = self._queue.get_nowait()
+            self._stats["consumed"] += 1
+            for subscriber in list(self._subscribers.get(event.entity, [])):
+                try:
+                    await subscriber(event)
+                except Exception:
+                    self._stats["failed"] += 1
+                    logger.exception("event subscriber %s failed on %s %s", getattr(subscriber, "__name__", subscriber), event.entity, event.action)
+            self._queue.task_done()
+
+    # wait until every queued event went through its subscribers
+    async def drain(self):
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+    async def stop(self):
+        await self.drain()
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "subscribers": {entity: len(subscribers) for entity, subscribers in self._subscribers.items() if subscribers},
+        }
+
+
+event_bus = EventBus()
+
+
+router = APIRouter()
+
+# publish/consume counters, rates come from sampling them
+@router.get("/event_bus_stats", response_model=EventBusStats)
+async def event_bus_stats_endpoint():
+    return event_bus.stats()
@@ -1,13 +1,21 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
+from typing import Annotated, AsyncIterator, Dict, Literal, Optional, Tuple, Union
 from dotenv import load_dotenv
-from jinja2 import Environment, FileSystemLoader
-from weasyprint import HTML
-from io import BytesIO
 from fastapi import HTTPException
-from fastapi import Response, APIRouter
+from fastapi import Response, APIRouter, Header
+from fastapi.responses import HTMLResponse
 from modules.employees.employees_crud import get_employee
 from config.database.database import daily_report_collection
-from modules.static_values.static_values_crud import get_static_values
+from modules.daily_reports.report_buckets_crud import buckets_enabled, get_bucket_reports
+from modules.static_values.static_values_crud import get_static_values, get_static_values_as_of
+from services.payroll import compute_payroll_from_reports, month_bounds
+from services.payslip_renderer import get_render_context, render_salary_pdf
+from services.payslip_cache import payslip_cache, payslip_content_key
+from shared.models_schemas.schemas import PdfRenderStats
 
 import os
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
@@ -16,46 +24,161 @@ load_dotenv(dotenv_path)
 def generate_salary_pdf(salary_data: dict) -> bytes:
     
     try:
-        # Set the path to the templates directory
-        templates_dir = os.path.join(os.path.dirname(__file__), '..', 'templates')
+        return render_salary_pdf(salary_data)
+                
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating PDF: {str(e)}")
 
-        # Initialize Jinja2 environment
-        env = Environment(loader=FileSystemLoader(templates_dir))
 
-        # Load the template
-        template = env.get_template("salary_template.html")
+# Process pool every payslip render goes through, so the event loop never blocks on WeasyPrint.
+# PDF_RENDER_WORKERS bounds how many renders run at once (default: CPU count) and
+# PDF_RENDER_MAX_QUEUE bounds how many single-payslip requests may wait for a worker.
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS") or os.cpu_count() or 1)
+PDF_RENDER_MAX_QUEUE = int(os.getenv("PDF_RENDER_MAX_QUEUE") or PDF_RENDER_WORKERS * 4)
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_stats = {"in_flight": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        # spawn instead of fork: the parent holds Motor and event loop threads.
+        # Each worker builds its render context once, before its first payslip.
+        _render_pool = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=get_render_context)
+    return _render_pool
+
+
+def shutdown_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(cancel_futures=True)
+        _render_pool = None
+
+
+def get_render_stats() -> dict:
+    in_flight = _render_stats["in_flight"]
+    return {
+        "workers": PDF_RENDER_WORKERS,
+        "max_queue": PDF_RENDER_MAX_QUEUE,
+        "running": min(in_flight, PDF_RENDER_WORKERS),
+        "queue_depth": max(in_flight - PDF_RENDER_WORKERS, 0),
+        "completed": _render_stats["completed"],
+        "failed": _render_stats["failed"],
+        "rejected": _render_stats["rejected"],
+    }
 
-        # Render the template with salary data
-        html_content = template.render(**salary_data)
 
-        # Generate the PDF from HTML content
-        pdf_io = BytesIO()
-        HTML(string=html_content).write_pdf(pdf_io)
-        pdf_content = pdf_io.getvalue()  # Get binary PDF content
-        return pdf_content
-                
+def _on_render_done(future: asyncio.Future):
+    _render_stats["in_flight"] -= 1
+    if future.cancelled() or future.exception() is not None:
+        _render_stats["failed"] += 1
+    else:
+        _render_stats["completed"] += 1
+
+
+def submit_salary_pdf(salary_data: dict) -> asyncio.Future:
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(get_render_pool(), render_salary_pdf, salary_data)
+    _render_stats["in_flight"] += 1
+    future.add_done_callback(_on_render_done)
+    return future
+
+
+async def generate_salary_pdf_async(salary_data: dict) -> bytes:
+    if get_render_stats()["queue_depth"] >= PDF_RENDER_MAX_QUEUE:
+        _render_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="PDF renderer is busy, please retry shortly")
+    try:
+        return await submit_salary_pdf(salary_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating PDF: {str(e)}")
+
+
+async def render_salary_pdfs(payslips: Dict[int, dict]) -> AsyncIterator[Tuple[int, Union[bytes, Exception]]]:
+    # yields (key, pdf bytes or the rendering error) in completion order.
+    # Only a small window is submitted at a time so single-payslip requests
+    # are not stuck behind a whole month-end run in the pool queue.
+    window = PDF_RENDER_WORKERS * 2
+    items = iter(payslips.items())
+    futures = {}
+    try:
+        while True:
+            for key, salary_data in items:
+                futures[submit_salary_pdf(salary_data)] = key
+                if len(futures) >= window:
+                    break
+            if not futures:
+                return
+            done, _ = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                key = futures.pop(future)
+                error = future.exception()
+                yield key, error if error is not None else future.result()
+    finally:
+        # the consumer stopped early (client gone, error downstream): renders that
+        # did not start yet are dropped from the pool queue
+        for future in futures:
+            future.cancel()
     
     
 router = APIRouter()
 
+@router.get("/pdf_render_stats", response_model=PdfRenderStats)
+async def pdf_render_stats_endpoint():
+    return get_render_stats()
+
+
+# "json" and "html" previews skip PDF rendering. Without a format parameter the Accept
+# header decides: JSON when it asks for application/json first, HTML only for an exact
+# text/html, since browser navigations list text/html among many types and expect the PDF.
+def payslip_format(format:Optional[str], accept:Optional[str]) -> str:
+    if format:
+        return format
+    media_types = [media_type.split(";")[0].strip() for media_type in (accept or "").split(",")]
+    if media_types[0] == "application/json":
+        return "json"
+    if media_types == ["text/html"]:
+        return "html"
+    return "pdf"
+
+
+# without values_id the payslip uses the static values version in force this month
+@router.get("/generate_salary_pdf/{employee_id}")
 @router.get("/generate_salary_pdf/{employee_id}/{values_id}")
-async def generate_salary_pdf_endpoint(employee_id: int, values_id:int):
+async def generate_salary_pdf_endpoint(employee_id: int, values_id:Optional[int] = None, format:Optional[Literal["pdf", "json", "html"]] = None,
+                                       accept:Annotated[Optional[str], Header()] = None):
     # Get the current month and year
     now = datetime.now(timezone.utc)
-    start_of_month = datetime(now.year, now.month, 1)  # First day of the current month
-    next_month = datetime(now.year, now.month + 1, 1) if now.month < 12 else datetime(now.year + 1, 1, 1)  # First day of the next month
+    start_of_month, next_month = month_bounds(now)
+    output = payslip_format(format, accept)
+
+    static_values = None
+    if values_id is None:
+        static_values = await get_static_values_as_of(start_of_month)
+        if static_values is None:
+            return {"error": "static_values not found"}
+        values_id = static_values.id
+
+    # Serve the last rendered payslip if none of its inputs, the template included, changed since
+    started_at = time.time_ns()
+    template_version = get_render_context().version
+    if output == "pdf":
+        cached_pdf = payslip_cache.lookup(employee_id, start_of_month, values_id, template_version)
+        if cached_pdf is not None:
+            return Response(content=cached_pdf, media_type="application/pdf")
 
     # Query to get only reports for the current month
-    if os.getenv("TESTING") == "True":
-        daily_reports = daily_report_collection.find({
+    if buckets_enabled():
+        daily_reports = (await get_bucket_reports([employee_id], start_of_month, next_month))[employee_id]
+    elif os.getenv("TESTING") == "True":
+        daily_reports = list(daily_report_collection.find({
             "employee_id": employee_id,
             "date": {
                 "$gte": start_of_month,   
                 "$lt": next_month         
             }
-        })
+        }).sort("date", 1))
     else:
         daily_reports = await daily_report_collection.find({
             "employee_id": employee_id,
@@ -63,184 +186,38 @@ async def generate_salary_pdf_endpoint(employee_id: int, values_id:int):
                 "$gte": start_of_month,   # Greater than or equal to the first day of the current month
                 "$lt": next_month         # Less than the first day of the next month
             }
-        }).to_list(length=None)
+        }).sort("date", 1).to_list(length=None)
     
     if daily_reports is None:
         return{"error":"daily report not found for employee"}
     
-    employee = await get_employee(employee_id)
+    # read uncached: the payslip index is shared by all workers and would keep a PDF rendered from a stale employee
+    employee = await get_employee(employee_id, cached=False)
     if employee is None:
         return {"error": "Employee not found"}
     
-    static_values = await get_static_values(values_id)
+    if static_values is None:
+        static_values = await get_static_values(values_id)
     if static_values is None:
         return {"error": "static_values not found"}
     
-    # Prepare list of absent with dates
-    absent_info = []
-    absent_count = 0
-    for report in daily_reports:
-        if report.get("adherence_status", 0) == False:
-            date_str = report["date"].strftime("%Y-%m-%d")
-            date_name = report["date"].strftime("%A")
-            absent_info.append(f"In {date_name} {date_str} : absent ")
-            absent_count += 1 
-
-    # Prepare list of missing hours with dates
-    missing_hours_info = []
-    additional_hours_info = []
-    sum = 0
-    additional_hours_value = 0
-    for report in daily_reports:
-        if report.get("working_hours", 0) < 9 and report.get("working_hours", 0) != 0:
-            missing_hours = 9 - report["working_hours"]
-            sum = sum + missing_hours
-            date_str = report["date"].strftime("%Y-%m-%d")
-            date_name = report["date"].strftime("%A")
-            missing_hours_info.append(f"In {date_name} {date_str} : {missing_hours} hrs missing")
-            
-        if report.get("working_hours", 0) > 9 :
-            additional_hours = report["working_hours"] - 9
-            additional_hours_value = additional_hours_value + (additional_hours * static_values.hour_price[employee.tier_type])
-            date_str = report["date"].strftime("%Y-%m-%d")
-            date_name = report["date"].strftime("%A")
-            additional_hours_info.append(f"In {date_name} {date_str} : {additional_hours} hrs over : (double paid)")
-    
-    # Prepare list of working in saturdays
-    saturdays = []
-    saturdays_value = 0
-    for report in daily_reports:
-        if report.get("is_saturday", 0) == True:
-            date_str = report["date"].strftime("%Y-%m-%d")
-            hours = report["working_hours"]
-            saturdays_value = saturdays_value + (hours * static_values.hour_price[employee.tier_type])
-            saturdays.append(f"working on saturday {date_str} for {hours} hours : (double paid)")
-
-    # Prepare list of kpis in compensation
-    kpis = []
-    kpis_values = 0
-    kpis_amount = 0  
-
-    for report in daily_reports:
-        no_of_qulified_app = report.get("appointment", {}).get("no_of_qualified_appointment", 0)
-        kpis_values += no_of_qulified_app
-        kpis_amount += report.get("compensation", {}).get("kpis", 0)
-        date_str = report["date"].strftime("%Y-%m-%d")
-        date_name = report["date"].strftime("%A")
-        kpis.append(f"Making {no_of_qulified_app} qualified appointments on {date_name} {date_str}")
-        
-        # Ensure that compensation and kpi information exist in each report before accessing them
-    if employee.employee_type.is_appointment_serrer == True:
-        if kpis_values >= static_values.no_of_qulified_appt_tier_setter[employee.tier_type] * 30:
-            kpis_total = kpis_amount * static_values.kpis
-        else:
-            kpis_total = 0
-    else:
-        if kpis_values >= static_values.no_of_qulified_appt_tier_fronter[employee.tier_type] * 30:
-            kpis_total = kpis_amount * static_values.kpis
-        else:
-            kpis_total = 0
-            
-    # Prepare list of spiffs in compensation
-    spiffs_list = []
-    spiffs_values = 0
-    for report in daily_reports:
-        spiffs = report.get("compensation", {}).get("spiffs", 0)
-        spiffs_values += spiffs
-        date_str = report["date"].strftime("%Y-%m-%d")
-        date_name = report["date"].strftime("%A")
-        spiffs_list.append(f"In {date_name} {date_str} has {spiffs} spiffs")
-    
-
-    # Prepare list of transportation allowance data 
-    count = 0
-    for report in daily_reports:
-        if report.get("adherence_status", 0) == True:
-            count += 1 
-    if count == 0:
-        transportation_allowance = 0
-    else:
-        allowance_sum = count * static_values.allowance["travel"]
-        transportation_allowance = f"{count} Days * {static_values.allowance["travel"]} EGP = {allowance_sum}"
-            
-    
-    # Prepare list of deductions
-    deductions_info = []
-    deductions_values = 0
-    for report in daily_reports:
-        if report.get("deductions", {}).get("deductions", 0) !=0:
-            deduction = report.get("deductions", {}).get("deductions", 0)
-            reason = report.get("deductions", {}).get("reason", 0)
-            deductions_values += deduction
-            date_str = report["date"].strftime("%Y-%m-%d")
-            date_name = report["date"].strftime("%A")
-            deductions_info.append(f"In {date_name} {date_str} has {deduction} deduction for the reason of: {reason}")
-        else:
-            deductions_values = 0
-            
-    # Prepare list of butterup in compensation
-    butter_up_values = 0
-    for report in daily_reports:
-        butter_up = report.get("compensation", {}).get("butter_up", 0)
-        butter_up_values += butter_up
-    butter_up_total = butter_up_values * static_values.butter_up
-            
-    # basic salary
-    basic_salary = static_values.tier_base_salary[employee.tier_type]
-    basic_salary_deduction_absent = absent_count * (static_values.tier_base_salary[employee.tier_type] / 30)
-    basic_salary_deduction_missing_hours =  static_values.hour_price[employee.tier_type] * sum
-    final_salary = basic_salary - basic_salary_deduction_absent - basic_salary_deduction_missing_hours
-    
-    # overpay
-    overpay_summary =  saturdays_value * 2 
-    additional_hours = additional_hours_value * 2
-    total_spiffs = spiffs_values * 2 * static_values.cad
-        
-
-    # total salary
-    total_salary = final_salary + overpay_summary + additional_hours + kpis_total + total_spiffs + allowance_sum + deductions_values + butter_up_total
-    
-
-    
-    # Prepare salary data dictionary
-    salary_data = {
-        "name": employee.name,
-        "position":employee.position,
-        "tier_type":employee.tier_type,
-        "is_onsite":employee.is_onsite,
-        "has_insurance":employee.has_insurance,
-        "is_appointment_serrer":employee.employee_type.is_appointment_serrer,
-        "is_full_time":employee.employee_type.is_full_time,
-        "name": employee.name,
-        "month": now.strftime("%m"),
-        "month_name": now.strftime("%B"),
-        "year": now.strftime("%Y"),
-        "basic_salary" :basic_salary, 
-        "basic_salary_deduction_absent":basic_salary_deduction_absent,
-        "basic_salary_deduction_missing_hours": basic_salary_deduction_missing_hours ,
-        "final_salary": final_salary,
-        "no_show_days": "<br>".join(absent_info), 
-        "missing_hours": "<br>".join(missing_hours_info),
-        "saturdays": "<br>".join(saturdays),
-        "overpay_summary": overpay_summary,
-        "additional_hours": "<br>".join(additional_hours_info),
-        "additional_hours_value": additional_hours,
-        "kpis_score": "<br>".join(kpis),
-        "kpis_total": kpis_total,
-        "spiffs_logs": "<br>".join(spiffs_list),
-        "spiffs_total": total_spiffs,
-        "transportation_allowance": transportation_allowance,
-        "deductions_info": "<br>".join(deductions_info),
-        "deductions": deductions_values,
-        "butter_up": butter_up_total,
-        "total_salary": total_salary,
-        
-
-    }
-
-
-    # Generate the PDF content
-    pdf_content = generate_salary_pdf(salary_data)  
+    if output != "pdf":
+        salary_data = compute_payroll_from_reports(employee, static_values, daily_reports, now)
+        if output == "json":
+            return salary_data
+        return HTMLResponse(get_render_context().render_html(salary_data.model_dump(), inline_stylesheet=True))
+
+    # Same inputs as an earlier render (e.g. after an unrelated invalidation) reuse its PDF
+    content_key = payslip_content_key(employee.model_dump(), daily_reports, static_values.model_dump(), start_of_month, template_version)
+    pdf_content = payslip_cache.get(content_key)
+    if pdf_content is None:
+        # Compute every salary component in one pass over the month's reports
+        salary_data = compute_payroll_from_reports(employee, static_values, daily_reports, now)
+
+        # Generate the PDF content off the event loop
+        pdf_content = await generate_salary_pdf_async(salary_data.model_dump())
+        payslip_cache.put(content_key, pdf_content)
+    payslip_cache.index(employee_id, start_of_month, values_id, template_version, content_key, started_at)
     
     # Return the PDF response
     return Response(content=pdf_content, media_type="application/pdf")
@@ -0,0 +1,220 @@
+from array import array
+from itertools import compress
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+from shared.models_schemas.models import Employee, StaticValues
+from shared.models_schemas.schemas import MonthlyReportTotals, PayrollResult
+
+
+# a full working day, anything below is missing hours and anything above is overtime
+WORKING_DAY_HOURS = 9
+DAYS_PER_MONTH = 30
+
+
+def month_bounds(period:datetime) -> Tuple[datetime, datetime]:
+    start_of_month = datetime(period.year, period.month, 1)
+    next_month = datetime(period.year, period.month + 1, 1) if period.month < 12 else datetime(period.year + 1, 1, 1)
+    return start_of_month, next_month
+
+
+# the typed columns hold floats, whole numbers are shown on the payslip without the trailing .0
+def _number(value:float):
+    return int(value) if float(value).is_integer() else value
+
+
+# Column oriented view of one employee's daily reports for a month.
+# The raw documents are walked exactly once; every payroll component is then
+# derived from the typed arrays instead of re-reading the documents.
+class ReportColumns:
+    __slots__ = ("labels", "working_hours", "adherence", "is_saturday", "qualified_appointments",
+                 "kpis", "spiffs", "butter_up", "deductions", "reasons")
+
+    def __init__(self):
+        self.labels = []                          # "Monday 2024-09-02", formatted once per report
+        self.working_hours = array("d")
+        self.adherence = array("b")
+        self.is_saturday = array("b")
+        self.qualified_appointments = array("q")
+        self.kpis = array("d")
+        self.spiffs = array("d")
+        self.butter_up = array("d")
+        self.deductions = array("d")
+        self.reasons = []
+
+    @classmethod
+    def from_reports(cls, reports:Iterable[dict]) -> "ReportColumns":
+        columns = cls()
+        for report in reports:
+            compensation = report.get("compensation") or {}
+            deductions = report.get("deductions") or {}
+            columns.labels.append(report["date"].strftime("%A %Y-%m-%d"))
+            columns.working_hours.append(report.get("working_hours", 0))
+            columns.adherence.append(1 if report.get("adherence_status") else 0)
+            columns.is_saturday.append(1 if report.get("is_saturday") else 0)
+            columns.qualified_appointments.append((report.get("appointment") or {}).get("no_of_qualified_appointment", 0))
+            columns.kpis.append(compensation.get("kpis", 0))
+            columns.spiffs.append(compensation.get("spiffs", 0))
+            columns.butter_up.append(compensation.get("butter_up", 0))
+            columns.deductions.append(deductions.get("deductions", 0))
+            columns.reasons.append(deductions.get("reason", ""))
+        return columns
+
+    def __len__(self):
+        return len(self.labels)
+
+    def totals(self) -> MonthlyReportTotals:
+        hours = self.working_hours
+        present_days = sum(self.adherence)
+        return MonthlyReportTotals(
+            report_count=len(hours),
+            present_days=present_days,
+            absent_days=len(hours) - present_days,
+            missing_hours=sum(WORKING_DAY_HOURS - h for h in hours if 0 != h < WORKING_DAY_HOURS),
+            overtime_hours=sum(h - WORKING_DAY_HOURS for h in hours if h > WORKING_DAY_HOURS),
+            saturday_hours=sum(compress(hours, self.is_saturday)),
+            qualified_appointments=sum(self.qualified_appointments),
+            kpis=sum(self.kpis),
+            spiffs=sum(self.spiffs),
+            butter_up=sum(self.butter_up),
+            deductions=sum(self.deductions),
+        )
+
+    # itemized per-day lines shown on the payslip, joined the way the template expects
+    def itemized(self) -> dict:
+        absent, missing, overtime, saturdays, kpis, spiffs, deductions = [], [], [], [], [], [], []
+        for i, label in enumerate(self.labels):
+            hours = _number(self.working_hours[i])
+            if not self.adherence[i]:
+                absent.append(f"In {label} : absent ")
+            if 0 != hours < WORKING_DAY_HOURS:
+                missing.append(f"In {label} : {_number(WORKING_DAY_HOURS - hours)} hrs missing")
+            elif hours > WORKING_DAY_HOURS:
+                overtime.append(f"In {label} : {_number(hours - WORKING_DAY_HOURS)} hrs over : (double paid)")
+            if self.is_saturday[i]:
+                saturdays.append(f"working on saturday {label[-10:]} for {hours} hours : (double paid)")
+            kpis.append(f"Making {self.qualified_appointments[i]} qualified appointments on {label}")
+            spiffs.append(f"In {label} has {_number(self.spiffs[i])} spiffs")
+            if self.deductions[i] != 0:
+                deductions.append(f"In {label} has {_number(self.deductions[i])} deduction for the reason of: {self.reasons[i]}")
+        return {
+            "no_show_days": "<br>".join(absent),
+            "missing_hours": "<br>".join(missing),
+            "additional_hours": "<br>".join(overtime),
+            "saturdays": "<br>".join(saturdays),
+            "kpis_score": "<br>".join(kpis),
+            "spiffs_logs": "<br>".join(spiffs),
+            "deductions_info": "<br>".join(deductions),
+        }
+
+
+# one report's contribution to MonthlyReportTotals, used to keep monthly rollups up to date
+def report_totals(report:dict) -> dict:
+    hours = report.get("working_hours", 0)
+    present = 1 if report.get("adherence_status") else 0
+    compensation = report.get("compensation") or {}
+    return {
+        "report_count": 1,
+        "present_days": present,
+        "absent_days": 1 - present,
+        "missing_hours": WORKING_DAY_HOURS - hours if 0 != hours < WORKING_DAY_HOURS else 0,
+        "overtime_hours": hours - WORKING_DAY_HOURS if hours > WORKING_DAY_HOURS else 0,
+        "saturday_hours": hours if report.get("is_saturday") else 0,
+        "qualified_appointments": (report.get("appointment") or {}).get("no_of_qualified_appointment", 0),
+        "kpis": compensation.get("kpis", 0),
+        "spiffs": compensation.get("spiffs", 0),
+        "butter_up": compensation.get("butter_up", 0),
+        "deductions": (report.get("deductions") or {}).get("deductions", 0),
+    }
+
+
+# One report's approximate share of the month's pay, with the same components and rates as compute_payroll:
+# a day of basic salary when present, missing/extra hours, saturdays, compensation, travel and deductions.
+# Two components only have a monthly value, so the sum of a month's shares differs from its payroll:
+# the basic salary accrues per present day instead of being docked per absent day of a DAYS_PER_MONTH
+# month, and the KPI bonus is paid on the days reaching the daily target instead of for the whole
+# month once the month reaches DAYS_PER_MONTH times it.
+def daily_salary(report:dict, employee:Employee, static_values:StaticValues) -> float:
+    tier = employee.tier_type
+    hour_price = static_values.hour_price[tier]
+    totals = report_totals(report)
+    compensation = report.get("compensation") or {}
+
+    basic_salary = totals["present_days"] * static_values.tier_base_salary[tier] / DAYS_PER_MONTH
+    hours_value = (totals["overtime_hours"] * 2 - totals["missing_hours"]) * hour_price
+    saturday_value = totals["saturday_hours"] * hour_price * 2
+
+    if employee.employee_type.is_appointment_serrer:
+        kpis_target = static_values.no_of_qulified_appt_tier_setter[tier]
+    else:
+        kpis_target = static_values.no_of_qulified_appt_tier_fronter[tier]
+    kpis = compensation.get("kpis", 0) * static_values.kpis if totals["qualified_appointments"] >= kpis_target else 0
+    spiffs = compensation.get("spiffs", 0) * 2 * static_values.cad
+    butter_up = compensation.get("butter_up", 0) * static_values.butter_up
+    allowance = totals["present_days"] * static_values.allowance["travel"]
+
+    return basic_salary + hours_value + saturday_value + kpis + spiffs + butter_up + allowance + totals["deductions"]
+
+
+def compute_payroll(employee:Employee, static_values:StaticValues, totals:MonthlyReportTotals, period:datetime, itemized:Optional[dict] = None) -> PayrollResult:
+    tier = employee.tier_type
+    hour_price = static_values.hour_price[tier]
+    basic_salary = static_values.tier_base_salary[tier]
+
+    # basic salary
+    basic_salary_deduction_absent = totals.absent_days * (basic_salary / DAYS_PER_MONTH)
+    basic_salary_deduction_missing_hours = hour_price * totals.missing_hours
+    final_salary = basic_salary - basic_salary_deduction_absent - basic_salary_deduction_missing_hours
+
+    # overpay
+    overpay_summary = totals.saturday_hours * hour_price * 2
+    additional_hours_value = totals.overtime_hours * hour_price * 2
+
+    # compensation
+    if employee.employee_type.is_appointment_serrer:
+        kpis_target = static_values.no_of_qulified_appt_tier_setter[tier]
+    else:
+        kpis_target = static_values.no_of_qulified_appt_tier_fronter[tier]
+    kpis_total = totals.kpis * static_values.kpis if totals.qualified_appointments >= kpis_target * DAYS_PER_MONTH else 0
+    spiffs_total = totals.spiffs * 2 * static_values.cad
+    butter_up_total = totals.butter_up * static_values.butter_up
+
+    # transportation allowance
+    allowance_sum = totals.present_days * static_values.allowance["travel"]
+    if totals.present_days == 0:
+        transportation_allowance = 0
+    else:
+        transportation_allowance = f"{totals.present_days} Days * {static_values.allowance['travel']} EGP = {allowance_sum}"
+
+    total_salary = final_salary + overpay_summary + additional_hours_value + kpis_total + spiffs_total + allowance_sum + totals.deductions + butter_up_total
+
+    return PayrollResult(
+        employee_id=employee.id,
+        name=employee.name,
+        position=employee.position,
+        tier_type=tier,
+        is_onsite=employee.is_onsite,
+        has_insurance=employee.has_insurance,
+        is_appointment_serrer=employee.employee_type.is_appointment_serrer,
+        is_full_time=employee.employee_type.is_full_time,
+        month=period.strftime("%m"),
+        month_name=period.strftime("%B"),
+        year=period.strftime("%Y"),
+        basic_salary=basic_salary,
+        basic_salary_deduction_absent=basic_salary_deduction_absent,
+        basic_salary_deduction_missing_hours=basic_salary_deduction_missing_hours,
+        final_salary=final_salary,
+        overpay_summary=overpay_summary,
+        additional_hours_value=additional_hours_value,
+        kpis_total=kpis_total,
+        spiffs_total=spiffs_total,
+        transportation_allowance=transportation_allowance,
+        deductions=totals.deductions,
+        butter_up=butter_up_total,
+        total_salary=total_salary,
+        **(itemized or {}),
+    )
+
+
+def compute_payroll_from_reports(employee:Employee, static_values:StaticValues, reports:Iterable[dict], period:datetime) -> PayrollResult:
+    columns = ReportColumns.from_reports(reports)
+    return compute_payroll(employee, static_values, columns.totals(), period, columns.itemized())
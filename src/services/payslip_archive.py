@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+PAYSLIP_ARCHIVE_DIR = os.getenv("PAYSLIP_ARCHIVE_DIR") or os.path.join(os.path.dirname(__file__), '..', '..', 'payslip_archive')
+
+
+# Append-only archive of closed months.
+#   <dir>/<YYYY-MM>/<employee_id>-<values_id>.pdf     the payslip as it was issued
+#   <dir>/<YYYY-MM>/<employee_id>-<values_id>.json    everything it was computed from
+#   <dir>/<YYYY-MM>/index.jsonl                        one line per archived payslip
+# Paths are derived from the key, so a lookup is two stats whatever the archive size.
+# The PDF is published with os.link, which refuses to replace an existing entry: the first close
+# to link it wins. Only a close holding the winning PDF writes the inputs next to it, so the
+# pair always comes from the same close; a payslip counts as archived once both are there.
+class PayslipArchive:
+
+    def __init__(self, directory:str = PAYSLIP_ARCHIVE_DIR):
+        self.directory = directory
+
+    def month_dir(self, period:datetime) -> str:
+        return os.path.abspath(os.path.join(self.directory, period.strftime("%Y-%m")))
+
+    def pdf_path(self, employee_id:int, period:datetime, values_id:int) -> str:
+        return os.path.join(self.month_dir(period), f"{employee_id}-{values_id}.pdf")
+
+    def inputs_path(self, employee_id:int, period:datetime, values_id:int) -> str:
+        return os.path.join(self.month_dir(period), f"{employee_id}-{values_id}.json")
+
+    # path of the archived PDF, None if that payslip was never (completely) archived
+    def lookup(self, employee_id:int, period:datetime, values_id:int) -> Optional[str]:
+        path = self.pdf_path(employee_id, period, values_id)
+        return path if os.path.isfile(path) and os.path.isfile(self.inputs_path(employee_id, period, values_id)) else None
+
+    def _publish(self, path:str, data:bytes, replace:bool = False) -> bool:
+        temp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        if replace:
+            os.replace(temp_path, path)
+            return True
+        try:
+            os.link(temp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(temp_path)
+
+    # freeze a payslip, returns False if it was already archived (the archived copy is kept)
+    def put(self, employee_id:int, period:datetime, values_id:int, pdf:bytes, inputs:dict) -> bool:
+        month_dir = self.month_dir(period)
+        os.makedirs(month_dir, exist_ok=True)
+        if self.lookup(employee_id, period, values_id) is not None:
+            return False
+
+        pdf_path = self.pdf_path(employee_id, period, values_id)
+        inputs_data = json.dumps(inputs, sort_keys=True, default=str).encode()
+        if not self._publish(pdf_path, pdf):
+            # another close won; if it stopped before its inputs and rendered the same PDF, these inputs are its inputs
+            with open(pdf_path, "rb") as pdf_file:
+                if pdf_file.read() == pdf:
+                    self._publish(self.inputs_path(employee_id, period, values_id), inputs_data, replace=True)
+            return False
+        # the inputs of an earlier close that lost or stopped before its PDF are replaced
+        self._publish(self.inputs_path(employee_id, period, values_id), inputs_data, replace=True)
+
+        entry = {
+            "employee_id": employee_id,
+            "values_id": values_id,
+            "sha256": hashlib.sha256(pdf).hexdigest(),
+            "size": len(pdf),
+            "archived_at": datetime.now(timezone.utc).isoformat(),
+        }
+        with open(os.path.join(month_dir, "index.jsonl"), "a") as index_file:
+            index_file.write(json.dumps(entry) + "\n")
+        return True
+
+    def index(self, period:datetime) -> list:
+        try:
+            with open(os.path.join(self.month_dir(period), "index.jsonl")) as index_file:
+                return [json.loads(line) for line in index_file if line.strip()]
+        except OSError:
+            return []
+
+
+payslip_archive = PayslipArchive()
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+PAYSLIP_CACHE_DIR = os.getenv("PAYSLIP_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "salary_calculation_payslips")
+PAYSLIP_CACHE_MAX_BYTES = int(os.getenv("PAYSLIP_CACHE_MAX_BYTES") or 512 * 1024 * 1024)
+
+
+# hash of everything a payslip is rendered from, so identical inputs share one PDF
+def payslip_content_key(employee:dict, reports:Iterable[dict], static_values:dict, period:datetime, template_version:str) -> str:
+    digest = hashlib.sha256()
+    payload = {
+        "employee": employee,
+        "reports": sorted(({k: v for k, v in report.items() if k != "_id"} for report in reports), key=lambda report: str(report.get("date"))),
+        "static_values": {k: v for k, v in static_values.items() if k != "_id"},
+        "period": period.strftime("%Y-%m"),
+        "template": template_version,
+    }
+    digest.update(json.dumps(payload, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+# Size bounded LRU of rendered payslips on local disk.
+#   <dir>/pdf/<content key>.pdf                       content addressed PDFs, mtime is the LRU clock
+#   <dir>/index/<employee_id>/<YYYY-MM>-<values_id>     template version and content key a payslip currently resolves to
+#   <dir>/stamps/{employee,values}-<id>                 touched on every invalidation
+# Everything lives on disk so an invalidation in one gunicorn worker is seen by all of them.
+class PayslipCache:
+
+    def __init__(self, directory:str = PAYSLIP_CACHE_DIR, max_bytes:int = PAYSLIP_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _pdf_path(self, content_key:str) -> str:
+        return os.path.join(self.directory, "pdf", f"{content_key}.pdf")
+
+    def _index_path(self, employee_id:int, period:datetime, values_id:int) -> str:
+        return os.path.join(self.directory, "index", str(employee_id), f"{period.strftime('%Y-%m')}-{values_id}")
+
+    def _stamp_path(self, kind:str, key:int) -> str:
+        return os.path.join(self.directory, "stamps", f"{kind}-{key}")
+
+    # cached PDF for a payslip that has not been invalidated since it was indexed,
+    # rendered with the current template version
+    def lookup(self, employee_id:int, period:datetime, values_id:int, template_version:str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        try:
+            with open(self._index_path(employee_id, period, values_id)) as index_file:
+                indexed_version, _, content_key = index_file.read().partition("\n")
+        except OSError:
+            return None
+        if indexed_version != template_version:
+            return None
+        return self.get(content_key)
+
+    def get(self, content_key:str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        path = self._pdf_path(content_key)
+        try:
+            with open(path, "rb") as pdf_file:
+                pdf = pdf_file.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return pdf
+
+    def put(self, content_key:str, pdf:bytes):
+        if not self.enabled:
+            return
+        path = self._pdf_path(content_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename so concurrent readers never see a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as pdf_file:
+            pdf_file.write(pdf)
+        os.replace(temp_path, path)
+        if self._size is None:
+            self._size = self._disk_usage()
+        else:
+            self._size += len(pdf)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    # point a payslip at its content key, unless its inputs were invalidated after started_at
+    def index(self, employee_id:int, period:datetime, values_id:int, template_version:str, content_key:str, started_at:int):
+        if not self.enabled:
+            return
+        for stamp in (self._stamp_path("employee", employee_id), self._stamp_path("values", values_id)):
+            try:
+                if os.stat(stamp).st_mtime_ns >= started_at:
+                    return
+            except OSError:
+                pass
+        path = self._index_path(employee_id, period, values_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as index_file:
+            index_file.write(f"{template_version}\n{content_key}")
+        os.replace(temp_path, path)
+
+    def _touch_stamp(self, kind:str, key:int):
+        path = self._stamp_path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a"):
+            pass
+        os.utime(path, ns=(time.time_ns(), time.time_ns()))
+
+    def invalidate_employee(self, employee_id:int):
+        if not self.enabled:
+            return
+        self._touch_stamp("employee", employee_id)
+        shutil.rmtree(os.path.join(self.directory, "index", str(employee_id)), ignore_errors=True)
+
+    def invalidate_static_values(self, values_id:int):
+        if not self.enabled:
+            return
+        self._touch_stamp("values", values_id)
+        index_dir = os.path.join(self.directory, "index")
+        if not os.path.isdir(index_dir):
+            return
+        suffix = f"-{values_id}"
+        for employee_dir in os.scandir(index_dir):
+            for entry in os.scandir(employee_dir.path):
+                if entry.name.endswith(suffix):
+                    os.remove(entry.path)
+
+    def _entries(self) -> list:
+        pdf_dir = os.path.join(self.directory, "pdf")
+        if not os.path.isdir(pdf_dir):
+            return []
+        entries = []
+        for entry in os.scandir(pdf_dir):
+            if entry.name.endswith(".pdf"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def _disk_usage(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    # drop least recently used PDFs until the cache is back under 90% of its budget;
+    # index entries pointing at an evicted PDF simply miss on the next lookup
+    def _evict(self):
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                size -= entry_size
+            except OSError:
+                pass
+        self._size = size
+
+
+payslip_cache = PayslipCache()
@@ -0,0 +1,103 @@
+import hashlib
+import os
+from typing import Optional
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+from markupsafe import Markup
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+
+TEMPLATES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'templates'))
+TEMPLATE_NAME = "salary_template.html"
+STYLESHEET_NAME = "salary_template.css"
+
+# part of the version, bumped when the rendering changes outside the template files
+# so payslips cached by their content key are rendered again
+RENDER_REVISION = "2"
+
+# itemized payslip lines, one per report joined with <br> (see ReportColumns.itemized)
+LINE_FIELDS = ("no_show_days", "missing_hours", "additional_hours", "saturdays", "kpis_score", "spiffs_logs", "deductions_info")
+
+
+# Everything a payslip render needs that does not depend on the payslip itself:
+# the compiled Jinja2 template, the parsed stylesheet and WeasyPrint's font configuration.
+# It lives for the whole process (one per render pool worker) and only re-reads
+# the template or stylesheet when their modification time changes.
+class SalaryRenderContext:
+
+    def __init__(self, templates_dir:str = TEMPLATES_DIR):
+        self.templates_dir = templates_dir
+        self.env = Environment(loader=FileSystemLoader(templates_dir), auto_reload=True, autoescape=select_autoescape(["html"]))
+        self.font_config = FontConfiguration()
+        self._stylesheet = None
+        self._stylesheet_text = None
+        self._stylesheet_mtime = None
+        self._version = None
+        self._version_mtimes = None
+
+    def _path(self, name:str) -> str:
+        return os.path.join(self.templates_dir, name)
+
+    def _mtimes(self) -> tuple:
+        return (os.stat(self._path(TEMPLATE_NAME)).st_mtime_ns, os.stat(self._path(STYLESHEET_NAME)).st_mtime_ns)
+
+    @property
+    def template(self) -> Template:
+        # the environment caches the compiled template and checks the file's mtime itself
+        return self.env.get_template(TEMPLATE_NAME)
+
+    def _load_stylesheet(self):
+        mtime = os.stat(self._path(STYLESHEET_NAME)).st_mtime_ns
+        if mtime != self._stylesheet_mtime:
+            with open(self._path(STYLESHEET_NAME), encoding="utf-8") as stylesheet_file:
+                self._stylesheet_text = stylesheet_file.read()
+            self._stylesheet = CSS(string=self._stylesheet_text, font_config=self.font_config)
+            self._stylesheet_mtime = mtime
+
+    @property
+    def stylesheet(self) -> CSS:
+        self._load_stylesheet()
+        return self._stylesheet
+
+    @property
+    def stylesheet_text(self) -> str:
+        self._load_stylesheet()
+        return self._stylesheet_text
+
+    # content hash of RENDER_REVISION, the template and the stylesheet, changes whenever any of them does
+    @property
+    def version(self) -> str:
+        mtimes = (RENDER_REVISION, *self._mtimes())
+        if mtimes != self._version_mtimes:
+            digest = hashlib.sha256(RENDER_REVISION.encode())
+            for name in (TEMPLATE_NAME, STYLESHEET_NAME):
+                with open(self._path(name), "rb") as template_file:
+                    digest.update(template_file.read())
+            self._version = digest.hexdigest()[:16]
+            self._version_mtimes = mtimes
+        return self._version
+
+    # Values are escaped (names and deduction reasons are user input); only the <br> between
+    # itemized lines and our own stylesheet are emitted as markup.
+    def render_html(self, salary_data:dict, inline_stylesheet:bool = False) -> str:
+        stylesheet = Markup(self.stylesheet_text) if inline_stylesheet else None
+        lines = {field: Markup("<br>").join(salary_data[field].split("<br>")) for field in LINE_FIELDS if isinstance(salary_data.get(field), str)}
+        return self.template.render(**{**salary_data, **lines}, stylesheet=stylesheet)
+
+    def render_pdf(self, salary_data:dict) -> bytes:
+        html = HTML(string=self.render_html(salary_data), base_url=self.templates_dir)
+        return html.write_pdf(stylesheets=[self.stylesheet], font_config=self.font_config)
+
+
+_render_context: Optional[SalaryRenderContext] = None
+
+def get_render_context() -> SalaryRenderContext:
+    global _render_context
+    if _render_context is None:
+        _render_context = SalaryRenderContext()
+    return _render_context
+
+
+# entry point for the render pool, must stay a module level function so it can be pickled
+def render_salary_pdf(salary_data:dict) -> bytes:
+    return get_render_context().render_pdf(salary_data)
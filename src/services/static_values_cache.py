@@ -0,0 +1,74 @@
+import bisect
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from dotenv import load_dotenv
+from services.cache_version import SharedVersion
+from shared.models_schemas.models import StaticValues
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+# seconds a static values document is served from memory at most
+STATIC_VALUES_CACHE_TTL = float(os.getenv("STATIC_VALUES_CACHE_TTL") or 300)
+# seconds between two reads of the shared version, i.e. how late a worker may see another worker's write
+STATIC_VALUES_VERSION_INTERVAL = float(os.getenv("STATIC_VALUES_VERSION_INTERVAL") or 2)
+
+
+
+# Read-through cache of validated StaticValues, keyed by values id, plus an interval map of the
+# versions resolved by date: a resolved version answers every date of the range the loader returns
+# with it, the dates between the neighbouring version bounds, without another query. Writes of this
+# worker clear both and bump the "static_values" SharedVersion; the other workers see it move
+# within STATIC_VALUES_VERSION_INTERVAL and drop their entries.
+class StaticValuesCache:
+
+    def __init__(self, ttl:float = STATIC_VALUES_CACHE_TTL, version_interval:float = STATIC_VALUES_VERSION_INTERVAL):
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self._entries: Dict[Hashable, Tuple[float, Optional[StaticValues]]] = {}
+        # (start, end, expires, values) sorted by start, values is None where no version is in force
+        self._intervals: List[Tuple[datetime, datetime, float, Optional[StaticValues]]] = []
+        self._shared = SharedVersion("static_values")
+
+    async def _check_version(self):
+        if await self._shared.moved(self.version_interval):
+            self.invalidate()
+
+    # the cached value of key, loaded (and cached, None included) on a miss
+    async def get(self, key:Hashable, loader:Callable[[], Awaitable[Optional[StaticValues]]]) -> Optional[StaticValues]:
+        await self._check_version()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        values = await loader()
+        self._entries[key] = (time.monotonic() + self.ttl, values)
+        return values
+
+    # the version in force at as_of, loaded on a miss as (values, start, end) and memoized for [start, end),
+    # the range in which no version starts or ends, so the same version is in force on all of it
+    async def as_of(self, as_of:datetime, loader:Callable[[], Awaitable[Tuple[Optional[StaticValues], datetime, datetime]]]) -> Optional[StaticValues]:
+        await self._check_version()
+        position = bisect.bisect_right(self._intervals, as_of, key=lambda interval: interval[0]) - 1
+        if position >= 0:
+            start, end, expires, values = self._intervals[position]
+            if as_of < end and expires > time.monotonic():
+                return values
+        values, start, end = await loader()
+        self._intervals = [interval for interval in self._intervals if interval[1] <= start or interval[0] >= end]
+        bisect.insort(self._intervals, (start, end, time.monotonic() + self.ttl, values), key=lambda interval: interval[0])
+        return values
+
+    def invalidate(self):
+        self._entries.clear()
+        self._intervals = []
+
+    # called after every static values write, so every worker reloads
+    async def changed(self):
+        self.invalidate()
+        await self._shared.bump()
+
+
+static_values_cache = StaticValuesCache()
@@ -0,0 +1,67 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from dotenv import load_dotenv
+from services.cache_version import SharedVersion
+from services.events import DAILY_REPORT, EMPLOYEE, ChangeEvent, event_bus
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'env', '.env')
+load_dotenv(dotenv_path)
+
+# seconds a summary is served from memory at most
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL") or 60)
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES") or 256)
+# seconds between two reads of the shared version, i.e. how late a worker may see another worker's write
+SUMMARY_CACHE_VERSION_INTERVAL = float(os.getenv("SUMMARY_CACHE_VERSION_INTERVAL") or 2)
+
+
+# Results of range aggregations keyed by their (range, filter) parameters.
+# Any daily report or employee change event of this worker drops every entry and bumps the
+# "summaries" SharedVersion, the other workers drop theirs once they see it move, within
+# SUMMARY_CACHE_VERSION_INTERVAL. A range summary can not tell cheaply which reports it covered.
+class SummaryCache:
+
+    def __init__(self, ttl:float = SUMMARY_CACHE_TTL, max_entries:int = SUMMARY_CACHE_MAX_ENTRIES,
+                 version_interval:float = SUMMARY_CACHE_VERSION_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_interval = version_interval
+        self._shared = SharedVersion("summaries")
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    async def get(self, key:Hashable) -> Optional[Any]:
+        if await self._shared.moved(self.version_interval):
+            self.invalidate()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key:Hashable, value:Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self):
+        self._entries.clear()
+
+    # called after the writes of this worker the summaries depend on, so every worker recomputes
+    async def changed(self):
+        self.invalidate()
+        await self._shared.bump()
+
+
+summary_cache = SummaryCache()
+
+
+@event_bus.subscribe(DAILY_REPORT)
+@event_bus.subscribe(EMPLOYEE)
+async def invalidate_summaries(event:ChangeEvent):
+    await summary_cache.changed()
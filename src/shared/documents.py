@@ -0,0 +1,22 @@
+import copy
+from bson import ObjectId
+
+
+# the document as it is after applying {"$set": update_data}, dotted keys included
+def apply_set(document:dict, update_data:dict) -> dict:
+    updated = copy.deepcopy(document)
+    for key, value in update_data.items():
+        target = updated
+        *parents, field = key.split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[field] = value
+    return updated
+
+
+# every report write stamps the report with a new write id, the rollups and the buckets
+# tell by it which write of a report they hold
+WRITE_ID = "write_id"
+
+def new_write_id() -> str:
+    return str(ObjectId())
@@ -0,0 +1,179 @@
+import codecs
+import csv
+import json
+from fastapi import HTTPException
+from pydantic import ValidationError
+from typing import AsyncIterator, Tuple, Union
+from shared.documents import apply_set
+
+
+invalid_body_error = HTTPException(status_code=400, detail="Body must be NDJSON or a JSON array of records")
+invalid_csv_error = HTTPException(status_code=400, detail="Body must be CSV with a header row")
+
+
+def validation_error_message(e:ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(loc) for loc in error['loc']) or 'body'}: {error['msg']}" for error in e.errors())
+
+
+# a single record (NDJSON line, array element or CSV record) larger than this rejects the body
+MAX_RECORD_CHARS = 1024 * 1024
+
+
+# Incremental parser of a JSON array: feed it the text as it arrives and it returns the
+# elements completed so far, only the unfinished element is kept in memory.
+class _JsonArrayParser:
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.expect = "["      # then "value_or_end", "value" or "separator"
+        self.done = False
+
+    def feed(self, text:str, final:bool = False) -> list:
+        buffer = self.buffer + text
+        position = 0
+        records = []
+        while not self.done:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position == len(buffer):
+                break
+            char = buffer[position]
+            if self.expect == "[":
+                if char != "[":
+                    raise invalid_body_error
+                self.expect = "value_or_end"
+                position += 1
+            elif self.expect == "separator":
+                if char not in ",]":
+                    raise invalid_body_error
+                self.expect = "value"
+                self.done = char == "]"
+                position += 1
+            elif char == "]" and self.expect == "value_or_end":
+                self.done = True
+                position += 1
+            else:
+                try:
+                    record, end = self.decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if final or len(buffer) - position > MAX_RECORD_CHARS:
+                        raise invalid_body_error
+                    break
+                # a number at the very end may go on in the next chunk
+                if end == len(buffer) and not final:
+                    break
+                records.append(record)
+                self.expect = "separator"
+                position = end
+        self.buffer = buffer[position:]
+        if self.done and self.buffer.strip():
+            raise invalid_body_error
+        if final and not self.done:
+            raise invalid_body_error
+        return records
+
+
+async def _iter_array_records(chunks:AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, dict]]:
+    parser = _JsonArrayParser()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    row = 0
+    try:
+        async for chunk in chunks:
+            for record in parser.feed(text_decoder.decode(chunk)):
+                row += 1
+                yield row, record
+        for record in parser.feed(text_decoder.decode(b"", final=True), final=True):
+            row += 1
+            yield row, record
+    except UnicodeDecodeError:
+        raise invalid_body_error
+
+
+async def _iter_ndjson_records(chunks:AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    buffer = b""
+    row = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            row += 1
+            if line.strip():
+                yield row, line
+        if len(buffer) > MAX_RECORD_CHARS:
+            raise invalid_body_error
+    if buffer.strip():
+        yield row + 1, buffer
+
+
+# (row, record) for every record of an NDJSON or JSON array body, rows are 1-based.
+# Both are parsed as the body streams in. NDJSON lines are handed over raw so pydantic
+# parses and validates them in one step; a malformed JSON array rejects the body (400)
+# where NDJSON reports the bad line, so NDJSON is the format of choice for large imports.
+async def iter_body_records(chunks:AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Union[bytes, dict]]]:
+    head = b""
+    async for chunk in chunks:
+        head += chunk
+        if head.strip():
+            break
+
+    async def body():
+        yield head
+        async for chunk in chunks:
+            yield chunk
+
+    records = _iter_array_records(body()) if head.lstrip().startswith(b"[") else _iter_ndjson_records(body())
+    async for record in records:
+        yield record
+
+
+# (row, record) for every data row of a CSV body, rows are 1-based and the header is not counted.
+# Dotted columns (employee_type.is_full_time) become nested documents and empty cells are left out,
+# so the model's defaults apply; the strings are converted by pydantic when the record is validated.
+async def iter_csv_records(chunks:AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, dict]]:
+    buffer = b""
+    pending = ""
+    header = None
+    row = 0
+
+    def parse(text:str):
+        try:
+            return next(csv.reader([text]))
+        except (csv.Error, StopIteration):
+            raise invalid_csv_error
+
+    async def complete_lines():
+        nonlocal buffer
+        async for chunk in chunks:
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                yield line
+            if len(buffer) > MAX_RECORD_CHARS:
+                raise invalid_csv_error
+        if buffer:
+            yield buffer
+
+    async for line in complete_lines():
+        try:
+            pending += line.decode("utf-8-sig" if header is None and not pending else "utf-8")
+        except UnicodeDecodeError:
+            raise invalid_csv_error
+        # a quoted cell may span lines, the record is complete once its quotes are balanced
+        if pending.count('"') % 2:
+            if len(pending) > MAX_RECORD_CHARS:
+                raise invalid_csv_error
+            pending += "\n"
+            continue
+        text, pending = pending.rstrip("\r"), ""
+        if not text.strip():
+            continue
+        if header is None:
+            header = [name.strip() for name in parse(text)]
+            continue
+        row += 1
+        cells = {name: value for name, value in zip(header, parse(text)) if name and value != ""}
+        yield row, apply_set({}, cells)
+
+    if pending:
+        raise invalid_csv_error
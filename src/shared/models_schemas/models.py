@@ -81,6 +81,9 @@ class StaticValues(BaseModel):
     no_of_qulified_appt_tier_setter : Dict[str,float] 
     no_of_qulified_appt_tier_fronter : Dict[str,float] 
     # saturdays_price: float
+    # in force from effective_from (inclusive) to effective_to (exclusive), None is an open end
+    effective_from : Optional[datetime] = None
+    effective_to : Optional[datetime] = None
 
 # Daily report model
 class DailyReport(BaseModel):
@@ -91,63 +94,11 @@ class DailyReport(BaseModel):
     deductions: Deduction
     allowance: AdditionalAllowance
     adherence_status: bool
-    total_salary: float = None
+    # set on every write, see services.payroll.daily_salary
+    total_salary: Optional[float] = None
     is_saturday: bool
     working_hours: float
 
-    # def calculate_total_salary(self, static_values:StaticValues, employee:Employee):
-    #     if employee.tier_type == "C" and employee.employee_type.is_appointment_serrer == True:
-    #         if self.appointment.no_of_qualified_appointment >= 3 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "B" and employee.employee_type.is_appointment_serrer == True:
-    #         if self.appointment.no_of_qualified_appointment >= 4 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "A" and employee.employee_type.is_appointment_serrer == True:
-    #         if self.appointment.no_of_qualified_appointment >= 6 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "C" and employee.employee_type.is_appointment_serrer == False:
-    #         if self.appointment.no_of_qualified_appointment >= 7 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "B" and employee.employee_type.is_appointment_serrer == False:
-    #         if self.appointment.no_of_qualified_appointment >= 6 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "A" and employee.employee_type.is_appointment_serrer == False:
-    #         if self.appointment.no_of_qualified_appointment >= 6 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-                
-    #     if self.is_saturday:
-    #         saturdays = self.working_hours * static_values.hour_price[employee.tier_type]
-    #     else:
-    #         saturdays = 0
-    #     # Calculate compensation, allowance, and deductions
-    #     spiffs = self.compensation.spiffs * 2 * static_values.cad
-    #     butter_up = self.compensation.butter_up * static_values.butter_up
-        
-    #     compensation = spiffs + kpis + butter_up
-    #     allowance = self.allowance.allowance_value
-    #     deductions = self.deductions.deductions
-
-    #     if self.working_hours != 9 :
-    #         # Calculate the value based on working hours
-    #         hours_value = (self.working_hours - 9) * static_values.hour_price[employee.tier_type]
-    #     else:
-    #         hours_value = 0
-        
-    #     # Total salary calculation
-    #     total_salary = compensation + allowance + saturdays + hours_value - deductions
-    #     return total_salary
 
 
     
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Dict, Optional, List
+from typing import Any, Dict, Optional, List, Union
 from datetime import datetime
 
 
@@ -114,6 +114,8 @@ class StaticValuesBase(BaseModel):
     no_of_qulified_appt_tier_setter : Dict[str,float]
     no_of_qulified_appt_tier_fronter : Dict[str,float]
     # saturdays_price: float
+    effective_from : Optional[datetime] = None
+    effective_to : Optional[datetime] = None
     
 
 class StaticValuesCreate(StaticValuesBase):
@@ -131,64 +133,11 @@ class DailyReportBase(BaseModel):
     deductions: Deduction
     allowance: AdditionalAllowance
     adherence_status: bool
-    total_salary: float = None
+    # set on every write, see services.payroll.daily_salary
+    total_salary: Optional[float] = None
     is_saturday: bool
     working_hours: float
 
-    # def calculate_total_salary(self, static_values:StaticValuesBase, employee:EmployeeBase):
-    #     if employee.tier_type == "C" and employee.employee_type.is_appointment_serrer == True:
-    #         if self.appointment.no_of_qualified_appointment >= 3 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "B" and employee.employee_type.is_appointment_serrer == True:
-    #         if self.appointment.no_of_qualified_appointment >= 4 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "A" and employee.employee_type.is_appointment_serrer == True:
-    #         if self.appointment.no_of_qualified_appointment >= 6 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "C" and employee.employee_type.is_appointment_serrer == False:
-    #         if self.appointment.no_of_qualified_appointment >= 7 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "B" and employee.employee_type.is_appointment_serrer == False:
-    #         if self.appointment.no_of_qualified_appointment >= 6 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-    #     elif employee.tier_type == "A" and employee.employee_type.is_appointment_serrer == False:
-    #         if self.appointment.no_of_qualified_appointment >= 6 :
-    #             kpis = self.compensation.kpis * static_values.kpis 
-    #         else:
-    #             kpis = 0
-                
-    #     if self.is_saturday:
-    #         saturdays = self.working_hours * static_values.hour_price[employee.tier_type]
-    #     else:
-    #         saturdays = 0
-                    
-    #     # Calculate compensation, allowance, and deductions
-    #     spiffs = self.compensation.spiffs * static_values.cad
-    #     butter_up = self.compensation.butter_up * static_values.butter_up
-        
-    #     compensation = spiffs + kpis + butter_up
-    #     allowance = self.allowance.allowance_value
-    #     deductions = self.deductions.deductions
-
-    #     if self.working_hours != 9 and self.working_hours != 0:
-    #         # Calculate the value based on working hours
-    #         hours_value = (self.working_hours - 9) * static_values.hour_price[employee.tier_type]
-    #     else:
-    #         hours_value = 0
-        
-    #     # Total salary calculation
-    #     total_salary = compensation + allowance + saturdays + hours_value - deductions
-    #     return total_salary
     
     
 class DailyReportCreate(DailyReportBase):
@@ -205,5 +154,172 @@ class DailyReportRequest(BaseModel):
     report_date : datetime
 
 
+class BulkRowError(BaseModel):
+    row : int
+    error : str
 
 
+class BulkIngestResponse(BaseModel):
+    received : int
+    inserted : int
+    errors : List[BulkRowError] = []
+
+
+# a partial update of the report of (employee_id, date), {"$set"} style with dotted keys allowed,
+# with upsert the report is created when missing (the update then has to hold a whole report)
+class DailyReportBulkUpdate(BaseModel):
+    employee_id : int
+    date : datetime
+    update : Dict[str, Any]
+    upsert : bool = False
+
+
+class BulkUpdateResponse(BaseModel):
+    received : int
+    matched : int
+    modified : int
+    upserted : int
+    errors : List[BulkRowError] = []
+
+
+class SalaryTotalResponse(BaseModel):
+    employee_id : int
+    start_date : datetime
+    end_date : datetime
+    total_salary : float       # sum of the reports' daily shares, see services.payroll.daily_salary
+    report_count : int
+    missing_salaries : int     # reports written before their employee or static values existed, see backfill_total_salary
+
+
+
+
+
+
+
+# Payroll schemas
+class MonthlyReportTotals(BaseModel):
+    report_count : int = 0
+    present_days : int = 0
+    absent_days : int = 0
+    missing_hours : float = 0
+    overtime_hours : float = 0
+    saturday_hours : float = 0
+    qualified_appointments : int = 0
+    kpis : float = 0
+    spiffs : float = 0
+    butter_up : float = 0
+    deductions : float = 0
+
+
+# one employee's (or with group_by=company one company's) totals over a date range
+class TeamSummaryRow(MonthlyReportTotals):
+    employee_id : Optional[int] = None
+    company_id : Optional[int] = None
+    employees : int = 1
+    working_hours : float = 0
+    total_salary : float = 0
+
+
+class TeamSummaryResponse(BaseModel):
+    start_date : datetime
+    end_date : datetime
+    company_id : Optional[int] = None
+    group_by : str
+    rows : List[TeamSummaryRow]
+
+
+class PayrollResult(BaseModel):
+    employee_id : int
+    name : str
+    position : str
+    tier_type : str
+    is_onsite : bool
+    has_insurance : bool
+    is_appointment_serrer : bool
+    is_full_time : bool
+    month : str
+    month_name : str
+    year : str
+    basic_salary : float
+    basic_salary_deduction_absent : float
+    basic_salary_deduction_missing_hours : float
+    final_salary : float
+    no_show_days : str = ""
+    missing_hours : str = ""
+    saturdays : str = ""
+    overpay_summary : float
+    additional_hours : str = ""
+    additional_hours_value : float
+    kpis_score : str = ""
+    kpis_total : float
+    spiffs_logs : str = ""
+    spiffs_total : float
+    transportation_allowance : Union[str, float]
+    deductions_info : str = ""
+    deductions : float
+    butter_up : float
+    total_salary : float
+
+
+class PayrollRunRequest(BaseModel):
+    year : int
+    month : int = Field(ge=1, le=12)
+    values_id : Optional[int] = None     # None: the static values version in force at the start of the month
+    company_id : Optional[int] = None
+
+
+class PayrollRunResponse(BaseModel):
+    year : int
+    month : int
+    output_dir : str
+    employees : int
+    generated : int
+    errors : Dict[int,str] = {}
+
+
+class PayrollCloseResponse(PayrollRunResponse):
+    already_archived : int = 0
+
+
+class PdfRenderStats(BaseModel):
+    workers : int
+    max_queue : int
+    running : int
+    queue_depth : int
+    completed : int
+    failed : int
+    rejected : int
+
+
+class EventBusStats(BaseModel):
+    published : int
+    consumed : int
+    failed : int
+    dropped : int
+    queue_depth : int
+    subscribers : Dict[str, int]
+
+
+class MonthlyRollup(MonthlyReportTotals):
+    employee_id : int
+    year : int
+    month : int
+
+
+class RollupRebuildResponse(BaseModel):
+    rollups : int
+
+
+class RollupDriftResponse(BaseModel):
+    year : int
+    month : int
+    checked : int
+    drifted : List[int]     # employees whose rollup differs from their reports
+
+
+class EmployeeCacheStats(BaseModel):
+    hits : int
+    misses : int
+    evictions : int
+    size : int
+    max_entries : int
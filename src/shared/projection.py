@@ -0,0 +1,65 @@
+from functools import lru_cache
+from fastapi import HTTPException
+from pydantic import BaseModel, create_model
+from typing import Dict, List, Optional, Type
+
+
+# Turn a comma separated `fields=` parameter into a Mongo projection.
+# Nested fields use dots (compensation.kpis); only fields of the model are accepted.
+# Mongo rejects a projection naming both a field and one of its subfields, the field alone is kept.
+def parse_fields(fields:Optional[str], model:Type[BaseModel]) -> Optional[Dict[str, int]]:
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if not _has_field(model, name.split("."))]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    names = set(names)
+    projection = {name: 1 for name in sorted(names) if not any(parent in names for parent in _parents(name))}
+    projection["_id"] = 0
+    return projection
+
+
+def _parents(name:str) -> List[str]:
+    parts = name.split(".")
+    return [".".join(parts[:end]) for end in range(1, len(parts))]
+
+
+def _has_field(model:Type[BaseModel], path:List[str]) -> bool:
+    field = model.model_fields.get(path[0])
+    if field is None:
+        return False
+    if len(path) == 1:
+        return True
+    annotation = field.annotation
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel) and _has_field(annotation, path[1:])
+
+
+# The dotted leaf fields of the model in declaration order, only the projected ones with a projection:
+# a fixed set of columns whatever fields the documents happen to hold.
+def model_columns(model:Type[BaseModel], projection:Optional[Dict[str, int]] = None, prefix:str = "") -> List[str]:
+    columns = []
+    for name, field in model.model_fields.items():
+        path = f"{prefix}{name}"
+        if projection and not any(selected == path or path.startswith(f"{selected}.") or selected.startswith(f"{path}.")
+                                  for selected, include in projection.items() if include):
+            continue
+        annotation = field.annotation
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            columns.extend(model_columns(annotation, projection, f"{path}."))
+        else:
+            columns.append(path)
+    return columns
+
+
+# Same fields as the model but all optional, nested models included,
+# so a projected document validates without the fields it left out.
+@lru_cache(maxsize=None)
+def partial_model(model:Type[BaseModel]) -> Type[BaseModel]:
+    fields = {}
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            annotation = partial_model(annotation)
+        fields[name] = (Optional[annotation], None)
+    return create_model(f"Partial{model.__name__}", **fields)
@@ -1,3 +1,4 @@
+import importlib
 import pytest
 from fastapi.testclient import TestClient
 from src.main import app  # Adjust the import based on your project structure
@@ -6,4 +7,24 @@ from src.main import app  # Adjust the import based on your project structure
 def client():
     with TestClient(app) as client:
         yield client
-        
\ No newline at end of file
+        
+
+# the in-process caches outlive a test, every test starts from a cold cache
+@pytest.fixture(autouse=True)
+def clear_caches():
+    from services.static_values_cache import static_values_cache
+    static_values_cache.invalidate()
+    from services.employee_cache import employee_cache
+    employee_cache.invalidate()
+
+
+# the payslip cache, archive and payroll run output go to the test's own directory, not the shared defaults
+@pytest.fixture(autouse=True)
+def payslip_dirs(tmp_path, monkeypatch):
+    for prefix in ("", "src."):
+        payslip_cache = importlib.import_module(f"{prefix}services.payslip_cache").payslip_cache
+        monkeypatch.setattr(payslip_cache, "directory", str(tmp_path / "payslip_cache"))
+        monkeypatch.setattr(payslip_cache, "_size", None)
+        payslip_archive = importlib.import_module(f"{prefix}services.payslip_archive").payslip_archive
+        monkeypatch.setattr(payslip_archive, "directory", str(tmp_path / "payslip_archive"))
+        monkeypatch.setattr(importlib.import_module(f"{prefix}modules.payroll.payroll_controller"), "PAYSLIPS_DIR", str(tmp_path / "payslips"))
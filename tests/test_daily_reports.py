@@ -1,15 +1,27 @@
+import csv
+import io
+import json
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, patch, AsyncMock
 from mongomock import MongoClient
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 from src.main import app
 from src.modules.auth.authentication import create_access_token
-from src.modules.daily_reports.daily_reports_controller import create_daily_report_control, delete_daily_report_control, get_all_daily_reports_control, get_daily_report_control, get_daily_reports_by_employee_and_renage_date_control, update_daily_report_control
+from src.modules.daily_reports.daily_reports_controller import bulk_update_daily_reports_control, get_team_summary_control, export_daily_reports_control, get_daily_reports_page_control, bulk_create_daily_reports_control, create_daily_report_control, delete_daily_report_control, get_all_daily_reports_control, get_daily_report_control, get_daily_reports_by_employee_and_renage_date_control, update_daily_report_control
 from src.modules.daily_reports.daily_reports_router import get_all_daily_reports_endpoints, get_daily_reports_by_employee_and_renage_date_endpoint
 from src.shared.models_schemas.models import  Deduction, DailyReport
-from src.modules.daily_reports.daily_reports_crud import create_daily_report, delete_daily_report, get_all_daily_reports, get_daily_report, get_daily_reports_by_employee_and_range_date, update_daily_report
-from src.shared.models_schemas.schemas import DailyReportCreate, DailyReportResponse
+from src.modules.daily_reports.daily_reports_crud import backfill_total_salary, recompute_employee_salaries, recompute_static_values_salaries, create_daily_report, delete_daily_report, get_team_summary, get_total_salary, update_daily_reports, get_all_daily_reports, get_daily_report, get_daily_reports_by_employee_and_range_date, update_daily_report
+from src.shared.models_schemas.schemas import DailyReportBulkUpdate, DailyReportCreate, DailyReportResponse
+from src.services.daily_salary import SalaryLookups
+from src.modules.daily_reports.report_buckets_crud import apply_bucket_changes
+from src.shared.ingest import iter_body_records
+from src.services.summary_cache import SummaryCache
+from src.services.static_values_cache import StaticValuesCache
+from src.services.employee_cache import EmployeeCache
+from src.services.events import EMPLOYEE, STATIC_VALUES, ChangeEvent
+from tests.test_payroll import get_test_employee, get_test_static_values, get_test_report, get_test_reports
 
 client = TestClient(app)
 
@@ -73,8 +85,11 @@ async def test_create_daily_report():
 
         # Assertions: Check all attributes and type
         assert result== test_daily_report
-        # Verify that the employee was inserted into the collection
-        mock_collection.insert_one.assert_called_once_with(test_daily_report.model_dump())
+        # Verify that the report was inserted into the collection, stamped with its write id
+        mock_collection.insert_one.assert_called_once()
+        inserted = dict(mock_collection.insert_one.call_args.args[0])
+        assert inserted.pop("write_id")
+        assert inserted == test_daily_report.model_dump()
         
 
 # Test for create_daily_report_control
@@ -327,8 +342,8 @@ async def test_delete_daily_report():
     # Patch the daily_report_collection used in get_daily_report
     with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection):
         
-        # Mock the delete_one method to return result including successful deletion
-        mock_collection.delete_one.return_value = True
+        # Mock the find_one_and_delete method to return the deleted document
+        mock_collection.find_one_and_delete.return_value = test_daily_report.model_dump()
         
         # Call the function
         result = await delete_daily_report(test_daily_report.employee_id, test_daily_report.date)
@@ -339,8 +354,8 @@ async def test_delete_daily_report():
     # Patch the daily_report_collection used in get_daily_report
     with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection):
         
-        # Mock the delete_one method to return result including successful deletion
-        mock_collection.delete_one.return_value = False
+        # Mock the find_one_and_delete method to return None when nothing was deleted
+        mock_collection.find_one_and_delete.return_value = None
         
         # Call the function
         result = await delete_daily_report(test_daily_report.employee_id, test_daily_report.date)
@@ -375,8 +390,8 @@ async def test_delete_daily_report_endpoint():
     test_daily_report.employee_id = 1
     test_daily_report.date = datetime(2024, 10, 10)
 
-    # Mock the delete_daily_report_control function to return a test employee
-    with patch('src.modules.daily_reports.daily_reports_controller.delete_daily_report_control', AsyncMock(return_value=True)):
+    # Mock the delete_daily_report_control function the app's router is bound to
+    with patch('modules.daily_reports.daily_reports_router.delete_daily_report_control', AsyncMock(return_value=True)):
         # Patch the authorization dependency to always return a valid user
         with patch('src.modules.auth.authorizations.get_admin', return_value={"email": "admin@example.com", "role": "admin"}):
             # Create a mock token for the authenticated user
@@ -676,3 +691,487 @@ async def test_get_all_daily_reports_endpoint():
                     # assert response.json() == [daily_report.model_dump() for daily_report in mock_daily_report_data]
                     assert [daily_report.model_dump() for daily_report in result] ==[daily_report.model_dump() for daily_report in mock_daily_report_data]
 
+
+
+# test that a second report for the same employee and date is a conflict
+@pytest.mark.asyncio
+async def test_create_daily_report_control_duplicate():
+    with patch('src.modules.daily_reports.daily_reports_controller.create_daily_report', AsyncMock(side_effect=DuplicateKeyError("duplicate key"))):
+        with pytest.raises(Exception) as exc_info:
+            await create_daily_report_control(DailyReportCreate(**get_test_daily_report_data()))
+
+        assert exc_info.value.status_code == 409
+
+
+# Helper function to turn byte chunks into an async stream
+async def stream_chunks(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+# test for reading NDJSON and JSON array bodies
+@pytest.mark.asyncio
+async def test_iter_body_records():
+    # lines split across chunks, blank lines and no trailing newline
+    records = [record async for record in iter_body_records(stream_chunks([b'{"a": 1}\n{"a"', b': 2}\n\n', b'{"a": 3}']))]
+    assert records == [(1, b'{"a": 1}'), (2, b'{"a": 2}'), (4, b'{"a": 3}')]
+
+    records = [record async for record in iter_body_records(stream_chunks([b' [{"a": 1},', b' {"a": 2}]']))]
+    assert records == [(1, {"a": 1}), (2, {"a": 2})]
+
+    with pytest.raises(Exception) as exc_info:
+        [record async for record in iter_body_records(stream_chunks([b'[{"a": 1},']))]
+    assert exc_info.value.status_code == 400
+
+    # array elements are yielded as soon as they are complete, numbers and strings split across chunks included
+    chunks = [b'[{"a": 1', b'2}, {"b": "x', b'y"}, 4', b'2 , [1]', b']']
+    records = iter_body_records(stream_chunks(chunks))
+    assert await records.__anext__() == (1, {"a": 12})
+    assert [record async for record in records] == [(2, {"b": "xy"}), (3, 42), (4, [1])]
+    assert [record async for record in iter_body_records(stream_chunks([b"[", b" ]"]))] == []
+
+    for body in (b'[{"a": 1}} ]', b'[{"a": 1}] x', b'[1 2]'):
+        with pytest.raises(Exception) as exc_info:
+            [record async for record in iter_body_records(stream_chunks([body]))]
+        assert exc_info.value.status_code == 400
+
+
+# test that bulk ingest writes valid rows in chunks and reports the bad ones
+@pytest.mark.asyncio
+async def test_bulk_create_daily_reports_control():
+    mock_collection = get_mock_collection()
+    mock_collection.create_index([("employee_id", 1), ("date", 1)], unique=True)
+    report = get_test_daily_report_data()
+    lines = [
+        DailyReportCreate(**report).model_dump_json().encode(),
+        DailyReportCreate(**dict(report, date=datetime(2024, 9, 2))).model_dump_json().encode(),
+        b'{"employee_id": "not a number"}',
+        DailyReportCreate(**report).model_dump_json().encode(),
+        DailyReportCreate(**dict(report, date=datetime(2024, 9, 3))).model_dump_json().encode(),
+    ]
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.apply_report_deltas', AsyncMock()) as mock_deltas, \
+         patch('src.modules.daily_reports.daily_reports_crud.payslip_cache', MagicMock()), \
+         patch('src.modules.daily_reports.daily_reports_controller.BULK_CHUNK_SIZE', 2):
+        result = await bulk_create_daily_reports_control(iter_body_records(stream_chunks([b"\n".join(lines)])))
+
+        assert result.received == 5
+        assert result.inserted == 3
+        assert [error.row for error in result.errors] == [3, 4]
+        assert result.errors[0].error.startswith("employee_id")
+        assert result.errors[1].error == "Daily report already exists for this employee and date"
+        assert mock_collection.count_documents({}) == 3
+        # one rollup update per written chunk
+        assert mock_deltas.await_count == 2
+
+    drop_mock_collection()
+
+
+# test that walking the pages with the cursor returns every report once, in order
+@pytest.mark.asyncio
+async def test_get_daily_reports_page_control():
+    mock_collection = get_mock_collection()
+    report = get_test_daily_report_data()
+    mock_collection.insert_many([
+        DailyReportCreate(**dict(report, employee_id=employee_id, date=datetime(2024, 9, day))).model_dump()
+        for day in (3, 1, 2) for employee_id in (2, 1)
+    ])
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection):
+        keys = []
+        cursor = None
+        pages = 0
+        while True:
+            reports, cursor = await get_daily_reports_page_control(4, cursor)
+            keys.extend((report.date.day, report.employee_id) for report in reports)
+            pages += 1
+            if cursor is None:
+                break
+
+        assert pages == 2
+        assert keys == [(1, 1), (1, 2), (2, 1), (2, 2), (3, 1), (3, 2)]
+
+        # filters combine with the cursor
+        reports, cursor = await get_daily_reports_page_control(1, employee_id=2, start_date=datetime(2024, 9, 2))
+        assert [(report.date.day, report.employee_id) for report in reports] == [(2, 2)]
+        reports, cursor = await get_daily_reports_page_control(1, cursor, employee_id=2, start_date=datetime(2024, 9, 2))
+        assert [(report.date.day, report.employee_id) for report in reports] == [(3, 2)]
+        assert cursor is None
+
+    drop_mock_collection()
+
+    with pytest.raises(Exception) as exc_info:
+        await get_daily_reports_page_control(10, "not a cursor")
+    assert exc_info.value.status_code == 400
+
+
+# Helper function to read a streamed response body
+async def read_streaming_response(response):
+    return [chunk async for chunk in response.body_iterator]
+
+
+# test for the NDJSON and CSV exports with a projection
+@pytest.mark.asyncio
+async def test_export_daily_reports_control():
+    mock_collection = get_mock_collection()
+    report = get_test_daily_report_data()
+    mock_collection.insert_many([DailyReportCreate(**dict(report, employee_id=employee_id)).model_dump() for employee_id in (2, 1)])
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection):
+        response = await export_daily_reports_control("ndjson", "employee_id,date,compensation.kpis")
+        assert response.media_type == "application/x-ndjson"
+        chunks = await read_streaming_response(response)
+        # the first report is sent on its own, before the rest is read
+        assert len(chunks) == 2
+        lines = b"".join(chunks).decode().splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {"employee_id": 1, "date": "2023-01-01T00:00:00", "compensation": {"kpis": 500}},
+            {"employee_id": 2, "date": "2023-01-01T00:00:00", "compensation": {"kpis": 500}},
+        ]
+
+        response = await export_daily_reports_control("csv", employee_id=2)
+        assert response.media_type == "text/csv"
+        rows = list(csv.DictReader(io.StringIO(b"".join(await read_streaming_response(response)).decode())))
+        assert len(rows) == 1
+        assert rows[0]["employee_id"] == "2"
+        assert rows[0]["compensation.spiffs"] == "150.0"
+        assert "_id" not in rows[0]
+
+        # the columns come from the model, not from the first report: it has no salary, the second one has
+        mock_collection.update_one({"employee_id": 1}, {"$unset": {"total_salary": ""}})
+        mock_collection.update_one({"employee_id": 2}, {"$set": {"total_salary": 120.5}})
+        response = await export_daily_reports_control("csv")
+        rows = list(csv.DictReader(io.StringIO(b"".join(await read_streaming_response(response)).decode())))
+        assert [(row["employee_id"], row["total_salary"]) for row in rows] == [("1", ""), ("2", "120.5")]
+        assert list(rows[0])[:3] == ["date", "employee_id", "appointment.no_of_qualified_appointment"]
+
+        response = await export_daily_reports_control("csv", "employee_id,compensation")
+        lines = b"".join(await read_streaming_response(response)).decode().splitlines()
+        assert lines[0] == "employee_id,compensation.spiffs,compensation.kpis,compensation.butter_up"
+
+    drop_mock_collection()
+
+    with pytest.raises(Exception) as exc_info:
+        await export_daily_reports_control("csv", "employee_id,password")
+    assert exc_info.value.status_code == 400
+
+
+# test that fields= only fetches and returns the projected fields
+@pytest.mark.asyncio
+async def test_get_daily_reports_with_fields():
+    mock_collection = get_mock_collection()
+    report = DailyReportCreate(**dict(get_test_daily_report_data(), total_salary=100)).model_dump()
+    mock_collection.insert_one(dict(report))
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection):
+        result = await get_daily_report_control(1, report["date"], "working_hours,adherence_status")
+        assert result.model_dump(exclude_unset=True) == {"working_hours": 7, "adherence_status": True}
+
+        reports = await get_daily_reports_by_employee_and_renage_date_control(1, None, None, "compensation.kpis")
+        assert [report.model_dump(exclude_unset=True) for report in reports] == [{"compensation": {"kpis": 500}}]
+
+        # a field and one of its subfields collapse to the field, repeats are ignored
+        result = await get_daily_report_control(1, report["date"], "appointment,appointment.no_of_qualified_appointment,appointment")
+        assert result.model_dump(exclude_unset=True) == {"appointment": report["appointment"]}
+
+        # pages always carry their key, the next cursor is built from it
+        reports, cursor = await get_daily_reports_page_control(10, fields="working_hours")
+        assert [report.model_dump(exclude_unset=True) for report in reports] == [{"date": report["date"], "employee_id": 1, "working_hours": 7}]
+
+    drop_mock_collection()
+
+
+# Helper function to create salary lookups backed by mongomock employees and static values
+def get_test_salary_lookups():
+    mock_db = MongoClient()['test_db']
+    mock_db['employees'].insert_one(get_test_employee().model_dump())
+    mock_db['static_values'].insert_one(get_test_static_values().model_dump())
+    return SalaryLookups(values_cache=StaticValuesCache(), employee_cache=EmployeeCache()), mock_db['employees'], mock_db['static_values']
+
+
+# test that create and update store the daily salary and the range sum adds them up
+@pytest.mark.asyncio
+async def test_total_salary_stored_on_write():
+    mock_collection = get_mock_collection()
+    salary_lookups, employee_collection, static_values_collection = get_test_salary_lookups()
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.salary_lookups', salary_lookups), \
+         patch('src.modules.daily_reports.daily_reports_crud.apply_report_delta', AsyncMock()), \
+         patch('src.services.daily_salary.employee_collection', employee_collection), \
+         patch('src.services.daily_salary.static_values_collection', static_values_collection):
+        reports = get_test_reports()
+        for report in reports:
+            created = await create_daily_report(DailyReport(**report))
+        assert created.total_salary == 340
+        assert mock_collection.find_one({"date": datetime(2024, 9, 2)})["total_salary"] == 210
+
+        updated = await update_daily_report(1, datetime(2024, 9, 2), {"working_hours": 9})
+        assert updated.total_salary == 230
+        assert mock_collection.find_one({"date": datetime(2024, 9, 2)})["total_salary"] == 230
+
+        totals = await get_total_salary(1, datetime(2024, 9, 1), datetime(2024, 9, 30))
+        assert totals == {"total_salary": 230 + 290 + 90 + 340, "report_count": 4, "missing_salaries": 0}
+        assert (await get_total_salary(1, datetime(2024, 10, 1), datetime(2024, 10, 31)))["report_count"] == 0
+
+    drop_mock_collection()
+
+
+# test that the backfill fills in the reports stored without a salary
+@pytest.mark.asyncio
+async def test_backfill_total_salary():
+    mock_collection = get_mock_collection()
+    salary_lookups, employee_collection, static_values_collection = get_test_salary_lookups()
+    mock_collection.insert_many([get_test_report(2), dict(get_test_report(3), total_salary=1), dict(get_test_report(4), employee_id=2)])
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.salary_lookups', salary_lookups), \
+         patch('src.services.daily_salary.employee_collection', employee_collection), \
+         patch('src.services.daily_salary.static_values_collection', static_values_collection):
+        assert (await get_total_salary(1, datetime(2024, 9, 1), datetime(2024, 9, 30)))["missing_salaries"] == 1
+
+        # employee 2 does not exist, its report keeps waiting
+        assert await backfill_total_salary() == 1
+        assert mock_collection.find_one({"date": datetime(2024, 9, 2)})["total_salary"] == 250
+        assert mock_collection.find_one({"date": datetime(2024, 9, 3)})["total_salary"] == 1
+
+        assert await backfill_total_salary(recompute=True) == 1
+        assert mock_collection.find_one({"date": datetime(2024, 9, 3)})["total_salary"] == 250
+
+    drop_mock_collection()
+
+
+# test that the stored salaries follow the employee and static values changes they depend on
+@pytest.mark.asyncio
+async def test_recompute_salaries_on_change():
+    mock_collection = get_mock_collection()
+    salary_lookups, employee_collection, static_values_collection = get_test_salary_lookups()
+    mock_collection.insert_one(get_test_report(2))
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.salary_lookups', salary_lookups), \
+         patch('src.services.daily_salary.employee_collection', employee_collection), \
+         patch('src.services.daily_salary.static_values_collection', static_values_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.static_values_collection', static_values_collection):
+        await backfill_total_salary()
+        before = get_test_employee().model_dump()
+        after = get_test_employee(is_appointment_serrer=False).model_dump()
+        employee_collection.update_one({"id": 1}, {"$set": {"employee_type.is_appointment_serrer": False}})
+        salary_lookups.employee_cache.invalidate(1)
+
+        # a field the salary does not read leaves the reports alone
+        await recompute_employee_salaries(ChangeEvent(EMPLOYEE, "update", 1, before, dict(before, position="Lead")))
+        assert mock_collection.find_one({"date": datetime(2024, 9, 2)})["total_salary"] == 250
+
+        # as a fronter the day misses the KPI target
+        await recompute_employee_salaries(ChangeEvent(EMPLOYEE, "update", 1, before, after))
+        assert mock_collection.find_one({"date": datetime(2024, 9, 2)})["total_salary"] == 240
+
+        static_values_collection.update_one({"id": 1}, {"$set": {"allowance": {"travel": 0}}})
+        salary_lookups.values_cache.invalidate()
+        await recompute_static_values_salaries(ChangeEvent(STATIC_VALUES, "create", 2, None, {"effective_from": datetime(2024, 10, 1)}))
+        assert mock_collection.find_one({"date": datetime(2024, 9, 2)})["total_salary"] == 240
+        await recompute_static_values_salaries(ChangeEvent(STATIC_VALUES, "update", 1, None, {"effective_from": None}))
+        assert mock_collection.find_one({"date": datetime(2024, 9, 2)})["total_salary"] == 190
+
+    drop_mock_collection()
+    employee_collection.drop()
+    static_values_collection.drop()
+
+
+# test that a static values write recomputes the reports of its ranges before and after the write only,
+# in the buckets too
+@pytest.mark.asyncio
+async def test_recompute_static_values_salaries_ranges(monkeypatch):
+    monkeypatch.setenv("DAILY_REPORT_STORAGE", "bucket")
+    mock_collection = get_mock_collection()
+    bucket_collection = MongoClient()['test_db']['daily_report_buckets']
+    bucket_collection.drop()
+    salary_lookups, employee_collection, static_values_collection = get_test_salary_lookups()
+    mock_collection.insert_many([get_test_report(day) for day in (2, 3, 4)])
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection), \
+         patch('src.modules.daily_reports.report_buckets_crud.daily_report_bucket_collection', bucket_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.salary_lookups', salary_lookups), \
+         patch('src.services.daily_salary.employee_collection', employee_collection), \
+         patch('src.services.daily_salary.static_values_collection', static_values_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.static_values_collection', static_values_collection):
+        await apply_bucket_changes((None, report) for report in mock_collection.find())
+        await backfill_total_salary()
+        static_values_collection.update_one({"id": 1}, {"$set": {"allowance": {"travel": 0}}})
+        salary_lookups.values_cache.invalidate()
+
+        def salaries():
+            stored = [report.get("total_salary") for report in mock_collection.find().sort("date", 1)]
+            bucketed = [day.get("total_salary") for day in bucket_collection.find_one({"employee_id": 1})["days"]]
+            assert stored == bucketed
+            return stored
+
+        assert salaries() == [250, 250, 250]
+        # the version moved from the 2nd to the 4th, the 3rd was in neither range
+        before = {"effective_from": datetime(2024, 9, 2), "effective_to": datetime(2024, 9, 3)}
+        await recompute_static_values_salaries(ChangeEvent(STATIC_VALUES, "update", 2, before, {"effective_from": datetime(2024, 9, 4)}))
+        assert salaries() == [200, 250, 200]
+
+        # a deleted document without effective dates was in force until the first version
+        static_values_collection.insert_one(dict(get_test_static_values().model_dump(), id=2, effective_from=datetime(2024, 9, 3)))
+        salary_lookups.values_cache.invalidate()
+        static_values_collection.delete_one({"id": 1})
+        await recompute_static_values_salaries(ChangeEvent(STATIC_VALUES, "delete", 1, {"id": 1, "effective_from": None}, None))
+        assert salaries() == [None, 250, 200]
+
+    drop_mock_collection()
+    bucket_collection.drop()
+    employee_collection.drop()
+    static_values_collection.drop()
+
+
+# test that employee and static values writes drop the cached lookups
+@pytest.mark.asyncio
+async def test_salary_lookups_invalidation():
+    salary_lookups, employee_collection, static_values_collection = get_test_salary_lookups()
+
+    with patch('src.services.daily_salary.employee_collection', employee_collection), \
+         patch('src.services.daily_salary.static_values_collection', static_values_collection):
+        assert await salary_lookups.total_salary(get_test_report(2)) == 250
+        static_values_collection.update_one({"id": 1}, {"$set": {"allowance": {"travel": 0}}})
+        # still served from the cache
+        assert await salary_lookups.total_salary(get_test_report(2)) == 250
+        salary_lookups.values_cache.invalidate()
+        assert await salary_lookups.total_salary(get_test_report(2)) == 200
+
+        employee_collection.delete_one({"id": 1})
+        salary_lookups.employee_cache.invalidate(1)
+        assert await salary_lookups.total_salary(get_test_report(2)) is None
+
+
+# test that a batch of updates and upserts is written with one bulk_write and reported per row
+@pytest.mark.asyncio
+async def test_update_daily_reports():
+    mock_collection = get_mock_collection()
+    salary_lookups, employee_collection, static_values_collection = get_test_salary_lookups()
+    mock_collection.insert_many([get_test_report(2), get_test_report(3)])
+    apply_report_deltas = AsyncMock()
+    new_report = {field: value for field, value in get_test_report(5).items() if field not in ("employee_id", "date")}
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.salary_lookups', salary_lookups), \
+         patch('src.modules.daily_reports.daily_reports_crud.apply_report_deltas', apply_report_deltas), \
+         patch('src.services.daily_salary.employee_collection', employee_collection), \
+         patch('src.services.daily_salary.static_values_collection', static_values_collection):
+        counts, errors = await update_daily_reports([
+            (1, datetime(2024, 9, 2), {"working_hours": 7}, False),
+            (1, datetime(2024, 9, 2), {"compensation.kpis": 1}, False),
+            (1, datetime(2024, 9, 3), {"working_hours": "many"}, False),
+            (1, datetime(2024, 9, 4), {"working_hours": 7}, False),
+            (1, datetime(2024, 9, 5), new_report, True),
+            (1, datetime(2024, 9, 3), {"date": datetime(2024, 9, 6)}, False),
+        ])
+
+    assert counts == {"matched": 1, "modified": 1, "upserted": 1}
+    assert sorted(errors) == [2, 3, 5]
+    assert errors[3] == "Daily report not found"
+    assert errors[2].startswith("working_hours:")
+
+    updated = mock_collection.find_one({"date": datetime(2024, 9, 2)})
+    assert (updated["working_hours"], updated["compensation"]["kpis"], updated["compensation"]["spiffs"]) == (7, 1, 1)
+    assert updated["total_salary"] == 250 - 20 - 8
+    assert mock_collection.find_one({"date": datetime(2024, 9, 5)})["total_salary"] == 250
+    assert mock_collection.find_one({"date": datetime(2024, 9, 3)})["working_hours"] == 9
+
+    # the rollups get one delta per written report
+    changes = list(apply_report_deltas.call_args.args[0])
+    assert [(before is None, after["date"].day) for before, after in changes] == [(False, 2), (True, 5)]
+
+    drop_mock_collection()
+
+
+# test that bulk_update_daily_reports_control numbers the rows of every chunk from the start of the request
+@pytest.mark.asyncio
+async def test_bulk_update_daily_reports_control():
+    updates = [DailyReportBulkUpdate(employee_id=1, date=datetime(2024, 9, day), update={"working_hours": 8}) for day in range(1, 6)]
+    update_daily_reports = AsyncMock(side_effect=[({"matched": 2, "modified": 1, "upserted": 0}, {1: "Daily report not found"}),
+                                                  ({"matched": 2, "modified": 2, "upserted": 0}, {}),
+                                                  ({"matched": 0, "modified": 0, "upserted": 0}, {0: "Daily report not found"})])
+
+    with patch('src.modules.daily_reports.daily_reports_controller.BULK_CHUNK_SIZE', 2), \
+         patch('src.modules.daily_reports.daily_reports_controller.update_daily_reports', update_daily_reports):
+        result = await bulk_update_daily_reports_control(updates)
+
+    assert (result.received, result.matched, result.modified, result.upserted) == (5, 4, 3, 0)
+    assert [error.row for error in result.errors] == [2, 5]
+    assert update_daily_reports.call_args_list[0].args[0][0] == (1, datetime(2024, 9, 1), {"working_hours": 8}, False)
+
+
+# test that the team summary groups the range by employee, and by company through the employees
+@pytest.mark.asyncio
+async def test_get_team_summary():
+    mock_db = MongoClient()['test_db']
+    mock_collection = mock_db['daily_report']
+    employee_collection = mock_db['employees']
+    employee_collection.insert_many([dict(get_test_employee().model_dump(), id=employee_id, company_id=company_id)
+                                     for employee_id, company_id in ((1, 10), (2, 10), (3, 20))])
+    mock_collection.insert_many([dict(report, total_salary=100) for report in get_test_reports()] +
+                                [dict(get_test_report(2), employee_id=2), dict(get_test_report(3), employee_id=3),
+                                 dict(get_test_report(3), employee_id=3, date=datetime(2024, 10, 1))])
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.employee_collection', employee_collection):
+        rows = await get_team_summary(datetime(2024, 9, 1), datetime(2024, 9, 30))
+        assert [row["employee_id"] for row in rows] == [1, 2, 3]
+        assert (rows[0]["report_count"], rows[0]["absent_days"], rows[0]["working_hours"], rows[0]["total_salary"]) == (4, 1, 24, 400)
+        assert (rows[0]["qualified_appointments"], rows[0]["spiffs"], rows[0]["deductions"]) == (4, 4, -20)
+
+        rows = await get_team_summary(datetime(2024, 9, 1), datetime(2024, 9, 30), company_id=10)
+        assert [(row["employee_id"], row["company_id"]) for row in rows] == [(1, 10), (2, 10)]
+
+        rows = await get_team_summary(datetime(2024, 9, 1), datetime(2024, 9, 30), by_company=True)
+        assert [(row["company_id"], row["employees"], row["report_count"]) for row in rows] == [(10, 2, 5), (20, 1, 1)]
+
+    mock_collection.drop()
+    employee_collection.drop()
+
+
+# test that summaries are cached per (range, filter) and dropped by report writes
+@pytest.mark.asyncio
+async def test_get_team_summary_control_cache():
+    get_team_summary = AsyncMock(return_value=[{"employee_id": 1, "report_count": 2, "present_days": 2, "absent_days": 0}])
+
+    with patch('src.modules.daily_reports.daily_reports_controller.get_team_summary', get_team_summary), \
+         patch('src.modules.daily_reports.daily_reports_controller.summary_cache', SummaryCache()) as summary_cache:
+        first = await get_team_summary_control(datetime(2024, 9, 1), datetime(2024, 9, 30))
+        assert await get_team_summary_control(datetime(2024, 9, 1), datetime(2024, 9, 30)) is first
+        assert get_team_summary.await_count == 1
+
+        await get_team_summary_control(datetime(2024, 9, 1), datetime(2024, 9, 30), group_by="company")
+        get_team_summary.assert_awaited_with(datetime(2024, 9, 1), datetime(2024, 9, 30), None, by_company=True)
+
+        summary_cache.invalidate()
+        await get_team_summary_control(datetime(2024, 9, 1), datetime(2024, 9, 30))
+        assert get_team_summary.await_count == 3
+        assert first.rows[0].employee_id == 1
+
+
+# test that a worker drops its summaries once another worker wrote
+@pytest.mark.asyncio
+async def test_summary_cache_version_check():
+    mock_db = MongoClient()['test_db']
+    this_worker = SummaryCache(version_interval=0)
+    other_worker = SummaryCache(version_interval=0)
+
+    with patch('services.cache_version.cache_version_collection', mock_db['cache_versions']):
+        assert await this_worker.get(("team_summary",)) is None
+        this_worker.put(("team_summary",), "summary")
+        assert await this_worker.get(("team_summary",)) == "summary"
+
+        await other_worker.changed()
+        assert await this_worker.get(("team_summary",)) is None
+
+        # within the interval the version is not read again
+        this_worker.version_interval = 60
+        this_worker.put(("team_summary",), "summary")
+        await other_worker.changed()
+        assert await this_worker.get(("team_summary",)) == "summary"
+
+    mock_db['cache_versions'].drop()
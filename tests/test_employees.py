@@ -1,15 +1,20 @@
 import pytest
+from fastapi import Response
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, patch, AsyncMock
 from mongomock import MongoClient
 from datetime import datetime
 from src.main import app
-from src.modules.employees.employees_controller import create_employee_control, delete_employee_control, get_all_employees_control, get_employee_control, update_employee_control
+from src.modules.employees.employees_controller import get_employees_page_control, import_employees_control, create_employee_control, delete_employee_control, get_all_employees_control, get_employee_control, update_employee_control
 from src.modules.employees.employees_router import get_all_employees_endpoint
 from src.shared.models_schemas.models import Employee
-from src.modules.employees.employees_crud import create_employee, get_all_employee, get_employee, update_employee, delete_employee
+from src.modules.employees.employees_crud import create_employee, get_all_employee, get_employee, update_employee, delete_employee, upsert_employees
 from src.shared.models_schemas.schemas import EmployeeCreate, EmployeeResponse
 from src.modules.auth.authentication import create_access_token
+from src.services.employee_cache import EmployeeCache
+from src.services.events import EMPLOYEE, EventBus
+from src.shared.ingest import iter_body_records, iter_csv_records
+from tests.test_daily_reports import stream_chunks
 
 client = TestClient(app)
 
@@ -488,10 +493,10 @@ async def test_get_all_employees_endpoint():
     mock_collection.find.return_value = test_employee_data
 
     with patch('src.modules.employees.employees_crud.employee_collection', mock_collection):
-        # Patch get_all_employee instead of get_all_employees_control
-        with patch('src.modules.employees.employees_crud.get_all_employee', return_value=mock_employee_data) as mock_get_all:
+        # Patch the page control the endpoint reads from
+        with patch('src.modules.employees.employees_router.get_employees_page_control', AsyncMock(return_value=(mock_employee_data, None))) as mock_get_page:
             with patch('src.modules.employees.employees_router.get_all_employees_endpoint', return_value=mock_employee_data) as mock_get_all:
-                result = await get_all_employees_endpoint()
+                result = await get_all_employees_endpoint(Response(), limit=100)
                 with patch('src.modules.auth.authorizations.get_admin', return_value={"email": "admin@example.com", "role": "admin"}):      
                     token = create_access_token({"sub": "admin@example.com", "role": "admin"})
 
@@ -502,3 +507,252 @@ async def test_get_all_employees_endpoint():
                         
                     assert response.status_code == 200
                     assert [employee.model_dump() for employee in result] ==[employee.model_dump() for employee in mock_employee_data]
+
+
+# test that fields= only fetches and returns the projected fields
+@pytest.mark.asyncio
+async def test_get_employee_control_with_fields():
+    mock_collection = get_mock_collection()
+    mock_collection.insert_one(Employee(**get_test_employee_data()).model_dump())
+
+    with patch('src.modules.employees.employees_crud.employee_collection', mock_collection):
+        employee = await get_employee_control(1, "name,employee_type.is_full_time")
+        assert employee.model_dump(exclude_unset=True) == {"name": "John Doe", "employee_type": {"is_full_time": True}}
+
+        employees = await get_all_employees_control("id")
+        assert [employee.model_dump(exclude_unset=True) for employee in employees] == [{"id": 1}]
+
+        with pytest.raises(Exception) as exc_info:
+            await get_employee_control(1, "name,salary")
+        assert exc_info.value.status_code == 400
+
+    mock_collection.drop()
+
+
+# test that get_employee reads through the cache and the writes update it
+@pytest.mark.asyncio
+async def test_get_employee_cached():
+    mock_collection = get_mock_collection()
+    cache = EmployeeCache()
+
+    with patch('src.modules.employees.employees_crud.employee_collection', mock_collection), \
+         patch('src.modules.employees.employees_crud.employee_cache', cache):
+        await create_employee(Employee(**get_test_employee_data()))
+        assert (await get_employee(1)).name == "John Doe"
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 0
+
+        # a write made behind the cache is not seen, the CRUD writes are
+        mock_collection.update_one({"id": 1}, {"$set": {"name": "Behind"}})
+        assert (await get_employee(1)).name == "John Doe"
+        await update_employee(1, {"position": "Lead"})
+        assert (await get_employee(1)).position == "Lead"
+
+        await delete_employee(1)
+        assert await get_employee(1) is None
+        assert cache.stats()["misses"] == 0
+
+        # projected reads are not cached
+        mock_collection.insert_one(get_test_employee_data())
+        assert (await get_employee(1, {"name": 1, "_id": 0})).name == "John Doe"
+
+    mock_collection.drop()
+
+
+# test that the least recently used employee is evicted first
+@pytest.mark.asyncio
+async def test_employee_cache_eviction():
+    cache = EmployeeCache(max_entries=2)
+    loader = AsyncMock(side_effect=lambda: Employee(**get_test_employee_data()))
+
+    await cache.get(1, loader)
+    await cache.get(2, loader)
+    await cache.get(1, loader)
+    await cache.get(3, loader)      # evicts 2
+    await cache.get(1, loader)
+    await cache.get(2, loader)
+
+    assert loader.await_count == 4
+    assert cache.stats() == {"hits": 2, "misses": 4, "evictions": 2, "size": 2, "max_entries": 2}
+
+
+# test that a cache drops its entries once another worker wrote an employee
+@pytest.mark.asyncio
+async def test_employee_cache_version_check():
+    mock_db = MongoClient()['test_db']
+    this_worker = EmployeeCache(version_interval=0)
+    other_worker = EmployeeCache(version_interval=0)
+    loader = AsyncMock(side_effect=lambda: Employee(**get_test_employee_data()))
+
+    with patch('services.cache_version.cache_version_collection', mock_db['cache_versions']):
+        await this_worker.get(1, loader)
+        await this_worker.get(1, loader)
+        assert loader.await_count == 1
+
+        other_worker.put(1, None)
+        await other_worker.changed()
+        await this_worker.get(1, loader)
+        assert loader.await_count == 2
+
+        # a write of this worker keeps its own entries unless another worker wrote in between
+        this_worker.put(2, Employee(**get_test_employee_data() | {"id": 2}))
+        await this_worker.changed()
+        await this_worker.get(2, loader)
+        assert loader.await_count == 2
+
+        await other_worker.changed()
+        this_worker.version_interval = 60
+        await this_worker.changed()
+        await this_worker.get(2, loader)
+        assert loader.await_count == 3
+
+    mock_db['cache_versions'].drop()
+
+
+CSV_HEADER = b"id,name,national_id,company_id,start_date,position,tier_type,is_onsite,has_insurance,employee_type.is_appointment_serrer,employee_type.is_full_time\n"
+
+
+# test for reading CSV bodies split across chunks
+@pytest.mark.asyncio
+async def test_iter_csv_records():
+    body = CSV_HEADER + b'1,"Doe, John",123,1,,Developer,A,true,false,true,false\r\n\n2,"Multi\nline",456,1,2024-01-01,Developer,A,1,0,0,1'
+    records = [record async for record in iter_csv_records(stream_chunks([body[:40], body[40:95], body[95:]]))]
+
+    assert records[0] == (1, {"id": "1", "name": "Doe, John", "national_id": "123", "company_id": "1", "position": "Developer", "tier_type": "A",
+                              "is_onsite": "true", "has_insurance": "false", "employee_type": {"is_appointment_serrer": "true", "is_full_time": "false"}})
+    assert records[1][0] == 2
+    assert records[1][1]["name"] == "Multi\nline"
+    assert records[1][1]["start_date"] == "2024-01-01"
+
+    with pytest.raises(Exception) as exc_info:
+        [record async for record in iter_csv_records(stream_chunks([CSV_HEADER + b'1,"unterminated']))]
+    assert exc_info.value.status_code == 400
+
+
+# test that an import upserts the valid rows in chunks and reports the bad ones
+@pytest.mark.asyncio
+async def test_import_employees_control():
+    mock_collection = get_mock_collection()
+    mock_collection.insert_one(Employee(**get_test_employee_data()).model_dump())
+    cache = EmployeeCache()
+    body = CSV_HEADER + b"\n".join([
+        b"1,John Doe,123,1,,Team Lead,A,true,true,true,true",
+        b"2,Jane Doe,456,1,2024-01-01,Developer,B,true,false,false,true",
+        b"3,No Tier,789,1,,Developer,,true,true,true,true",
+        b"4,Bad Id,not a number,1,,Developer,A,true,true,true,true",
+        b"5,Sam Doe,999,2,,Developer,C,false,false,false,false",
+    ])
+
+    with patch('src.modules.employees.employees_crud.employee_collection', mock_collection), \
+         patch('src.modules.employees.employees_crud.employee_cache', cache), \
+         patch('src.modules.employees.employees_controller.IMPORT_CHUNK_SIZE', 2):
+        result = await import_employees_control(iter_csv_records(stream_chunks([body])))
+
+        assert result.received == 5
+        assert (result.matched, result.modified, result.upserted) == (1, 1, 2)
+        assert [error.row for error in result.errors] == [3, 4]
+        assert result.errors[0].error.startswith("tier_type")
+        assert mock_collection.count_documents({}) == 3
+
+        # an existing employee keeps the start date the record left out
+        updated = mock_collection.find_one({"id": 1})
+        assert updated["position"] == "Team Lead"
+        assert updated["start_date"] == datetime(2023, 1, 1)
+        assert mock_collection.find_one({"id": 2})["start_date"] == datetime(2024, 1, 1)
+        assert mock_collection.find_one({"id": 5})["employee_type"] == {"is_appointment_serrer": False, "is_full_time": False}
+
+        # created employees are written through to the cache, updated ones are reloaded
+        assert cache.stats()["size"] == 2
+        assert (await get_employee(1)).position == "Team Lead"
+
+        # NDJSON bodies go through the same path
+        line = Employee(**get_test_employee_data() | {"id": 6}).model_dump_json().encode()
+        result = await import_employees_control(iter_body_records(stream_chunks([line])))
+        assert result.upserted == 1
+
+        # of two records with the same id the later one is written, the earlier one is reported
+        lines = [Employee(**get_test_employee_data() | {"id": 7, "position": position}).model_dump_json().encode() for position in ("Developer", "Team Lead")]
+        result = await import_employees_control(iter_body_records(stream_chunks([b"\n".join(lines)])))
+        assert result.upserted == 1
+        assert [(error.row, error.error) for error in result.errors] == [(1, "duplicate id, superseded by row 2")]
+        assert mock_collection.find_one({"id": 7})["position"] == "Team Lead"
+
+    mock_collection.drop()
+
+
+# test that an upsert publishes the documents around the write and nothing for the records that change nothing
+@pytest.mark.asyncio
+async def test_upsert_employees_events():
+    mock_collection = get_mock_collection()
+    mock_collection.insert_many([Employee(**get_test_employee_data() | {"id": employee_id}).model_dump() for employee_id in (1, 2)])
+    event_bus = EventBus()
+    events = []
+    event_bus.subscribe(EMPLOYEE, AsyncMock(side_effect=events.append))
+    cache = EmployeeCache()
+
+    with patch('src.modules.employees.employees_crud.employee_collection', mock_collection), \
+         patch('src.modules.employees.employees_crud.employee_cache', cache), \
+         patch('src.modules.employees.employees_crud.event_bus', event_bus):
+        cache.put(1, Employee(**get_test_employee_data()))
+        counts, errors, _ = await upsert_employees([
+            Employee(**get_test_employee_data()),
+            Employee(**get_test_employee_data() | {"id": 2, "tier_type": "A"}),
+            Employee(**get_test_employee_data() | {"id": 3}),
+        ])
+        await event_bus.drain()
+
+    assert (counts["matched"], counts["modified"], counts["upserted"], errors) == (2, 1, 1, {})
+    assert [(event.action, event.key) for event in events] == [("update", 2), ("create", 3)]
+    assert (events[0].before["tier_type"], events[0].after["tier_type"]) == ("B", "A")
+    assert events[0].after["start_date"] == datetime(2023, 1, 1)
+    # the unchanged employee stays cached
+    assert cache.stats()["size"] == 2
+
+    mock_collection.drop()
+
+
+# test that walking the pages with the cursor returns every matching employee once, in sort order
+@pytest.mark.asyncio
+async def test_get_employees_page_control():
+    mock_collection = get_mock_collection()
+    names = ["Eve", "Bob", "Dan", "Amy", "Cat", "Bob"]
+    mock_collection.insert_many([
+        Employee(**get_test_employee_data() | {"id": employee_id, "name": name, "company_id": 1 if employee_id % 2 else 2,
+                                               "start_date": datetime(2024, 1, employee_id)}).model_dump()
+        for employee_id, name in enumerate(names, start=1)
+    ])
+    mock_collection.update_one({"id": 5}, {"$set": {"end_date": datetime(2024, 6, 1)}})
+
+    with patch('src.modules.employees.employees_crud.employee_collection', mock_collection):
+        async def walk(limit, **kwargs):
+            keys, cursor = [], None
+            while True:
+                employees, cursor = await get_employees_page_control(limit, cursor, **kwargs)
+                keys.extend(employee.id for employee in employees)
+                if cursor is None:
+                    return keys
+
+        assert await walk(4) == [1, 2, 3, 4, 5, 6]
+        # ties on the sort field are broken by id
+        assert await walk(2, sort="name") == [4, 2, 6, 5, 3, 1]
+        assert await walk(2, sort="-name") == [1, 3, 5, 6, 2, 4]
+        assert await walk(1, sort="-start_date") == [6, 5, 4, 3, 2, 1]
+
+        # filters combine with the cursor
+        assert await walk(1, company_id=1) == [1, 3, 5]
+        assert await walk(1, company_id=1, active=True) == [1, 3]
+        assert await walk(1, active=False) == [5]
+        assert await walk(10, tier_type="A") == []
+
+        employees, cursor = await get_employees_page_control(2, sort="name", fields="name")
+        assert [employee.model_dump(exclude_unset=True) for employee in employees] == [{"id": 4, "name": "Amy"}, {"id": 2, "name": "Bob"}]
+
+        # a cursor is only accepted for the sort it was issued for
+        with pytest.raises(Exception) as exc_info:
+            await get_employees_page_control(2, cursor, sort="id")
+        assert exc_info.value.status_code == 400
+
+    mock_collection.drop()
+
+    with pytest.raises(Exception) as exc_info:
+        await get_employees_page_control(10, "not a cursor")
+    assert exc_info.value.status_code == 400
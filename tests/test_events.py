@@ -0,0 +1,103 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from datetime import datetime
+from mongomock import MongoClient
+from src.services.events import DAILY_REPORT, EMPLOYEE, ChangeEvent, EventBus
+from src.modules.daily_reports.daily_reports_crud import create_daily_report, delete_daily_report
+from src.modules.employees.employees_crud import update_employee
+from src.shared.models_schemas.models import DailyReport
+from tests.test_payroll import get_test_employee, get_test_report
+
+
+# test that subscribers get the events of their entity, in publish order, after the publish returned
+@pytest.mark.asyncio
+async def test_event_bus_publish_and_consume():
+    event_bus = EventBus()
+    received = []
+
+    @event_bus.subscribe(DAILY_REPORT)
+    async def on_report(event):
+        received.append(event)
+
+    event_bus.publish(DAILY_REPORT, "create", (1, datetime(2024, 9, 2)), None, {"working_hours": 9})
+    event_bus.publish(EMPLOYEE, "delete", 1)
+    event_bus.publish(DAILY_REPORT, "delete", (1, datetime(2024, 9, 2)), {"working_hours": 9}, None)
+    assert received == []
+
+    await event_bus.drain()
+    assert [event.action for event in received] == ["create", "delete"]
+    assert received[0] == ChangeEvent(DAILY_REPORT, "create", (1, datetime(2024, 9, 2)), None, {"working_hours": 9})
+    # events nobody subscribed to are not queued
+    assert event_bus.stats() == {"published": 2, "consumed": 2, "failed": 0, "dropped": 0, "queue_depth": 0, "subscribers": {DAILY_REPORT: 1}}
+
+
+# test that a failing subscriber is counted and does not keep the others from their events
+@pytest.mark.asyncio
+async def test_event_bus_failing_subscriber():
+    event_bus = EventBus(max_queue=2)
+    failing = AsyncMock(side_effect=ValueError("boom"))
+    subscriber = AsyncMock()
+    event_bus.subscribe(EMPLOYEE, failing)
+    event_bus.subscribe(EMPLOYEE, subscriber)
+    event_bus.subscribe(EMPLOYEE, AsyncMock())
+
+    for employee_id in range(3):
+        event_bus.publish(EMPLOYEE, "update", employee_id)
+    await event_bus.stop()
+
+    assert subscriber.await_count == 2
+    stats = event_bus.stats()
+    # consumed counts events, not subscriber calls
+    assert (stats["published"], stats["consumed"], stats["failed"], stats["dropped"]) == (2, 2, 2, 1)
+
+    event_bus.unsubscribe(EMPLOYEE, failing)
+    assert event_bus.stats()["subscribers"] == {EMPLOYEE: 2}
+
+
+# test that the daily report and employee writes publish their changes
+@pytest.mark.asyncio
+async def test_crud_writes_publish_events():
+    event_bus = EventBus()
+    events = []
+    subscriber = AsyncMock(side_effect=events.append)
+    event_bus.subscribe(DAILY_REPORT, subscriber)
+    event_bus.subscribe(EMPLOYEE, subscriber)
+    mock_db = MongoClient()['test_db']
+    report = get_test_report(2)
+    employee_collection = MagicMock()
+    employee_collection.find_one_and_update.return_value = get_test_employee().model_dump()
+
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_db['daily_report']), \
+         patch('src.modules.daily_reports.daily_reports_crud.apply_report_delta', AsyncMock()), \
+         patch('src.modules.daily_reports.daily_reports_crud.event_bus', event_bus), \
+         patch('src.modules.employees.employees_crud.employee_collection', employee_collection), \
+         patch('src.modules.employees.employees_crud.event_bus', event_bus):
+        await create_daily_report(DailyReport(**report))
+        await delete_daily_report(1, datetime(2024, 9, 2))
+        await delete_daily_report(1, datetime(2024, 9, 3))
+        await update_employee(1, {"employee_type.is_full_time": False})
+        await event_bus.drain()
+
+    assert [(event.entity, event.action, event.key) for event in events] == [
+        (DAILY_REPORT, "create", (1, datetime(2024, 9, 2))),
+        (DAILY_REPORT, "delete", (1, datetime(2024, 9, 2))),
+        (EMPLOYEE, "update", 1),
+    ]
+    assert events[1].before["working_hours"] == 9 and events[1].after is None
+    assert events[2].before["employee_type"]["is_full_time"] is True
+    assert events[2].after["employee_type"]["is_full_time"] is False
+
+    mock_db['daily_report'].drop()
+
+
+# test that report and employee changes drop the cached summaries
+@pytest.mark.asyncio
+async def test_summary_cache_subscriber():
+    from src.services.summary_cache import event_bus, invalidate_summaries, summary_cache
+    assert invalidate_summaries in event_bus._subscribers[DAILY_REPORT]
+    assert invalidate_summaries in event_bus._subscribers[EMPLOYEE]
+
+    summary_cache.put(("team_summary",), "summary")
+    event_bus.publish(DAILY_REPORT, "create", (1, datetime(2024, 9, 2)), None, {})
+    await event_bus.drain()
+    assert await summary_cache.get(("team_summary",)) is None
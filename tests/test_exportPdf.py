@@ -1,8 +1,13 @@
+import asyncio
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock, MagicMock
 from src.main import app
 from src.modules.auth.authentication import create_access_token
+from src.services.payslip_cache import PayslipCache
+from src.services.exportPdf import generate_salary_pdf_async, generate_salary_pdf_endpoint, render_salary_pdfs, payslip_format
+from tests.test_payroll import get_test_employee, get_test_static_values, get_test_reports
 
 client = TestClient(app)
 
@@ -55,3 +60,162 @@ async def test_generate_salary_pdf_endpoint(mock_get_static_values, mock_daily_r
         # Assertions
         assert response.status_code == 200
         assert response.headers["Content-Type"] == "application/json"
+
+
+# test that single-payslip renders are rejected once the render queue is full
+@pytest.mark.asyncio
+async def test_generate_salary_pdf_async_queue_full():
+    with patch("src.services.exportPdf.PDF_RENDER_MAX_QUEUE", 0):
+        with pytest.raises(HTTPException) as exc_info:
+            await generate_salary_pdf_async({"name": "John Doe"})
+
+        assert exc_info.value.status_code == 503
+
+
+# test that render errors surface as HTTP 500
+@pytest.mark.asyncio
+async def test_generate_salary_pdf_async_error():
+    async def failing_render():
+        raise RuntimeError("broken font")
+
+    with patch("src.services.exportPdf.submit_salary_pdf", side_effect=lambda salary_data: failing_render()):
+        with pytest.raises(HTTPException) as exc_info:
+            await generate_salary_pdf_async({"name": "John Doe"})
+
+        assert exc_info.value.status_code == 500
+        assert exc_info.value.detail == "Error generating PDF: broken font"
+
+
+# test that batch renders are submitted in a bounded window and all results are yielded
+@pytest.mark.asyncio
+async def test_render_salary_pdfs():
+    loop = asyncio.get_running_loop()
+    submitted = []
+
+    def mock_submit(salary_data):
+        submitted.append(salary_data["name"])
+        future = loop.create_future()
+        if salary_data["name"] == "broken":
+            future.set_exception(RuntimeError("broken font"))
+        else:
+            future.set_result(salary_data["name"].encode())
+        return future
+
+    payslips = {1: {"name": "a"}, 2: {"name": "broken"}, 3: {"name": "c"}, 4: {"name": "d"}}
+    with patch("src.services.exportPdf.submit_salary_pdf", side_effect=mock_submit), \
+         patch("src.services.exportPdf.PDF_RENDER_WORKERS", 1):
+        results = {key: pdf async for key, pdf in render_salary_pdfs(payslips)}
+
+    assert submitted == ["a", "broken", "c", "d"]
+    assert results[1] == b"a" and results[4] == b"d"
+    assert isinstance(results[2], RuntimeError)
+
+
+# test that renders still pending are cancelled when the consumer stops early
+@pytest.mark.asyncio
+async def test_render_salary_pdfs_cancelled_on_close():
+    loop = asyncio.get_running_loop()
+    futures = []
+
+    def mock_submit(salary_data):
+        future = loop.create_future()
+        if salary_data["name"] == "a":
+            future.set_result(b"a")
+        futures.append(future)
+        return future
+
+    payslips = {1: {"name": "a"}, 2: {"name": "b"}, 3: {"name": "c"}}
+    with patch("src.services.exportPdf.submit_salary_pdf", side_effect=mock_submit), \
+         patch("src.services.exportPdf.PDF_RENDER_WORKERS", 2):
+        renders = render_salary_pdfs(payslips)
+        assert await renders.__anext__() == (1, b"a")
+        await renders.aclose()
+
+    assert [future.cancelled() for future in futures] == [False, True, True]
+
+
+# test for the render queue metrics endpoint
+def test_pdf_render_stats_endpoint():
+    token = create_access_token({"sub": "admin@example.com", "role": "admin"})
+    response = client.get("/pdf_render_stats", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["queue_depth"] == 0
+    assert stats["workers"] >= 1
+
+
+# test that a cached payslip is served without touching Mongo or the renderer
+@pytest.mark.asyncio
+async def test_generate_salary_pdf_endpoint_cache_hit():
+    mock_cache = MagicMock()
+    mock_cache.lookup.return_value = b"%PDF-1.4 cached content"
+
+    with patch("src.services.exportPdf.payslip_cache", mock_cache), \
+         patch("src.services.exportPdf.get_employee", new_callable=AsyncMock) as mock_get_employee, \
+         patch("src.services.exportPdf.generate_salary_pdf_async", new_callable=AsyncMock) as mock_render:
+        response = await generate_salary_pdf_endpoint(1, 1)
+
+        assert response.body == b"%PDF-1.4 cached content"
+        assert response.media_type == "application/pdf"
+        mock_get_employee.assert_not_called()
+        mock_render.assert_not_called()
+
+
+# test that a payslip cached before a renderer change is rendered again
+@pytest.mark.asyncio
+async def test_generate_salary_pdf_endpoint_render_revision(tmp_path):
+    mock_collection = MagicMock()
+    mock_collection.find.return_value.sort.return_value = get_test_reports()
+
+    with patch("src.services.exportPdf.payslip_cache", PayslipCache(str(tmp_path))), \
+         patch("src.services.exportPdf.daily_report_collection", mock_collection), \
+         patch("src.services.exportPdf.get_employee", AsyncMock(return_value=get_test_employee())), \
+         patch("src.services.exportPdf.get_static_values", AsyncMock(return_value=get_test_static_values())), \
+         patch("src.services.exportPdf.generate_salary_pdf_async", AsyncMock(return_value=b"%PDF-1.4 mock content")) as mock_render:
+        await generate_salary_pdf_endpoint(1, 1)
+        await generate_salary_pdf_endpoint(1, 1)
+        assert mock_render.await_count == 1
+
+        # exportPdf imports the renderer as services.payslip_renderer
+        with patch("services.payslip_renderer.RENDER_REVISION", "test"):
+            response = await generate_salary_pdf_endpoint(1, 1)
+        assert response.body == b"%PDF-1.4 mock content"
+        assert mock_render.await_count == 2
+
+
+# test for choosing the payslip output from the format parameter and the Accept header
+def test_payslip_format():
+    assert payslip_format(None, None) == "pdf"
+    assert payslip_format("html", "application/json") == "html"
+    assert payslip_format(None, "application/json") == "json"
+    assert payslip_format(None, "application/json, text/plain, */*") == "json"
+    assert payslip_format(None, "text/html") == "html"
+    # a browser navigation still gets the PDF
+    assert payslip_format(None, "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8") == "pdf"
+
+
+# test that JSON and HTML previews are served without rendering a PDF
+@pytest.mark.asyncio
+async def test_generate_salary_pdf_endpoint_previews():
+    mock_cache = MagicMock()
+    mock_cache.lookup.return_value = b"%PDF-1.4 cached content"
+    mock_collection = MagicMock()
+    mock_collection.find.return_value.sort.return_value = get_test_reports()
+
+    with patch("src.services.exportPdf.payslip_cache", mock_cache), \
+         patch("src.services.exportPdf.daily_report_collection", mock_collection), \
+         patch("src.services.exportPdf.get_employee", AsyncMock(return_value=get_test_employee())), \
+         patch("src.services.exportPdf.get_static_values", AsyncMock(return_value=get_test_static_values())), \
+         patch("src.services.exportPdf.generate_salary_pdf_async", new_callable=AsyncMock) as mock_render:
+        salary_data = await generate_salary_pdf_endpoint(1, 1, format="json")
+        assert salary_data.employee_id == 1
+        assert salary_data.final_salary == 2850
+
+        response = await generate_salary_pdf_endpoint(1, 1, accept="text/html")
+        assert response.media_type == "text/html"
+        assert b"John Doe" in response.body
+        assert b"<style>" in response.body
+
+        mock_cache.lookup.assert_not_called()
+        mock_render.assert_not_called()
@@ -0,0 +1,51 @@
+import pytest
+from unittest.mock import patch
+from mongomock import MongoClient
+from pymongo import ASCENDING, IndexModel
+from src.config.database.indexes import ensure_indexes, index_drift
+
+
+# Helper function to declare the indexes of a fresh mongomock database
+def get_required_indexes():
+    mock_db = MongoClient()['test_db']
+    return [
+        (mock_db['daily_reports'], [IndexModel([("employee_id", ASCENDING), ("date", ASCENDING)], unique=True)]),
+        (mock_db['users'], [IndexModel([("email", ASCENDING)], unique=True)]),
+    ]
+
+
+# test that missing indexes are created once and the second run reports no drift
+@pytest.mark.asyncio
+async def test_ensure_indexes():
+    required_indexes = get_required_indexes()
+
+    with patch('src.config.database.indexes.REQUIRED_INDEXES', required_indexes):
+        report = await ensure_indexes()
+        assert report["daily_reports"] == {"missing": [], "mismatched": [], "unexpected": []}
+        assert "employee_id_1_date_1" in required_indexes[0][0].index_information()
+
+        report = await ensure_indexes()
+        assert report["users"] == {"missing": [], "mismatched": [], "unexpected": []}
+
+    # duplicates are rejected once the unique index exists
+    users = required_indexes[1][0]
+    users.insert_one({"email": "john@example.com"})
+    with pytest.raises(Exception):
+        users.insert_one({"email": "john@example.com"})
+
+
+# test for index_drift
+def test_index_drift():
+    declared = [IndexModel([("email", ASCENDING)], unique=True)]
+
+    assert index_drift({"_id_": {"key": [("_id", 1)]}}, declared)["missing"] == ["email_1"]
+
+    drift = index_drift({
+        "_id_": {"key": [("_id", 1)]},
+        "email_1": {"key": [("email", 1)]},
+        "name_1": {"key": [("name", 1)]},
+    }, declared)
+    # same keys but not unique
+    assert drift["mismatched"] == ["email_1"]
+    assert drift["unexpected"] == ["name_1"]
+    assert drift["missing"] == []
@@ -0,0 +1,152 @@
+from datetime import datetime
+from src.services.payroll import ReportColumns, compute_payroll, compute_payroll_from_reports, daily_salary, month_bounds
+from src.shared.models_schemas.models import Employee, StaticValues
+
+
+# Helper function to prepare test employee data
+def get_test_employee(is_appointment_serrer=True):
+    return Employee(**{
+        "id": 1,
+        "name": "John Doe",
+        "national_id": 123456789,
+        "company_id": 1,
+        "position": "Developer",
+        "tier_type": "A",
+        "is_onsite": True,
+        "has_insurance": True,
+        "employee_type": {
+            "is_appointment_serrer": is_appointment_serrer,
+            "is_full_time": True
+        }
+    })
+
+
+# Helper function to prepare test static values data
+def get_test_static_values():
+    return StaticValues(**{
+        "id": 1,
+        "tier_base_salary": {"A": 3000},
+        "cad": 35,
+        "kpis": 2,
+        "butter_up": 10,
+        "allowance": {"travel": 50},
+        "hour_price": {"A": 10},
+        "no_of_qulified_appt_tier_setter": {"A": 0.1},
+        "no_of_qulified_appt_tier_fronter": {"A": 5}
+    })
+
+
+# Helper function to prepare a raw daily report document
+def get_test_report(day, working_hours=9, adherence_status=True, is_saturday=False, qualified=1, deductions=0):
+    return {
+        "date": datetime(2024, 9, day),
+        "employee_id": 1,
+        "appointment": {"no_of_qualified_appointment": qualified, "no_of_not_qualified_appointment": 0},
+        "compensation": {"spiffs": 1, "kpis": 5, "butter_up": 2},
+        "deductions": {"deductions": deductions, "reason": "late"},
+        "allowance": {"allowance_type": "travel", "allowance_value": 0},
+        "adherence_status": adherence_status,
+        "is_saturday": is_saturday,
+        "working_hours": working_hours
+    }
+
+
+def get_test_reports():
+    return [
+        get_test_report(2, working_hours=7, qualified=2, deductions=-20),
+        get_test_report(3, working_hours=11),
+        get_test_report(4, working_hours=0, adherence_status=False, qualified=0),
+        get_test_report(7, working_hours=6, is_saturday=True),
+    ]
+
+
+def test_month_bounds():
+    assert month_bounds(datetime(2024, 9, 15)) == (datetime(2024, 9, 1), datetime(2024, 10, 1))
+    assert month_bounds(datetime(2024, 12, 31)) == (datetime(2024, 12, 1), datetime(2025, 1, 1))
+
+
+def test_report_columns_totals():
+    totals = ReportColumns.from_reports(get_test_reports()).totals()
+
+    assert totals.report_count == 4
+    assert totals.present_days == 3
+    assert totals.absent_days == 1
+    assert totals.missing_hours == 5
+    assert totals.overtime_hours == 2
+    assert totals.saturday_hours == 6
+    assert totals.qualified_appointments == 4
+    assert totals.kpis == 20
+    assert totals.spiffs == 4
+    assert totals.butter_up == 8
+    assert totals.deductions == -20
+
+
+def test_report_columns_itemized():
+    itemized = ReportColumns.from_reports(get_test_reports()).itemized()
+
+    assert itemized["no_show_days"] == "In Wednesday 2024-09-04 : absent "
+    assert itemized["missing_hours"] == "In Monday 2024-09-02 : 2 hrs missing<br>In Saturday 2024-09-07 : 3 hrs missing"
+    assert itemized["additional_hours"] == "In Tuesday 2024-09-03 : 2 hrs over : (double paid)"
+    assert itemized["saturdays"] == "working on saturday 2024-09-07 for 6 hours : (double paid)"
+    assert itemized["deductions_info"] == "In Monday 2024-09-02 has -20 deduction for the reason of: late"
+    assert itemized["kpis_score"].count("<br>") == 3
+    assert itemized["spiffs_logs"].startswith("In Monday 2024-09-02 has 1 spiffs<br>")
+
+    # fractions are kept
+    itemized = ReportColumns.from_reports([get_test_report(2, working_hours=7.5)]).itemized()
+    assert itemized["missing_hours"] == "In Monday 2024-09-02 : 1.5 hrs missing"
+
+
+def test_compute_payroll():
+    employee = get_test_employee()
+    static_values = get_test_static_values()
+    totals = ReportColumns.from_reports(get_test_reports()).totals()
+
+    result = compute_payroll(employee, static_values, totals, datetime(2024, 9, 30))
+
+    assert result.employee_id == 1
+    assert (result.month, result.month_name, result.year) == ("09", "September", "2024")
+    assert result.basic_salary == 3000
+    assert result.basic_salary_deduction_absent == 100
+    assert result.basic_salary_deduction_missing_hours == 50
+    assert result.final_salary == 2850
+    assert result.overpay_summary == 120
+    assert result.additional_hours_value == 40
+    assert result.kpis_total == 40
+    assert result.spiffs_total == 280
+    assert result.transportation_allowance == "3 Days * 50.0 EGP = 150.0"
+    assert result.butter_up == 80
+    assert result.total_salary == 2850 + 120 + 40 + 40 + 280 + 150 - 20 + 80
+    # itemized lines are optional
+    assert result.no_show_days == ""
+
+
+def test_compute_payroll_kpis_below_target():
+    # fronter target is 5 qualified appointments a day, far above the test data
+    employee = get_test_employee(is_appointment_serrer=False)
+    result = compute_payroll_from_reports(employee, get_test_static_values(), get_test_reports(), datetime(2024, 9, 30))
+
+    assert result.kpis_total == 0
+    assert result.no_show_days == "In Wednesday 2024-09-04 : absent "
+
+
+def test_compute_payroll_without_reports():
+    result = compute_payroll_from_reports(get_test_employee(), get_test_static_values(), [], datetime(2024, 9, 30))
+
+    assert result.transportation_allowance == 0
+    assert result.final_salary == 3000
+    assert result.total_salary == 3000
+    assert result.kpis_score == ""
+
+
+def test_daily_salary():
+    employee = get_test_employee()
+    static_values = get_test_static_values()
+    reports = get_test_reports()
+
+    # 100 basic - 20 missing hours + 10 kpis + 70 spiffs + 20 butter up + 50 travel - 20 deductions
+    assert daily_salary(reports[0], employee, static_values) == 210
+    # an absent day keeps its compensation but no basic salary, kpis or travel
+    assert daily_salary(reports[2], employee, static_values) == 90
+    # a saturday is paid double on top of the day
+    assert daily_salary(reports[3], employee, static_values) == 100 - 30 + 120 + 10 + 70 + 20 + 50
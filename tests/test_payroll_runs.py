@@ -0,0 +1,231 @@
+import io
+import zipfile
+import pytest
+from unittest.mock import MagicMock, patch, AsyncMock
+from datetime import datetime
+from mongomock import MongoClient
+from src.modules.payroll.payroll_crud import get_payroll_employees, get_reports_by_employee, get_monthly_totals
+from src.modules.payroll.payroll_controller import get_run_static_values, run_payroll_control, iter_payslips_zip, zip_payslips_control, payroll_summary_control
+from src.shared.models_schemas.models import Employee, StaticValues
+from src.shared.models_schemas.schemas import PayrollRunRequest, MonthlyReportTotals
+from src.services.payroll import ReportColumns
+from tests.test_payroll import get_test_reports
+from src.services.payslip_cache import PayslipCache
+
+
+# Helper function to prepare test employee data
+def get_test_employee_data(employee_id=1):
+    return {
+        "id": employee_id,
+        "name": "John Doe",
+        "national_id": 123456789,
+        "company_id": 1,
+        "position": "Developer",
+        "tier_type": "A",
+        "is_onsite": True,
+        "has_insurance": True,
+        "employee_type": {
+            "is_appointment_serrer": True,
+            "is_full_time": True
+        }
+    }
+
+
+# Helper function to prepare test static values data
+def get_test_static_values():
+    return StaticValues(**{
+        "id": 1,
+        "tier_base_salary": {"A": 3000},
+        "cad": 35,
+        "kpis": 2,
+        "butter_up": 10,
+        "allowance": {"travel": 50},
+        "hour_price": {"A": 10},
+        "no_of_qulified_appt_tier_setter": {"A": 3},
+        "no_of_qulified_appt_tier_fronter": {"A": 5}
+    })
+
+
+# test for get_payroll_employees
+@pytest.mark.asyncio
+async def test_get_payroll_employees():
+    mock_collection = MagicMock()
+    mock_collection.find.return_value = [get_test_employee_data(1), get_test_employee_data(2)]
+
+    with patch('src.modules.payroll.payroll_crud.employee_collection', mock_collection):
+        result = await get_payroll_employees(datetime(2024, 9, 1), company_id=1)
+
+        assert [employee.id for employee in result] == [1, 2]
+        query = mock_collection.find.call_args[0][0]
+        assert query["company_id"] == 1
+        assert query["$or"] == [{"end_date": None}, {"end_date": {"$gte": datetime(2024, 9, 1)}}]
+
+
+# test for get_reports_by_employee
+@pytest.mark.asyncio
+async def test_get_reports_by_employee():
+    reports = [
+        {"employee_id": 1, "date": datetime(2024, 9, 1)},
+        {"employee_id": 1, "date": datetime(2024, 9, 2)},
+        {"employee_id": 2, "date": datetime(2024, 9, 1)},
+    ]
+    mock_collection = MagicMock()
+    mock_collection.find.return_value.sort.return_value = reports
+
+    with patch('src.modules.payroll.payroll_crud.daily_report_collection', mock_collection):
+        result = await get_reports_by_employee([1, 2, 3], datetime(2024, 9, 1), datetime(2024, 10, 1))
+
+        assert len(result[1]) == 2
+        assert len(result[2]) == 1
+        # employees without reports still get an entry
+        assert result[3] == []
+
+
+# test for run_payroll_control
+@pytest.mark.asyncio
+async def test_run_payroll_control(tmp_path):
+    employees = [Employee(**get_test_employee_data(1)), Employee(**get_test_employee_data(2))]
+
+    async def mock_render(payslips):
+        assert set(payslips) == {1, 2}
+        yield 1, b"%PDF-1.4 mock content"
+        yield 2, RuntimeError("broken font")
+
+    with patch('src.modules.payroll.payroll_controller.get_static_values', AsyncMock(return_value=get_test_static_values())), \
+         patch('src.modules.payroll.payroll_controller.get_payroll_employees', AsyncMock(return_value=employees)), \
+         patch('src.modules.payroll.payroll_controller.get_reports_by_employee', AsyncMock(return_value={1: [], 2: []})), \
+         patch('src.modules.payroll.payroll_controller.render_salary_pdfs', mock_render), \
+         patch('src.modules.payroll.payroll_controller.payslip_cache', PayslipCache(str(tmp_path / "cache"))), \
+         patch('src.modules.payroll.payroll_controller.PAYSLIPS_DIR', str(tmp_path)):
+        result = await run_payroll_control(PayrollRunRequest(year=2024, month=9, values_id=1))
+
+        assert result.employees == 2
+        assert result.generated == 1
+        assert result.errors == {2: "Error generating PDF: broken font"}
+        assert (tmp_path / "2024-09" / "1.pdf").read_bytes() == b"%PDF-1.4 mock content"
+
+
+# test that a second run only renders the payslips that are not cached yet
+@pytest.mark.asyncio
+async def test_run_payroll_control_uses_cache(tmp_path):
+    employees = [Employee(**get_test_employee_data(1)), Employee(**get_test_employee_data(2))]
+    rendered = []
+
+    async def mock_render(payslips):
+        for employee_id in payslips:
+            rendered.append(employee_id)
+            yield employee_id, b"%PDF-1.4 mock content"
+
+    with patch('src.modules.payroll.payroll_controller.get_static_values', AsyncMock(return_value=get_test_static_values())), \
+         patch('src.modules.payroll.payroll_controller.get_payroll_employees', AsyncMock(return_value=employees)), \
+         patch('src.modules.payroll.payroll_controller.get_reports_by_employee', AsyncMock(return_value={1: [], 2: []})), \
+         patch('src.modules.payroll.payroll_controller.render_salary_pdfs', mock_render), \
+         patch('src.modules.payroll.payroll_controller.payslip_cache', PayslipCache(str(tmp_path / "cache"))), \
+         patch('src.modules.payroll.payroll_controller.PAYSLIPS_DIR', str(tmp_path)):
+        await run_payroll_control(PayrollRunRequest(year=2024, month=9, values_id=1))
+        result = await run_payroll_control(PayrollRunRequest(year=2024, month=9, values_id=1))
+
+        assert rendered == [1, 2]
+        assert result.generated == 2
+        assert (tmp_path / "2024-09" / "2.pdf").read_bytes() == b"%PDF-1.4 mock content"
+
+
+# test for run_payroll_control with unknown static values
+@pytest.mark.asyncio
+async def test_run_payroll_control_static_values_not_found():
+    with patch('src.modules.payroll.payroll_controller.get_static_values', AsyncMock(return_value=None)):
+        with pytest.raises(Exception) as exc_info:
+            await run_payroll_control(PayrollRunRequest(year=2024, month=9, values_id=999))
+
+        assert exc_info.value.status_code == 404
+
+
+# test that the ZIP archive is streamed one payslip at a time and is a valid archive
+@pytest.mark.asyncio
+async def test_iter_payslips_zip():
+    async def mock_iter_payslips(run, static_values):
+        yield 1, b"%PDF-1.4 first"
+        yield 2, RuntimeError("broken font")
+        yield 3, b"%PDF-1.4 third"
+
+    with patch('src.modules.payroll.payroll_controller.iter_payslips', mock_iter_payslips):
+        chunks = [chunk async for chunk in iter_payslips_zip(PayrollRunRequest(year=2024, month=9, values_id=1), get_test_static_values())]
+
+    # every rendered PDF is flushed before the next one is produced
+    assert b"%PDF-1.4 first" in chunks[0]
+    assert b"%PDF-1.4 third" in chunks[1]
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.namelist() == ["1.pdf", "3.pdf", "errors.txt"]
+        assert archive.read("3.pdf") == b"%PDF-1.4 third"
+        assert archive.read("errors.txt") == b"2: Error generating PDF: broken font"
+
+
+# test for the ZIP download endpoint
+@pytest.mark.asyncio
+async def test_zip_payslips_control():
+    with patch('src.modules.payroll.payroll_controller.get_static_values', AsyncMock(return_value=get_test_static_values())):
+        response = await zip_payslips_control(PayrollRunRequest(year=2024, month=9, values_id=1))
+
+        assert response.media_type == "application/zip"
+        assert response.headers["Content-Disposition"] == 'attachment; filename="payslips_2024-09.zip"'
+
+    with patch('src.modules.payroll.payroll_controller.get_static_values', AsyncMock(return_value=None)):
+        with pytest.raises(Exception) as exc_info:
+            await zip_payslips_control(PayrollRunRequest(year=2024, month=9, values_id=999))
+        assert exc_info.value.status_code == 404
+
+
+# test for the monthly totals aggregation, run against mongomock
+@pytest.mark.asyncio
+async def test_get_monthly_totals():
+    mock_collection = MongoClient()['test_db']['daily_reports']
+    reports = get_test_reports()
+    mock_collection.insert_many([dict(report) for report in reports] + [dict(reports[1], employee_id=2)])
+
+    with patch('src.modules.payroll.payroll_crud.daily_report_collection', mock_collection):
+        result = await get_monthly_totals(datetime(2024, 9, 1), datetime(2024, 10, 1), [1, 2, 3])
+
+    # Mongo computes exactly what the in-process engine computes from the documents
+    assert result[1] == ReportColumns.from_reports(reports).totals()
+    assert result[2].overtime_hours == 2
+    assert result[2].report_count == 1
+    # employees without reports get empty totals
+    assert result[3].report_count == 0
+
+
+# test for payroll_summary_control
+@pytest.mark.asyncio
+async def test_payroll_summary_control():
+    employees = [Employee(**get_test_employee_data(1)), Employee(**get_test_employee_data(2))]
+    totals = {1: ReportColumns.from_reports(get_test_reports()).totals(), 2: MonthlyReportTotals()}
+
+    with patch('src.modules.payroll.payroll_controller.get_static_values', AsyncMock(return_value=get_test_static_values())), \
+         patch('src.modules.payroll.payroll_controller.get_payroll_employees', AsyncMock(return_value=employees)), \
+         patch('src.modules.payroll.payroll_controller.get_rollups', AsyncMock(return_value=totals)) as mock_totals, \
+         patch('src.modules.payroll.payroll_controller.get_reports_by_employee', AsyncMock()) as mock_reports:
+        result = await payroll_summary_control(PayrollRunRequest(year=2024, month=9, values_id=1))
+
+        assert [payslip.employee_id for payslip in result] == [1, 2]
+        assert result[0].final_salary == 2850
+        assert result[1].total_salary == 3000
+        assert result[0].kpis_score == ""
+        mock_totals.assert_awaited_once_with(2024, 9, [1, 2])
+        # no report documents are fetched
+        mock_reports.assert_not_called()
+
+
+# test that a run without values_id uses the static values in force on the first of the month
+@pytest.mark.asyncio
+async def test_get_run_static_values_as_of():
+    test_static_values = get_test_static_values()
+    as_of = AsyncMock(return_value=test_static_values)
+
+    with patch('src.modules.payroll.payroll_controller.get_static_values_as_of', as_of):
+        assert await get_run_static_values(PayrollRunRequest(year=2024, month=9)) == test_static_values
+        as_of.assert_awaited_once_with(datetime(2024, 9, 1))
+
+    with patch('src.modules.payroll.payroll_controller.get_static_values_as_of', AsyncMock(return_value=None)):
+        with pytest.raises(Exception) as exc_info:
+            await get_run_static_values(PayrollRunRequest(year=2024, month=9))
+        assert exc_info.value.status_code == 404
@@ -0,0 +1,123 @@
+import json
+import os
+import pytest
+from unittest.mock import patch, AsyncMock
+from datetime import datetime
+from src.modules.payroll.payroll_controller import close_month_control, get_archived_payslip_control, get_archived_payslip_inputs_control
+from src.services.payslip_archive import PayslipArchive
+from src.services.payslip_cache import PayslipCache
+from src.shared.models_schemas.models import Employee
+from src.shared.models_schemas.schemas import PayrollRunRequest
+from tests.test_payroll import get_test_reports
+from tests.test_payroll_runs import get_test_employee_data, get_test_static_values
+
+
+PERIOD = datetime(2024, 9, 1)
+
+
+# test that an archived payslip can not be replaced
+def test_archive_is_append_only(tmp_path):
+    archive = PayslipArchive(str(tmp_path))
+
+    assert archive.lookup(1, PERIOD, 1) is None
+    assert archive.put(1, PERIOD, 1, b"%PDF-1.4 first", {"salary_data": {"total_salary": 1}}) is True
+    assert archive.put(1, PERIOD, 1, b"%PDF-1.4 second", {"salary_data": {"total_salary": 2}}) is False
+
+    with open(archive.lookup(1, PERIOD, 1), "rb") as pdf_file:
+        assert pdf_file.read() == b"%PDF-1.4 first"
+    with open(archive.inputs_path(1, PERIOD, 1)) as inputs_file:
+        assert json.load(inputs_file) == {"salary_data": {"total_salary": 1}}
+    assert [entry["employee_id"] for entry in archive.index(PERIOD)] == [1]
+    # other months and static values are separate payslips
+    assert archive.lookup(1, datetime(2024, 10, 1), 1) is None
+    assert archive.lookup(1, PERIOD, 2) is None
+
+
+# test that the inputs always belong to the archived PDF, whichever close publishes first
+def test_archive_inputs_follow_pdf(tmp_path):
+    archive = PayslipArchive(str(tmp_path))
+    archive.put(1, PERIOD, 1, b"%PDF-1.4 first", {"salary_data": {"total_salary": 1}})
+
+    # a close that stopped after linking its PDF is not archived yet
+    archive.put(2, PERIOD, 1, b"%PDF-1.4 first", {"salary_data": {"total_salary": 1}})
+    os.remove(archive.inputs_path(2, PERIOD, 1))
+    assert archive.lookup(2, PERIOD, 1) is None
+
+    # a close with another PDF leaves the pair alone, one with the same PDF completes it
+    assert archive.put(2, PERIOD, 1, b"%PDF-1.4 second", {"salary_data": {"total_salary": 2}}) is False
+    assert archive.lookup(2, PERIOD, 1) is None
+    assert archive.put(2, PERIOD, 1, b"%PDF-1.4 first", {"salary_data": {"total_salary": 1}}) is False
+    with open(archive.inputs_path(2, PERIOD, 1)) as inputs_file:
+        assert json.load(inputs_file) == {"salary_data": {"total_salary": 1}}
+    assert archive.lookup(2, PERIOD, 1) == archive.pdf_path(2, PERIOD, 1)
+
+    # a losing close never touches the winner's inputs
+    assert archive.put(1, PERIOD, 1, b"%PDF-1.4 second", {"salary_data": {"total_salary": 2}}) is False
+    with open(archive.inputs_path(1, PERIOD, 1)) as inputs_file:
+        assert json.load(inputs_file) == {"salary_data": {"total_salary": 1}}
+
+
+# test for close_month_control
+@pytest.mark.asyncio
+async def test_close_month_control(tmp_path):
+    employees = [Employee(**get_test_employee_data(1)), Employee(**get_test_employee_data(2))]
+    archive = PayslipArchive(str(tmp_path / "archive"))
+    rendered = []
+
+    async def mock_render(payslips):
+        for employee_id in payslips:
+            rendered.append(employee_id)
+            if employee_id == 2 and rendered.count(2) == 1:
+                yield employee_id, RuntimeError("broken font")
+            else:
+                yield employee_id, f"%PDF-1.4 {employee_id}".encode()
+
+    with patch('src.modules.payroll.payroll_controller.get_static_values', AsyncMock(return_value=get_test_static_values())), \
+         patch('src.modules.payroll.payroll_controller.get_payroll_employees', AsyncMock(return_value=employees)), \
+         patch('src.modules.payroll.payroll_controller.get_reports_by_employee', AsyncMock(return_value={1: get_test_reports(), 2: []})), \
+         patch('src.modules.payroll.payroll_controller.render_salary_pdfs', mock_render), \
+         patch('src.modules.payroll.payroll_controller.payslip_cache', PayslipCache(str(tmp_path / "cache"))), \
+         patch('src.modules.payroll.payroll_controller.payslip_archive', archive):
+        result = await close_month_control(PayrollRunRequest(year=2024, month=9, values_id=1))
+
+        assert result.generated == 1
+        assert result.errors == {2: "Error generating PDF: broken font"}
+
+        # closing again only renders what is missing from the archive
+        result = await close_month_control(PayrollRunRequest(year=2024, month=9, values_id=1))
+
+        assert rendered == [1, 2, 2]
+        assert result.generated == 1
+        assert result.already_archived == 1
+        assert result.output_dir == archive.month_dir(PERIOD)
+
+        response = await get_archived_payslip_control(2, 2024, 9, 1)
+        assert response.path == archive.lookup(2, PERIOD, 1)
+        assert response.media_type == "application/pdf"
+
+        response = await get_archived_payslip_inputs_control(1, 2024, 9, 1)
+        with open(response.path) as inputs_file:
+            inputs = json.load(inputs_file)
+        assert len(inputs["reports"]) == len(get_test_reports())
+        assert inputs["salary_data"]["employee_id"] == 1
+
+
+# test that an open month can not be closed
+@pytest.mark.asyncio
+async def test_close_month_control_month_not_over():
+    now = datetime.now()
+    with patch('src.modules.payroll.payroll_controller.get_static_values', AsyncMock(return_value=get_test_static_values())):
+        with pytest.raises(Exception) as exc_info:
+            await close_month_control(PayrollRunRequest(year=now.year, month=now.month, values_id=1))
+
+        assert exc_info.value.status_code == 400
+
+
+# test that a payslip that was never archived is not found
+@pytest.mark.asyncio
+async def test_get_archived_payslip_not_found(tmp_path):
+    with patch('src.modules.payroll.payroll_controller.payslip_archive', PayslipArchive(str(tmp_path))):
+        with pytest.raises(Exception) as exc_info:
+            await get_archived_payslip_control(1, 2024, 9, 1)
+
+        assert exc_info.value.status_code == 404
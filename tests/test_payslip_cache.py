@@ -0,0 +1,143 @@
+import os
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+from datetime import datetime
+from src.services.payslip_cache import PayslipCache, payslip_content_key
+from src.modules.employees.employees_crud import update_employee
+from src.modules.daily_reports.daily_reports_crud import delete_daily_report
+from src.modules.static_values.static_values_crud import update_static_values
+
+PERIOD = datetime(2024, 9, 1)
+
+
+# Helper function to prepare the inputs of one payslip
+def get_test_inputs():
+    employee = {"id": 1, "name": "John Doe", "tier_type": "A"}
+    reports = [
+        {"_id": "a", "employee_id": 1, "date": datetime(2024, 9, 2), "working_hours": 9},
+        {"_id": "b", "employee_id": 1, "date": datetime(2024, 9, 3), "working_hours": 7},
+    ]
+    static_values = {"_id": "c", "id": 1, "cad": 35}
+    return employee, reports, static_values
+
+
+# Helper function to cache and index one payslip
+def store_payslip(cache, employee_id=1, values_id=1, pdf=b"%PDF-1.4 mock content"):
+    content_key = payslip_content_key(*get_test_inputs(), PERIOD, "v1")
+    cache.put(content_key, pdf)
+    cache.index(employee_id, PERIOD, values_id, "v1", content_key, time.time_ns())
+    return content_key
+
+
+def test_payslip_content_key():
+    employee, reports, static_values = get_test_inputs()
+    key = payslip_content_key(employee, reports, static_values, PERIOD, "v1")
+
+    # Mongo ids and report order do not change the key
+    assert key == payslip_content_key(employee, [dict(r, _id="x") for r in reversed(reports)], static_values, PERIOD, "v1")
+    # any input does
+    assert key != payslip_content_key(employee, reports[:1], static_values, PERIOD, "v1")
+    assert key != payslip_content_key(dict(employee, tier_type="B"), reports, static_values, PERIOD, "v1")
+    assert key != payslip_content_key(employee, reports, dict(static_values, cad=36), PERIOD, "v1")
+    assert key != payslip_content_key(employee, reports, static_values, datetime(2024, 10, 1), "v1")
+    assert key != payslip_content_key(employee, reports, static_values, PERIOD, "v2")
+
+
+def test_lookup_hit_and_miss(tmp_path):
+    cache = PayslipCache(str(tmp_path))
+
+    assert cache.lookup(1, PERIOD, 1, "v1") is None
+    store_payslip(cache)
+    assert cache.lookup(1, PERIOD, 1, "v1") == b"%PDF-1.4 mock content"
+    assert cache.lookup(1, PERIOD, 2, "v1") is None
+    assert cache.lookup(1, datetime(2024, 10, 1), 1, "v1") is None
+    # rendered with another template version
+    assert cache.lookup(1, PERIOD, 1, "v2") is None
+
+
+def test_invalidate_employee(tmp_path):
+    cache = PayslipCache(str(tmp_path))
+    content_key = store_payslip(cache)
+
+    cache.invalidate_employee(1)
+
+    assert cache.lookup(1, PERIOD, 1, "v1") is None
+    # the content addressed PDF stays reusable for identical inputs
+    assert cache.get(content_key) == b"%PDF-1.4 mock content"
+
+
+def test_invalidate_static_values(tmp_path):
+    cache = PayslipCache(str(tmp_path))
+    store_payslip(cache, employee_id=1, values_id=1)
+    store_payslip(cache, employee_id=2, values_id=1)
+    store_payslip(cache, employee_id=2, values_id=2)
+
+    cache.invalidate_static_values(1)
+
+    assert cache.lookup(1, PERIOD, 1, "v1") is None
+    assert cache.lookup(2, PERIOD, 1, "v1") is None
+    assert cache.lookup(2, PERIOD, 2, "v1") is not None
+
+
+def test_index_skipped_after_concurrent_invalidation(tmp_path):
+    cache = PayslipCache(str(tmp_path))
+    content_key = payslip_content_key(*get_test_inputs(), PERIOD, "v1")
+    started_at = time.time_ns()
+    cache.put(content_key, b"%PDF-1.4 stale")
+
+    # a report write lands while the payslip was being rendered
+    cache.invalidate_employee(1)
+    cache.index(1, PERIOD, 1, "v1", content_key, started_at)
+
+    assert cache.lookup(1, PERIOD, 1, "v1") is None
+
+
+def test_lru_eviction(tmp_path):
+    cache = PayslipCache(str(tmp_path), max_bytes=250)
+    cache.put("old", b"x" * 100)
+    cache.put("used", b"y" * 100)
+    os.utime(os.path.join(str(tmp_path), "pdf", "old.pdf"), ns=(1, 1))
+    os.utime(os.path.join(str(tmp_path), "pdf", "used.pdf"), ns=(2, 2))
+    cache.get("used")
+
+    cache.put("new", b"z" * 100)
+
+    assert cache.get("old") is None
+    assert cache.get("used") is not None
+    assert cache.get("new") is not None
+
+
+def test_disabled_cache(tmp_path):
+    cache = PayslipCache(str(tmp_path), max_bytes=0)
+    store_payslip(cache)
+
+    assert cache.lookup(1, PERIOD, 1, "v1") is None
+    assert not os.listdir(str(tmp_path))
+
+
+# writes through the CRUD layer invalidate the cached payslips they affect
+@pytest.mark.asyncio
+async def test_crud_writes_invalidate_cache(tmp_path):
+    cache = PayslipCache(str(tmp_path))
+    mock_collection = MagicMock()
+    mock_collection.find_one_and_update.return_value = None
+    mock_collection.find_one_and_delete.return_value = None
+
+    store_payslip(cache, employee_id=1)
+    with patch('src.modules.employees.employees_crud.employee_collection', mock_collection), \
+         patch('src.modules.employees.employees_crud.payslip_cache', cache):
+        await update_employee(1, {"tier_type": "B"})
+    assert cache.lookup(1, PERIOD, 1, "v1") is None
+
+    store_payslip(cache, employee_id=1)
+    with patch('src.modules.daily_reports.daily_reports_crud.daily_report_collection', mock_collection), \
+         patch('src.modules.daily_reports.daily_reports_crud.payslip_cache', cache):
+        await delete_daily_report(1, datetime(2024, 9, 2))
+    assert cache.lookup(1, PERIOD, 1, "v1") is None
+
+    store_payslip(cache, employee_id=1)
+    with patch('src.modules.static_values.static_values_crud.static_values_collection', mock_collection), \
+         patch('src.modules.static_values.static_values_crud.payslip_cache', cache):
+        await update_static_values(1, {"cad": 36})
+    assert cache.lookup(1, PERIOD, 1, "v1") is None
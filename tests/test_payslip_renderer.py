@@ -0,0 +1,88 @@
+import os
+import shutil
+from unittest.mock import patch
+from src.services.payslip_renderer import SalaryRenderContext, TEMPLATES_DIR, TEMPLATE_NAME, STYLESHEET_NAME, get_render_context
+
+
+# Helper function to copy the real templates into a scratch directory
+def get_test_templates_dir(tmp_path):
+    for name in (TEMPLATE_NAME, STYLESHEET_NAME):
+        shutil.copy(os.path.join(TEMPLATES_DIR, name), tmp_path / name)
+    return str(tmp_path)
+
+
+# Helper function to bump a file's modification time so the context notices the change
+def touch_later(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_render_html():
+    context = SalaryRenderContext()
+
+    html = context.render_html({"name": "John Doe", "total_salary": 4930})
+    assert "Salary Breakdown for John Doe" in html
+    assert "Total Salary =  4930 EGP" in html
+    assert "<style>" not in html
+
+    # previews embed the stylesheet so the page is self contained
+    html = context.render_html({"name": "John Doe"}, inline_stylesheet=True)
+    assert "<style>" in html and "font-family: Arial" in html
+
+
+def test_render_html_escapes_values():
+    context = SalaryRenderContext()
+
+    html = context.render_html({
+        "name": "<script>alert(1)</script>",
+        "deductions_info": 'In Monday 2024-09-02 has -20 deduction for the reason of: <img src=x onerror="alert(1)"><br>In Tuesday 2024-09-03 has -5 deduction for the reason of: late',
+    }, inline_stylesheet=True)
+    assert "<script>" not in html and "&lt;script&gt;alert(1)&lt;/script&gt;" in html
+    assert "<img" not in html and "&lt;img src=x onerror=&#34;alert(1)&#34;&gt;<br>In Tuesday" in html
+    # the stylesheet is not escaped
+    assert "font-family: Arial" in html
+
+
+def test_render_context_is_reused():
+    assert get_render_context() is get_render_context()
+
+
+def test_template_is_compiled_once(tmp_path):
+    context = SalaryRenderContext(get_test_templates_dir(tmp_path))
+
+    assert context.template is context.template
+    with patch("src.services.payslip_renderer.CSS") as mock_css:
+        context.stylesheet
+        context.stylesheet
+        assert mock_css.call_count == 1
+
+
+def test_reload_on_template_change(tmp_path):
+    templates_dir = get_test_templates_dir(tmp_path)
+    context = SalaryRenderContext(templates_dir)
+    version = context.version
+    assert context.version == version
+
+    template_path = tmp_path / TEMPLATE_NAME
+    template_path.write_text(template_path.read_text().replace("Total Salary", "Net Salary"))
+    touch_later(template_path)
+
+    assert context.version != version
+    assert "Net Salary" in context.render_html({"name": "John Doe"})
+
+
+def test_reload_on_stylesheet_change(tmp_path):
+    templates_dir = get_test_templates_dir(tmp_path)
+    context = SalaryRenderContext(templates_dir)
+    version = context.version
+
+    with patch("src.services.payslip_renderer.CSS") as mock_css:
+        context.stylesheet
+        stylesheet_path = tmp_path / STYLESHEET_NAME
+        stylesheet_path.write_text("p { color: red; }")
+        touch_later(stylesheet_path)
+        context.stylesheet
+
+        assert mock_css.call_count == 2
+        assert context.stylesheet_text == "p { color: red; }"
+    assert context.version != version
@@ -0,0 +1,166 @@
+import pytest
+from unittest.mock import patch
+from datetime import datetime
+from mongomock import MongoClient
+from src.modules.daily_reports.report_buckets_crud import apply_bucket_changes, drop_report_buckets, get_bucket_reports, rebuild_report_buckets
+from src.modules.payroll.payroll_crud import get_reports_by_employee
+from tests.test_payroll import get_test_report, get_test_reports
+
+
+# Helper function to create mongomock collections for the reports and their buckets
+def get_mock_collections():
+    mock_db = MongoClient()['test_db']
+    return mock_db['daily_report'], mock_db['daily_report_buckets']
+
+
+def without_ids(reports):
+    return [{field: value for field, value in report.items() if field != "_id"} for report in reports]
+
+
+# test that report writes keep one date sorted bucket per employee and month
+@pytest.mark.asyncio
+async def test_apply_bucket_changes(monkeypatch):
+    monkeypatch.setenv("DAILY_REPORT_STORAGE", "bucket")
+    _, bucket_collection = get_mock_collections()
+    reports = get_test_reports()
+
+    with patch('src.modules.daily_reports.report_buckets_crud.daily_report_bucket_collection', bucket_collection):
+        await apply_bucket_changes((None, report) for report in reversed(reports))
+        assert bucket_collection.count_documents({}) == 1
+        bucket = bucket_collection.find_one({"employee_id": 1, "year": 2024, "month": 9})
+        assert [day["date"].day for day in bucket["days"]] == [2, 3, 4, 7]
+        assert "employee_id" not in bucket["days"][0]
+
+        # an update replaces the day, a move to another month moves it to that bucket
+        await apply_bucket_changes([(reports[0], dict(reports[0], working_hours=5))])
+        await apply_bucket_changes([(reports[1], dict(reports[1], date=datetime(2024, 10, 1)))])
+        await apply_bucket_changes([(reports[2], None)])
+
+        grouped = await get_bucket_reports([1, 2], datetime(2024, 9, 1), datetime(2024, 11, 1))
+        assert [(report["date"], report["working_hours"]) for report in grouped[1]] == [
+            (datetime(2024, 9, 2), 5), (datetime(2024, 9, 7), 6), (datetime(2024, 10, 1), 11)]
+        assert grouped[2] == []
+
+
+# test that nothing is written to the buckets with the default storage
+@pytest.mark.asyncio
+async def test_apply_bucket_changes_disabled(monkeypatch):
+    monkeypatch.delenv("DAILY_REPORT_STORAGE", raising=False)
+    _, bucket_collection = get_mock_collections()
+
+    with patch('src.modules.daily_reports.report_buckets_crud.daily_report_bucket_collection', bucket_collection):
+        await apply_bucket_changes([(None, get_test_report(2))])
+    assert bucket_collection.count_documents({}) == 0
+
+
+# test that the migration builds the buckets the writes would have built, and monthly reads match the documents
+@pytest.mark.asyncio
+async def test_rebuild_report_buckets(monkeypatch):
+    report_collection, bucket_collection = get_mock_collections()
+    reports = get_test_reports() + [dict(get_test_report(3), employee_id=2), dict(get_test_report(1), date=datetime(2024, 10, 1))]
+    report_collection.insert_many([dict(report) for report in reports])
+
+    with patch('src.modules.daily_reports.report_buckets_crud.daily_report_collection', report_collection), \
+         patch('src.modules.daily_reports.report_buckets_crud.daily_report_bucket_collection', bucket_collection), \
+         patch('src.modules.payroll.payroll_crud.daily_report_collection', report_collection), \
+         patch('src.modules.payroll.payroll_crud.get_bucket_reports', get_bucket_reports):
+        assert await rebuild_report_buckets() == 3
+        assert await rebuild_report_buckets(2024, 9) == 2
+        assert bucket_collection.count_documents({}) == 3
+
+        from_documents = await get_reports_by_employee([1, 2], datetime(2024, 9, 1), datetime(2024, 10, 1))
+        monkeypatch.setenv("DAILY_REPORT_STORAGE", "bucket")
+        from_buckets = await get_reports_by_employee([1, 2], datetime(2024, 9, 1), datetime(2024, 10, 1))
+        assert {employee_id: without_ids(reports) for employee_id, reports in from_buckets.items()} == \
+               {employee_id: without_ids(reports) for employee_id, reports in from_documents.items()}
+        assert len(from_buckets[1]) == 4
+
+    report_collection.drop()
+    bucket_collection.drop()
+
+
+# a report collection where another worker inserts a report right before the next aggregation reads,
+# its bucket change is left to the test
+class InsertBeforeAggregate:
+
+    def __init__(self, collection, report):
+        self.collection = collection
+        self.report = report
+
+    def aggregate(self, pipeline):
+        if self.report is not None:
+            report, self.report = self.report, None
+            self.collection.insert_one(dict(report))
+        return self.collection.aggregate(pipeline)
+
+
+# test that a report a rebuild already put in its bucket is not added a second time by its write
+@pytest.mark.asyncio
+async def test_rebuild_report_buckets_with_late_write(monkeypatch):
+    monkeypatch.setenv("DAILY_REPORT_STORAGE", "bucket")
+    report_collection, bucket_collection = get_mock_collections()
+    report_collection.drop()
+    bucket_collection.drop()
+    bucket_collection.create_index([("employee_id", 1), ("year", 1), ("month", 1)], unique=True)
+    reports = get_test_reports()
+    report_collection.insert_many([dict(report) for report in reports])
+    late_report = get_test_report(10, working_hours=5)
+
+    with patch('src.modules.daily_reports.report_buckets_crud.daily_report_collection', InsertBeforeAggregate(report_collection, late_report)), \
+         patch('src.modules.daily_reports.report_buckets_crud.daily_report_bucket_collection', bucket_collection):
+        await apply_bucket_changes((None, report) for report in reports)
+        await rebuild_report_buckets(2024, 9)
+        # the writer's bucket change lands after the rebuild wrote the bucket
+        await apply_bucket_changes([(None, late_report)])
+
+        grouped = await get_bucket_reports([1], datetime(2024, 9, 1), datetime(2024, 10, 1))
+        assert [report["date"].day for report in grouped[1]] == [2, 3, 4, 7, 10]
+
+    report_collection.drop()
+    bucket_collection.drop()
+
+
+# a report collection whose aggregate lets a report write land right after the reports were read
+class WriteDuringAggregate:
+
+    def __init__(self, collection, bucket_collection, report):
+        self.collection = collection
+        self.bucket_collection = bucket_collection
+        self.report = report
+
+    def aggregate(self, pipeline):
+        groups = list(self.collection.aggregate(pipeline))
+        if self.report is not None:
+            report, self.report = self.report, None
+            self.collection.insert_one(dict(report))
+            query = {"employee_id": report["employee_id"], "year": report["date"].year, "month": report["date"].month}
+            day = {field: value for field, value in report.items() if field != "employee_id"}
+            self.bucket_collection.update_one(query, {"$push": {"days": {"$each": [day], "$sort": {"date": 1}}}, "$inc": {"version": 1}}, upsert=True)
+        return groups
+
+
+# test that a report written while a rebuild runs is kept in its bucket, and that the buckets can be dropped
+@pytest.mark.asyncio
+async def test_rebuild_report_buckets_with_concurrent_write(monkeypatch):
+    monkeypatch.setenv("DAILY_REPORT_STORAGE", "bucket")
+    report_collection, bucket_collection = get_mock_collections()
+    report_collection.drop()
+    bucket_collection.drop()
+    bucket_collection.create_index([("employee_id", 1), ("year", 1), ("month", 1)], unique=True)
+    reports = get_test_reports()
+    report_collection.insert_many([dict(report) for report in reports])
+    late_report = get_test_report(10, working_hours=5)
+
+    with patch('src.modules.daily_reports.report_buckets_crud.daily_report_collection', WriteDuringAggregate(report_collection, bucket_collection, late_report)), \
+         patch('src.modules.daily_reports.report_buckets_crud.daily_report_bucket_collection', bucket_collection):
+        await apply_bucket_changes((None, report) for report in reports)
+        await rebuild_report_buckets(2024, 9)
+
+        grouped = await get_bucket_reports([1], datetime(2024, 9, 1), datetime(2024, 10, 1))
+        assert [report["date"].day for report in grouped[1]] == [2, 3, 4, 7, 10]
+        assert bucket_collection.count_documents({}) == 1
+
+        await drop_report_buckets()
+        assert bucket_collection.count_documents({}) == 0
+
+    report_collection.drop()
@@ -0,0 +1,201 @@
+import pytest
+from unittest.mock import patch
+from datetime import datetime
+from mongomock import MongoClient
+from src.modules.rollups.rollups_crud import apply_report_delta, get_rollup, get_rollups, rebuild_rollups
+from src.shared.documents import new_write_id
+from src.modules.rollups.rollups_controller import get_rollup_drift_control, rebuild_rollups_control
+from src.services.payroll import ReportColumns, report_totals
+from tests.test_payroll import get_test_report, get_test_reports
+
+
+# Helper function to create mongomock collections for the reports and the rollups
+def get_mock_collections():
+    mock_db = MongoClient()['test_db']
+    return mock_db['daily_reports'], mock_db['monthly_rollups']
+
+
+# test that create, update and delete deltas keep the rollup equal to the reports
+@pytest.mark.asyncio
+async def test_apply_report_delta():
+    _, rollup_collection = get_mock_collections()
+    reports = get_test_reports()
+
+    with patch('src.modules.rollups.rollups_crud.monthly_rollup_collection', rollup_collection):
+        for report in reports:
+            await apply_report_delta(None, report)
+        rollup = await get_rollup(1, 2024, 9)
+        assert rollup.model_dump(exclude={"employee_id", "year", "month"}) == ReportColumns.from_reports(reports).totals().model_dump()
+
+        # an update only applies its difference
+        updated = dict(reports[0], working_hours=5)
+        await apply_report_delta(reports[0], updated)
+        rollup = await get_rollup(1, 2024, 9)
+        assert rollup.model_dump(exclude={"employee_id", "year", "month"}) == ReportColumns.from_reports([updated] + reports[1:]).totals().model_dump()
+
+        # a delete takes the report out again
+        await apply_report_delta(updated, None)
+        rollup = await get_rollup(1, 2024, 9)
+        assert rollup.report_count == len(reports) - 1
+        assert rollup.missing_hours == ReportColumns.from_reports(reports[1:]).totals().missing_hours
+
+
+# test that moving a report to another month moves its contribution
+@pytest.mark.asyncio
+async def test_apply_report_delta_moves_month():
+    _, rollup_collection = get_mock_collections()
+    report = get_test_report(2)
+
+    with patch('src.modules.rollups.rollups_crud.monthly_rollup_collection', rollup_collection):
+        await apply_report_delta(None, report)
+        await apply_report_delta(report, dict(report, date=datetime(2024, 10, 1)))
+
+        september = await get_rollups(2024, 9, [1])
+        october = await get_rollups(2024, 10, [1])
+        assert september[1].report_count == 0
+        assert october[1].report_count == 1
+
+
+# test that a rebuild from the raw reports matches the incremental rollups
+@pytest.mark.asyncio
+async def test_rebuild_rollups():
+    report_collection, rollup_collection = get_mock_collections()
+    reports = get_test_reports() + [dict(get_test_report(3), employee_id=2), get_test_report(1) | {"date": datetime(2024, 10, 1)}]
+    report_collection.insert_many([dict(report) for report in reports])
+
+    with patch('src.modules.rollups.rollups_crud.daily_report_collection', report_collection), \
+         patch('src.modules.rollups.rollups_crud.monthly_rollup_collection', rollup_collection):
+        for report in reports:
+            await apply_report_delta(None, report)
+        incremental = await get_rollups(2024, 9, [1, 2, 3])
+
+        rollup_collection.drop()
+        assert await rebuild_rollups() == 3
+        assert await get_rollups(2024, 9, [1, 2, 3]) == incremental
+        assert (await get_rollups(2024, 10, [1]))[1].report_count == 1
+
+        # a single month rebuild leaves the other months alone
+        assert await rebuild_rollups(2024, 9) == 2
+        assert rollup_collection.count_documents({}) == 3
+
+
+# Report collection whose next aggregation returns what it read, then lets another
+# worker write a report (and its rollup $inc) before the rebuild writes its results
+class WriteDuringAggregate:
+
+    def __init__(self, collection, rollup_collection, report):
+        self.collection = collection
+        self.rollup_collection = rollup_collection
+        self.report = report
+
+    def aggregate(self, pipeline):
+        groups = list(self.collection.aggregate(pipeline))
+        if self.report is not None:
+            report, self.report = self.report, None
+            self.collection.insert_one(dict(report))
+            query = {"employee_id": report["employee_id"], "year": report["date"].year, "month": report["date"].month}
+            self.rollup_collection.update_one(query, {"$inc": {**report_totals(report), "version": 1}}, upsert=True)
+        return groups
+
+
+# test that a report written while a rebuild runs is neither lost nor counted twice
+@pytest.mark.asyncio
+async def test_rebuild_rollups_with_concurrent_write():
+    report_collection, rollup_collection = get_mock_collections()
+    report_collection.drop()
+    rollup_collection.drop()
+    rollup_collection.create_index([("year", 1), ("month", 1), ("employee_id", 1)], unique=True)
+    reports = get_test_reports()
+    report_collection.insert_many([dict(report) for report in reports])
+    late_report = get_test_report(10, working_hours=5)
+
+    with patch('src.modules.rollups.rollups_crud.daily_report_collection', WriteDuringAggregate(report_collection, rollup_collection, late_report)), \
+         patch('src.modules.rollups.rollups_crud.monthly_rollup_collection', rollup_collection):
+        for report in reports:
+            await apply_report_delta(None, report)
+        await rebuild_rollups(2024, 9)
+
+        rollup = await get_rollup(1, 2024, 9)
+        assert rollup.model_dump(exclude={"employee_id", "year", "month"}) == ReportColumns.from_reports(reports + [late_report]).totals().model_dump()
+        assert rollup_collection.count_documents({}) == 1
+
+    rollup_collection.drop()
+
+
+# Report collection where another worker inserts a report right before the next aggregation reads,
+# its rollup delta is left to the test
+class InsertBeforeAggregate:
+
+    def __init__(self, collection, report):
+        self.collection = collection
+        self.report = report
+
+    def aggregate(self, pipeline):
+        if self.report is not None:
+            report, self.report = self.report, None
+            self.collection.insert_one(dict(report))
+        return self.collection.aggregate(pipeline)
+
+
+# test that the delta of a report a rebuild already aggregated is not applied a second time
+@pytest.mark.asyncio
+async def test_rebuild_rollups_with_late_delta():
+    report_collection, rollup_collection = get_mock_collections()
+    report_collection.drop()
+    rollup_collection.drop()
+    rollup_collection.create_index([("year", 1), ("month", 1), ("employee_id", 1)], unique=True)
+    reports = [dict(report, write_id=new_write_id()) for report in get_test_reports()]
+    report_collection.insert_many([dict(report) for report in reports])
+    late_report = dict(get_test_report(10, working_hours=5), write_id=new_write_id())
+
+    with patch('src.modules.rollups.rollups_crud.daily_report_collection', InsertBeforeAggregate(report_collection, late_report)), \
+         patch('src.modules.rollups.rollups_crud.monthly_rollup_collection', rollup_collection):
+        for report in reports:
+            await apply_report_delta(None, report)
+        await rebuild_rollups(2024, 9)
+        # the writer's delta lands after the rebuild wrote the rollup
+        await apply_report_delta(None, late_report)
+
+        rollup = await get_rollup(1, 2024, 9)
+        assert rollup.report_count == len(reports) + 1
+        assert rollup.model_dump(exclude={"employee_id", "year", "month"}) == ReportColumns.from_reports(reports + [late_report]).totals().model_dump()
+
+        # later writes of the report keep applying
+        updated = dict(late_report, working_hours=9, write_id=new_write_id())
+        await apply_report_delta(late_report, updated)
+        await apply_report_delta(updated, None)
+        assert (await get_rollup(1, 2024, 9)).report_count == len(reports)
+
+    rollup_collection.drop()
+    report_collection.drop()
+
+
+# test for rebuild_rollups_control with only one of year and month
+@pytest.mark.asyncio
+async def test_rebuild_rollups_control_requires_year_and_month():
+    with pytest.raises(Exception) as exc_info:
+        await rebuild_rollups_control(2024, None)
+
+    assert exc_info.value.status_code == 400
+
+
+# test that the drift check finds rollups that no longer match the reports
+@pytest.mark.asyncio
+async def test_get_rollup_drift_control():
+    report_collection, rollup_collection = get_mock_collections()
+    report_collection.drop()
+    rollup_collection.drop()
+    reports = get_test_reports() + [dict(get_test_report(3), employee_id=2)]
+    report_collection.insert_many([dict(report) for report in reports])
+
+    # rollups_crud imports payroll_crud as modules.payroll.payroll_crud
+    with patch('modules.payroll.payroll_crud.daily_report_collection', report_collection), \
+         patch('src.modules.rollups.rollups_crud.monthly_rollup_collection', rollup_collection):
+        for report in reports:
+            await apply_report_delta(None, report)
+        assert await get_rollup_drift_control(2024, 9) == {"year": 2024, "month": 9, "checked": 2, "drifted": []}
+
+        # a report written behind the rollups and a rollup without reports
+        report_collection.insert_one(dict(get_test_report(5), employee_id=2))
+        rollup_collection.insert_one({"employee_id": 3, "year": 2024, "month": 9, "report_count": 1})
+        assert await get_rollup_drift_control(2024, 9) == {"year": 2024, "month": 9, "checked": 3, "drifted": [2, 3]}
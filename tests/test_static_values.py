@@ -1,13 +1,15 @@
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, patch, AsyncMock
+from datetime import datetime
 from mongomock import MongoClient
 from src.main import app
 from src.modules.static_values.static_values_controller import create_static_values_control, delete_static_values_control, get_static_values_control, update_static_values_control
 from src.shared.models_schemas.models import StaticValues
-from src.modules.static_values.static_values_crud import create_static_values, delete_static_values, get_static_values, update_static_values
+from src.modules.static_values.static_values_crud import create_static_values, create_static_values_version, delete_static_values, get_static_values, get_static_values_as_of, update_static_values
 from src.shared.models_schemas.schemas import StaticValuesCreate, StaticValuesResponse
 from src.modules.auth.authentication import create_access_token
+from src.services.static_values_cache import StaticValuesCache
 
 client = TestClient(app)
 
@@ -274,7 +276,8 @@ async def test_update_static_values_endpoint():
     update_data = {"cad": 40}
 
     # Mock the update_static_values_control function to return a test static_values
-    with patch('src.modules.static_values.static_values_controller.update_static_values_control', AsyncMock(return_value=test_static_values)):
+    # (the router imported by the app is modules.static_values.static_values_router)
+    with patch('modules.static_values.static_values_router.update_static_values_control', AsyncMock(return_value=test_static_values)):
         # Patch the authorization dependency to always return a valid user
         with patch('src.modules.auth.authorizations.get_superadmin', return_value={"email": "admin@example.com", "role": "superadmin"}):
             # Create a mock token for the authenticated user
@@ -308,8 +311,8 @@ async def test_delete_static_values():
     # Patch the static_values_collection used in delete_static_values
     with patch('src.modules.static_values.static_values_crud.static_values_collection', mock_collection):
         
-        # Mock the delete_one method to return result including successful deletion
-        mock_collection.delete_one.return_value = True
+        # Mock the find_one_and_delete method to return the deleted document
+        mock_collection.find_one_and_delete.return_value = get_test_static_values_data()
         
         # Call the function
         result = await delete_static_values(static_values_id)
@@ -319,8 +322,8 @@ async def test_delete_static_values():
     # Patch the static_values_collection used in delete_static_values
     with patch('src.modules.static_values.static_values_crud.static_values_collection', mock_collection):
         
-        # Mock the delete_one method to return result including successful deletion
-        mock_collection.delete_one.return_value = False
+        # Mock the find_one_and_delete method to find nothing to delete
+        mock_collection.find_one_and_delete.return_value = None
         
         # Call the function
         result = await delete_static_values(99)
@@ -348,8 +351,11 @@ async def test_delete_static_values_endpoint():
     # Prepare test data
     static_values_id = 1
     
-    # Patch delete_static_values_control
-    with patch('src.modules.static_values.static_values_controller.delete_static_values_control', return_value=True):
+    mock_collection = MagicMock()
+    mock_collection.find_one_and_delete.return_value = get_test_static_values_data()
+
+    # Patch the collection the endpoint deletes from
+    with patch('modules.static_values.static_values_crud.static_values_collection', mock_collection):
         # Patch the authorization dependency to always return a valid user
         
         with patch('src.modules.auth.authorizations.get_superadmin', return_value={"email": "admin@example.com", "role": "superadmin"}):
@@ -363,4 +369,157 @@ async def test_delete_static_values_endpoint():
             )
             # Assertions
             assert response.status_code == 200
-            assert response.json() is True
\ No newline at end of file
+            assert response.json() is True
+
+# test that get_static_values reads through the cache and writes invalidate it
+@pytest.mark.asyncio
+async def test_get_static_values_cached():
+    test_static_values_data = get_test_static_values_data()
+    mock_collection = MagicMock()
+    mock_collection.find_one.return_value = test_static_values_data
+    mock_collection.find_one_and_update.return_value = test_static_values_data
+
+    with patch('src.modules.static_values.static_values_crud.static_values_collection', mock_collection), \
+         patch('src.modules.static_values.static_values_crud.static_values_cache', StaticValuesCache()):
+        first = await get_static_values(1)
+        assert await get_static_values(1) is first
+        await get_static_values(999)
+        assert mock_collection.find_one.call_count == 2
+
+        await update_static_values(1, {"cad": 40})
+        await get_static_values(1)
+        assert mock_collection.find_one.call_count == 3
+
+
+# test that a cache notices the writes of another worker through the shared version
+@pytest.mark.asyncio
+async def test_static_values_cache_version_check():
+    mock_db = MongoClient()['test_db']
+    this_worker = StaticValuesCache(version_interval=0)
+    other_worker = StaticValuesCache(version_interval=0)
+    loader = AsyncMock(return_value=StaticValues(**get_test_static_values_data()))
+
+    with patch('services.cache_version.cache_version_collection', mock_db['cache_versions']):
+        await this_worker.get(1, loader)
+        await this_worker.get(1, loader)
+        assert loader.await_count == 1
+
+        await other_worker.changed()
+        await this_worker.get(1, loader)
+        assert loader.await_count == 2
+
+        # with a longer interval the version is not read again and the entry is kept
+        this_worker.version_interval = 60
+        await other_worker.changed()
+        await this_worker.get(1, loader)
+        assert loader.await_count == 2
+
+    mock_db['cache_versions'].drop()
+
+
+# test that a new version closes the open one and that dates resolve to the version in force
+@pytest.mark.asyncio
+async def test_static_values_versions():
+    mock_db = MongoClient()['test_db']
+    mock_collection = mock_db['static_values']
+    # a document written before versions existed
+    mock_collection.insert_one(get_test_static_values_data())
+
+    with patch('src.modules.static_values.static_values_crud.static_values_collection', mock_collection), \
+         patch('src.modules.static_values.static_values_crud.static_values_cache', StaticValuesCache()), \
+         patch('services.cache_version.cache_version_collection', mock_db['cache_versions']):
+        september = StaticValues(**get_test_static_values_data() | {"id": 2, "cad": 40, "effective_from": datetime(2024, 9, 1)})
+        october = StaticValues(**get_test_static_values_data() | {"id": 3, "cad": 45, "effective_from": datetime(2024, 10, 1)})
+        assert await create_static_values_version(september) == september
+        assert await create_static_values_version(october) == october
+
+        assert (await get_static_values_as_of(datetime(2024, 8, 31))).id == 1
+        assert (await get_static_values_as_of(datetime(2024, 9, 15))).id == 2
+        assert (await get_static_values_as_of(datetime(2024, 10, 1))).id == 3
+        assert mock_collection.find_one({"id": 1})["effective_to"] == datetime(2024, 9, 1)
+        assert mock_collection.find_one({"id": 2})["effective_to"] == datetime(2024, 10, 1)
+        assert mock_collection.find_one({"id": 3})["effective_to"] is None
+
+        # a version may not start before the latest one
+        backdated = StaticValues(**get_test_static_values_data() | {"id": 4, "effective_from": datetime(2024, 9, 15)})
+        assert await create_static_values_version(backdated) is None
+        assert mock_collection.count_documents({}) == 3
+
+
+# test that a resolved version serves every date of its range without another load
+@pytest.mark.asyncio
+async def test_static_values_cache_as_of():
+    mock_db = MongoClient()['test_db']
+    cache = StaticValuesCache()
+    september = StaticValues(**get_test_static_values_data() | {"effective_from": datetime(2024, 9, 1), "effective_to": datetime(2024, 10, 1)})
+    loader = AsyncMock(return_value=(september, september.effective_from, september.effective_to))
+
+    with patch('services.cache_version.cache_version_collection', mock_db['cache_versions']):
+        for day in range(1, 31):
+            assert await cache.as_of(datetime(2024, 9, day), loader) is september
+        assert loader.await_count == 1
+
+        await cache.as_of(datetime(2024, 10, 1), loader)
+        assert loader.await_count == 2
+
+
+# test that a date resolves to the same version with a warm and a cold cache
+@pytest.mark.asyncio
+async def test_static_values_as_of_warm_and_cold():
+    mock_db = MongoClient()['test_db']
+    mock_collection = mock_db['static_values']
+    mock_collection.drop()
+    mock_collection.insert_one(get_test_static_values_data() | {"effective_from": datetime(2024, 1, 1)})
+    # an undated document next to a version, it is only in force before the version starts
+    mock_collection.insert_one(get_test_static_values_data() | {"id": 2})
+
+    with patch('src.modules.static_values.static_values_crud.static_values_collection', mock_collection), \
+         patch('services.cache_version.cache_version_collection', mock_db['cache_versions']):
+        with patch('src.modules.static_values.static_values_crud.static_values_cache', StaticValuesCache()):
+            assert (await get_static_values_as_of(datetime(2023, 6, 1))).id == 2
+            warm = await get_static_values_as_of(datetime(2024, 6, 1))
+        with patch('src.modules.static_values.static_values_crud.static_values_cache', StaticValuesCache()):
+            cold = await get_static_values_as_of(datetime(2024, 6, 1))
+        assert warm.id == cold.id == 1
+
+    mock_collection.drop()
+    mock_db['cache_versions'].drop()
+
+
+# test that only a version starting later, or a document without effective dates, can be updated
+@pytest.mark.asyncio
+async def test_update_static_values_in_force():
+    mock_db = MongoClient()['test_db']
+    mock_collection = mock_db['static_values']
+    mock_collection.drop()
+    mock_collection.insert_one(get_test_static_values_data() | {"effective_from": datetime(2024, 1, 1)})
+    mock_collection.insert_one(get_test_static_values_data() | {"id": 2, "effective_from": datetime(2999, 1, 1)})
+    undated = get_test_static_values_data() | {"id": 3}
+    undated.pop("effective_from", None)
+    mock_collection.insert_one(undated)
+    mock_collection.insert_one(get_test_static_values_data() | {"id": 4, "effective_from": None})
+
+    with patch('src.modules.static_values.static_values_crud.static_values_collection', mock_collection), \
+         patch('src.modules.static_values.static_values_crud.static_values_cache', StaticValuesCache()), \
+         patch('services.cache_version.cache_version_collection', mock_db['cache_versions']):
+        with pytest.raises(Exception) as exc_info:
+            await update_static_values_control(1, {"cad": 40})
+        assert exc_info.value.status_code == 409
+        assert mock_collection.find_one({"id": 1})["cad"] == 35.66
+
+        assert (await update_static_values_control(2, {"cad": 40})).cad == 40
+        # legacy documents, without the field or with it unset
+        assert (await update_static_values_control(3, {"cad": 40})).cad == 40
+        assert (await update_static_values_control(4, {"cad": 40})).cad == 40
+        assert mock_collection.find_one({"id": 3})["cad"] == 40
+
+        with pytest.raises(Exception) as exc_info:
+            await update_static_values_control(2, {"effective_from": "2024-01-01"})
+        assert exc_info.value.status_code == 400
+
+        with pytest.raises(Exception) as exc_info:
+            await update_static_values_control(999, {"cad": 40})
+        assert exc_info.value.status_code == 404
+
+    mock_collection.drop()
+    mock_db['cache_versions'].drop()